@@ -98,6 +98,32 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Coût du hachage des mots de passe (PBKDF2-SHA256, api/hashers.py). Chaque connexion
+# coûte un hachage complet : à ajuster selon le nombre de workers et les pics de connexion.
+# Les mots de passe existants sont re-hachés avec ce coût à leur prochaine connexion.
+PASSWORD_HASH_ITERATIONS = int(getenv('PASSWORD_HASH_ITERATIONS', '1000000'))
+PASSWORD_HASHERS = [
+    'api.hashers.ConfigurablePBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'simple': {'format': '{asctime} {levelname} {name} {message}', 'style': '{'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'simple'},
+    },
+    'loggers': {
+        'api': {'handlers': ['console'], 'level': getenv('API_LOG_LEVEL', 'INFO'), 'propagate': False},
+    },
+}
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/
@@ -145,8 +171,70 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'api.authentication.CustomJWTAuthentication',
     ),
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
-    'PAGE_SIZE': 4,
+    # Taille ajustable par requête avec ?page_size= (ou pour toutes les listes avec la variable
+    # PAGE_SIZE, 4 par défaut comme avant) ; ?pagination=cursor active la pagination par
+    # curseur sur les bons, factures, transactions et transferts (api/pagination.py)
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.StandardPagination',
+    'PAGE_SIZE': int(getenv('PAGE_SIZE', '4')),
+}
+
+# Numérotation des documents (api/sequences.py) : nombre de numéros réservés
+# d'un coup par worker. 1 = numéros strictement consécutifs.
+DOCUMENT_SEQUENCE_BLOCK_SIZE = int(getenv('DOCUMENT_SEQUENCE_BLOCK_SIZE', '1'))
+
+# Exports différés (api/exports.py, manage.py run_export_worker) : fichiers produits,
+# nombre de processus de rendu et durée de conservation des fichiers terminés
+EXPORTS_ROOT = Path(getenv('EXPORTS_ROOT', BASE_DIR / 'exports'))
+EXPORT_WORKER_PROCESSES = int(getenv('EXPORT_WORKER_PROCESSES', '2'))
+EXPORT_RETENTION_HOURS = int(getenv('EXPORT_RETENTION_HOURS', '24'))
+# Un rendu 'running' depuis plus longtemps est considéré comme perdu (worker arrêté)
+EXPORT_JOB_TIMEOUT_MINUTES = int(getenv('EXPORT_JOB_TIMEOUT_MINUTES', '30'))
+EXPORT_JOB_MAX_ATTEMPTS = 3
+
+# Cache disque des PDF de factures (clé : facture + empreinte du contexte et du template).
+# Les fichiers les moins récemment servis sont supprimés au-delà de la taille maximale
+# (maintenance périodique du worker d'exports, toutes les minutes).
+INVOICE_PDF_CACHE_ROOT = Path(getenv('INVOICE_PDF_CACHE_ROOT', EXPORTS_ROOT / 'invoices'))
+INVOICE_PDF_CACHE_MAX_MB = int(getenv('INVOICE_PDF_CACHE_MAX_MB', '200'))
+# Pré-rendu du PDF par le worker d'exports à la création de chaque facture
+INVOICE_PDF_PRERENDER = getenv('INVOICE_PDF_PRERENDER', 'True') == 'True'
+# Impression de factures par lot : nombre maximal de factures d'un lot
+INVOICE_BATCH_MAX = int(getenv('INVOICE_BATCH_MAX', '5000'))
+
+# Cache des utilisateurs authentifiés par JWT (api/cache.py) : durée de vie en secondes
+# (0 pour désactiver) et nombre maximal d'entrées par processus
+AUTH_USER_CACHE_TTL = int(getenv('AUTH_USER_CACHE_TTL', '60'))
+AUTH_USER_CACHE_SIZE = int(getenv('AUTH_USER_CACHE_SIZE', '2048'))
+# Mode "claims" : les tokens portent store_id, is_staff et la version de l'état du store ;
+# les requêtes en lecture sont authentifiées sans base de données tant que cette version
+# est à jour. Nécessite un cache partagé entre workers (REDIS_CACHE_URL) : refusé au démarrage
+# avec le cache mémoire local (api/checks.py).
+JWT_STATELESS_CLAIMS = getenv('JWT_STATELESS_CLAIMS', 'False') == 'True'
+
+# Cache des données de référence par store (comptes, entrepôts, fournisseurs ; api/cache.py) :
+# mémoire locale par processus, ou fichiers partagés par les workers d'une même machine
+# avec REFERENCE_CACHE_DIR. Durée de vie en secondes (0 pour désactiver). Actif seulement si
+# REDIS_CACHE_URL ou REFERENCE_CACHE_DIR est défini : ses versions doivent être vues par tous les workers.
+REFERENCE_CACHE_DIR = getenv('REFERENCE_CACHE_DIR')
+REFERENCE_CACHE_TTL = int(getenv('REFERENCE_CACHE_TTL', '300'))
+# Cache par défaut (versions d'authentification, tokens révoqués) : partagé par tous les
+# workers avec REDIS_CACHE_URL (paquet redis requis), sinon mémoire locale par processus
+REDIS_CACHE_URL = getenv('REDIS_CACHE_URL')
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_CACHE_URL,
+    } if REDIS_CACHE_URL else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'reference': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': REFERENCE_CACHE_DIR,
+    } if REFERENCE_CACHE_DIR else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'reference',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
 }
 
 DJOSER = {
@@ -2,8 +2,10 @@ from django.contrib import admin
 from unfold.admin import ModelAdmin
 from .models import (
     User, Store, Warehouse, Employee, Supplier, Customer, Product, ProductStock,
-    StockEntry, StockEntryItem, StockExit, StockExitItem, Invoice, Account, FinancialTransaction
+    StockEntry, StockEntryItem, StockExit, StockExitItem, Invoice, Account, FinancialTransaction,
+    DocumentSequence, ExportJob
 )
+from .totals import deferred_totals
 
 
 # Configuration Admin pour Store
@@ -84,6 +86,14 @@ class AccountAdmin(ModelAdmin):
     readonly_fields = ['created_at']
 
 
+class DeferredTotalsMixin:
+    """Articles enregistrés depuis l'admin : un seul recalcul du total du bon (voir api/totals.py)"""
+    
+    def save_related(self, request, form, formsets, change):
+        with deferred_totals():
+            super().save_related(request, form, formsets, change)
+
+
 # Inline pour les articles des bons d'entrée
 class StockEntryItemInline(admin.TabularInline):
     model = StockEntryItem
@@ -93,9 +103,9 @@ class StockEntryItemInline(admin.TabularInline):
 
 # Configuration Admin pour StockEntry
 @admin.register(StockEntry)
-class StockEntryAdmin(ModelAdmin):
+class StockEntryAdmin(DeferredTotalsMixin, ModelAdmin):
     list_display = ['entry_number', 'supplier', 'warehouse', 'total_amount', 'created_at']
-    list_filter = ['warehouse__store', 'warehouse', 'supplier', 'created_at']
+    list_filter = ['store', 'warehouse', 'supplier', 'created_at']
     search_fields = ['entry_number', 'supplier__name']
     readonly_fields = ['entry_number', 'total_amount', 'created_at']
     inlines = [StockEntryItemInline]
@@ -111,9 +121,9 @@ class StockExitItemInline(admin.TabularInline):
 
 # Configuration Admin pour StockExit
 @admin.register(StockExit)
-class StockExitAdmin(ModelAdmin):
+class StockExitAdmin(DeferredTotalsMixin, ModelAdmin):
     list_display = ['exit_number', 'get_customer_name', 'warehouse', 'total_amount', 'created_at']
-    list_filter = ['warehouse__store', 'warehouse', 'created_at']
+    list_filter = ['store', 'warehouse', 'created_at']
     search_fields = ['exit_number', 'customer__name', 'customer_name']
     readonly_fields = ['exit_number', 'total_amount', 'created_at']
     inlines = [StockExitItemInline]
@@ -128,7 +138,7 @@ class StockExitAdmin(ModelAdmin):
 @admin.register(Invoice)
 class InvoiceAdmin(ModelAdmin):
     list_display = ['invoice_number', 'get_customer_name', 'total_amount', 'created_at']
-    list_filter = ['stock_exit__warehouse__store', 'created_at']
+    list_filter = ['store', 'created_at']
     search_fields = ['invoice_number', 'customer__name', 'customer_name']
     readonly_fields = ['invoice_number', 'total_amount', 'created_at']
     date_hierarchy = 'created_at'
@@ -142,7 +152,22 @@ class InvoiceAdmin(ModelAdmin):
 @admin.register(FinancialTransaction)
 class FinancialTransactionAdmin(ModelAdmin):
     list_display = ['transaction_number', 'transaction_type', 'amount', 'from_account', 'to_account', 'created_at']
-    list_filter = ['transaction_type', 'from_account__store', 'created_at']
+    list_filter = ['transaction_type', 'store', 'created_at']
     search_fields = ['transaction_number', 'description']
     readonly_fields = ['transaction_number', 'created_at']
-    date_hierarchy = 'created_at'
\ No newline at end of file
+    date_hierarchy = 'created_at'
+
+
+# Configuration Admin pour DocumentSequence
+@admin.register(DocumentSequence)
+class DocumentSequenceAdmin(ModelAdmin):
+    list_display = ['store', 'document_type', 'last_value']
+    list_filter = ['document_type', 'store']
+
+
+# Configuration Admin pour ExportJob
+@admin.register(ExportJob)
+class ExportJobAdmin(ModelAdmin):
+    list_display = ['id', 'store', 'kind', 'status', 'attempts', 'created_by', 'created_at', 'finished_at']
+    list_filter = ['kind', 'status', 'store']
+    readonly_fields = ['file_path', 'filename', 'error', 'created_at', 'started_at', 'finished_at']
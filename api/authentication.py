@@ -1,9 +1,14 @@
+from rest_framework.permissions import SAFE_METHODS
 from rest_framework.request import Request
 from .models import User, Store
 from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
 from django.contrib.auth.backends import ModelBackend
-from django.db.models import Q
 from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from .cache import get_cached_user, is_revoked, store_state_version
 import logging
 
 logger = logging.getLogger(__name__)
@@ -22,46 +27,113 @@ class CustomJWTAuthentication(JWTAuthentication):
                 return None
 
             validated_token = self.get_validated_token(raw_token)
+            
+            # Lectures en mode "claims" : utilisateur reconstruit à partir du token, sans requête
+            if settings.JWT_STATELESS_CLAIMS and request.method in SAFE_METHODS:
+                user = self.get_stateless_user(validated_token)
+                if user is not None:
+                    return user, validated_token
+            
             return self.get_user(validated_token), validated_token
         except Exception as e:
             logger.warning(f"Authentication failed: {e}")
             return None
+    
+    def get_user(self, validated_token):
+        """
+        Même contrôle que JWTAuthentication.get_user, plus la liste des tokens révoqués à la
+        déconnexion ; l'utilisateur et son store viennent du cache api/cache.py (aucune requête
+        tant que l'entrée est valide)
+        """
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+        
+        jti = validated_token.get(api_settings.JTI_CLAIM)
+        if is_revoked(jti):
+            raise AuthenticationFailed(_("Token is revoked"), code="token_revoked")
+        
+        user = get_cached_user(user_id, jti, self.load_user)
+        
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+        
+        return user
+    
+    def get_stateless_user(self, validated_token):
+        """
+        Utilisateur et store reconstruits à partir des claims (les autres champs sont différés :
+        chargés seulement si une vue les lit). None si le token ne porte pas les claims ou si
+        l'état du store a changé depuis son émission : le contrôle complet (get_user) s'applique.
+        Un token révoqué à la déconnexion est refusé dans les deux cas.
+        """
+        store_id = validated_token.get('store_id')
+        token_version = validated_token.get('store_version')
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if store_id is None or token_version is None or user_id is None:
+            return None
+        if token_version < store_state_version(store_id):
+            return None
+        if is_revoked(validated_token.get(api_settings.JTI_CLAIM)):
+            raise AuthenticationFailed(_("Token is revoked"), code="token_revoked")
+        
+        user = deferred_instance(
+            User, id=user_id, is_active=True, is_staff=bool(validated_token.get('is_staff')), store_id=store_id
+        )
+        user.store = deferred_instance(Store, id=store_id, is_active=True)
+        return user
+    
+    def load_user(self, user_id):
+        try:
+            return self.user_model.objects.select_related('store').get(**{api_settings.USER_ID_FIELD: user_id})
+        except self.user_model.DoesNotExist:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
         
+def deferred_instance(model, **values):
+    """Instance de `model` dont seuls les champs `values` sont chargés (les autres sont différés)"""
+    field_names = [field.attname for field in model._meta.concrete_fields if field.attname in values]
+    return model.from_db(None, field_names, [values[name] for name in field_names])
+
+
 class CustomAuthenticationBackend(ModelBackend):
-   def authenticate(self, request, username=None, password=None, store_name=None, **kwargs):
-        user = None
+    """
+    Connexion par (boutique, nom d'utilisateur, mot de passe) ; sans boutique pour le support
+    (superutilisateur sans store). Utilisateur et boutique sont lus en une seule requête.
+    """
+    def authenticate(self, request, username=None, password=None, store_name=None, **kwargs):
+        if username is None or password is None:
+            return None
         
-        # Cas global : utilisateur du support (superuser sans store)
-        if not store_name:
-            try:
-                print("-----------------",username)
-                
-                user = User.objects.get(
-                    username=username,
-                    store__isnull=True
-                )
-                print(User.objects.get(username=username)==None)
-            except User.DoesNotExist:
-                print("ddd")
-                return None
+        if store_name:
+            lookup = {'username': username, 'store__name': store_name, 'store__is_active': True}
         else:
-            try:
-                store = Store.objects.get(name=store_name)
-                print(store)
-                if not store.is_active:
-                    return None
-            except Store.DoesNotExist:
-                return None
-            try:
-                user = User.objects.get(
-                    username=username,
-                    store=store
-                )
-                print(user)
-            except User.DoesNotExist:
-                return None
-
-        if user and user.check_password(password) and self.user_can_authenticate(user):
+            # Cas global : utilisateur du support (superuser sans store)
+            lookup = {'username': username, 'store__isnull': True}
+        
+        try:
+            user = User.objects.select_related('store').get(**lookup)
+        except User.DoesNotExist:
+            # Hachage factice : même coût (et même durée) qu'un compte existant
+            User().set_password(password)
+            logger.info("Connexion refusée : compte inconnu (boutique=%r, utilisateur=%r)", store_name, username)
+            return None
+        
+        # check_password re-hache le mot de passe si les paramètres du hacheur ont changé :
+        # ce re-hachage (même mot de passe) ne révoque pas les tokens (signals.invalidate_auth_cache)
+        user._password_rehash = True
+        try:
+            valid = user.check_password(password)
+        finally:
+            del user._password_rehash
+        
+        if valid and self.user_can_authenticate(user):
+            logger.debug("Connexion réussie (boutique=%r, utilisateur=%r)", store_name, username)
             return user
-
+        
+        logger.info("Connexion refusée : mot de passe invalide ou compte inactif (boutique=%r, utilisateur=%r)", store_name, username)
         return None
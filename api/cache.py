@@ -0,0 +1,233 @@
+"""
+Cache en mémoire (par processus) des utilisateurs authentifiés par JWT.
+
+Chaque requête authentifiée chargeait l'utilisateur puis, à la vérification du
+magasin, le magasin : deux requêtes avant toute logique métier. Les instances
+(utilisateur + magasin) sont conservées ici par (id utilisateur, jti du token),
+avec une durée de vie (AUTH_USER_CACHE_TTL) et une taille maximale (LRU).
+
+Invalidation : chaque enregistrement ou suppression d'un User ou d'un Store
+incrémente un compteur de version dans le cache Django (voir api/signals.py).
+Une entrée n'est servie que si les versions enregistrées avec elle sont toujours
+les versions courantes. Avec le cache par défaut (mémoire locale), les compteurs
+ne sont pas partagés entre workers : l'obsolescence est alors bornée par la durée
+de vie ; avec un cache partagé (Redis, Memcached) l'invalidation est immédiate.
+
+Mode JWT_STATELESS_CLAIMS : une version de l'état de chaque store est aussi tenue
+ici ; les tokens la portent et ne sont acceptés sans contrôle en base que tant
+qu'elle n'a pas changé (voir CustomJWTAuthentication.get_stateless_user). Les tokens
+d'accès révoqués à la déconnexion sont listés ici jusqu'à leur expiration ; ce mode
+exige un cache partagé entre workers (vérification au démarrage, api/checks.py).
+
+Données de référence (comptes, entrepôts, fournisseurs) : les réponses des
+sélecteurs sont gardées dans le cache 'reference' (mémoire locale, ou fichiers avec
+REFERENCE_CACHE_DIR), sous une clé qui contient la version de chaque jeu de données
+du store. Les signaux post_save / post_delete changent ces versions après le commit :
+les anciennes entrées ne sont plus lues et expirent d'elles-mêmes (REFERENCE_CACHE_TTL).
+Les versions sont tenues dans un cache partagé par les workers (reference_version_cache) ;
+sans cache partagé, ce cache est désactivé. Les soldes des comptes
+n'y sont jamais gardés : modifiés à chaque transaction, ils seraient périmés dans les
+autres workers tant que le cache mémoire de chacun n'a pas expiré.
+"""
+import copy
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.utils.connection import ConnectionProxy
+
+
+class TTLCache:
+    """Dictionnaire borné (les entrées les moins récemment lues sont évincées) avec expiration"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if self.ttl <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+auth_users = TTLCache(settings.AUTH_USER_CACHE_SIZE, settings.AUTH_USER_CACHE_TTL)
+
+
+def version_key(model_name, pk):
+    return f"auth-version:{model_name}:{pk}"
+
+
+def bump_version(model_name, pk):
+    """Invalide les entrées de cache qui dépendent de cet objet"""
+    key = version_key(model_name, pk)
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Clé évincée entre add et incr
+        cache.set(key, 1, None)
+
+
+def current_versions(user_id, store_id):
+    keys = [version_key('user', user_id), version_key('store', store_id)]
+    versions = cache.get_many(keys)
+    return tuple(versions.get(key) for key in keys)
+
+
+def store_state_version(store_id):
+    """
+    Version de l'état d'un store (store et comptes de ses utilisateurs), portée par les tokens
+    en mode JWT_STATELESS_CLAIMS. Horodatage en millisecondes : si le compteur est perdu
+    (cache vidé ou redémarré), la nouvelle valeur est plus récente que tous les tokens émis.
+    """
+    return cache.get_or_set(version_key('store-state', store_id), lambda: int(time.time() * 1000), None)
+
+
+def bump_store_state(store_id):
+    """Les tokens émis avant cet appel repassent par le contrôle complet (base de données)"""
+    key = version_key('store-state', store_id)
+    cache.set(key, max(int(time.time() * 1000), (cache.get(key) or 0) + 1), None)
+
+
+def revocation_key(jti):
+    return f"auth-revoked:{jti}"
+
+
+def revoke_token(jti, expires_at):
+    """Révoque un token d'accès (déconnexion) jusqu'à son expiration (`expires_at`, timestamp)"""
+    cache.set(revocation_key(jti), True, max(1, int(expires_at - time.time())))
+
+
+def is_revoked(jti):
+    return jti is not None and cache.get(revocation_key(jti)) is not None
+
+
+def snapshot(user):
+    """Copie de l'utilisateur (et de son magasin) : une requête ne modifie pas l'instance partagée"""
+    clone = copy.copy(user)
+    if user.store is not None:
+        clone.store = copy.copy(user.store)
+    return clone
+
+
+def get_cached_user(user_id, jti, load_user):
+    """
+    Utilisateur (magasin préchargé) pour ce token, sans requête si l'entrée est valide.
+    `load_user(user_id)` charge l'utilisateur avec select_related('store') en cas d'absence.
+    """
+    key = (user_id, jti)
+    entry = auth_users.get(key)
+    if entry is not None:
+        user, versions = entry
+        if versions == current_versions(user.pk, user.store_id):
+            return snapshot(user)
+
+    user = load_user(user_id)
+    auth_users.set(key, (user, current_versions(user.pk, user.store_id)))
+    return snapshot(user)
+
+
+# 📚 Données de référence par store
+
+# Proxy (comme django.core.cache.cache) : suit les changements de CACHES
+reference_cache = ConnectionProxy(caches, 'reference')
+MISSING = object()
+
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def is_process_local(alias):
+    """Vrai si le cache `alias` est propre à chaque processus (invisible des autres workers)"""
+    return settings.CACHES[alias]['BACKEND'] in PROCESS_LOCAL_CACHES
+
+
+def reference_version_cache():
+    """
+    Cache des versions des données de référence : il doit être vu par tous les workers, sinon
+    une modification n'invaliderait que le cache du worker qui l'a faite. Le cache par défaut
+    s'il est partagé (REDIS_CACHE_URL), sinon le cache 'reference' s'il est en fichiers
+    (REFERENCE_CACHE_DIR) ; None si aucun ne l'est : le cache des données de référence est désactivé.
+    """
+    for alias in ('default', 'reference'):
+        if not is_process_local(alias):
+            return caches[alias]
+    return None
+
+
+def reference_version_key(store_id, name):
+    return f"reference-version:{store_id}:{name}"
+
+
+def reference_versions(store_id, names):
+    """
+    Versions courantes des jeux de données `names` du store. Horodatages en millisecondes,
+    comme store_state_version : un compteur perdu repart au-dessus de toutes les versions émises.
+    """
+    version_cache = reference_version_cache()
+    keys = [reference_version_key(store_id, name) for name in names]
+    versions = version_cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            version_cache.add(key, int(time.time() * 1000), None)
+            versions[key] = version_cache.get(key)
+    return tuple(versions[key] for key in keys)
+
+
+def bump_reference(store_id, *names):
+    """Les entrées en cache qui dépendent de ces jeux de données du store ne sont plus servies"""
+    version_cache = reference_version_cache()
+    if version_cache is None:
+        return
+    for name in names:
+        key = reference_version_key(store_id, name)
+        version_cache.set(key, max(int(time.time() * 1000), (version_cache.get(key) or 0) + 1), None)
+
+
+def cached_reference(store_id, name, build, depends=None, params=None):
+    """
+    Valeur `name` du store, calculée par `build()` en cas d'absence.
+    `depends` : jeux de données dont la valeur dépend (par défaut `name`) ;
+    `params` : paramètres de la requête qui distinguent plusieurs valeurs (filtres, pagination).
+    """
+    ttl = settings.REFERENCE_CACHE_TTL
+    if ttl <= 0 or reference_version_cache() is None:
+        return build()
+
+    versions = reference_versions(store_id, depends or (name,))
+    key = f"reference:{store_id}:{name}:{'-'.join(map(str, versions))}"
+    if params is not None:
+        key += ':' + hashlib.md5(repr(params).encode()).hexdigest()
+
+    value = reference_cache.get(key, MISSING)
+    if value is MISSING:
+        value = build()
+        reference_cache.set(key, value, ttl)
+    return value
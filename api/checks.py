@@ -0,0 +1,39 @@
+"""
+Vérifications au démarrage (manage.py check, migrate, runserver).
+
+Le mode JWT_STATELESS_CLAIMS authentifie les lectures sans base de données : la version
+de l'état du store et la liste des tokens révoqués doivent être vues par tous les workers.
+Avec un cache propre à chaque processus, un utilisateur désactivé ou déconnecté resterait
+accepté par les autres workers jusqu'à l'expiration de son token.
+"""
+from django.conf import settings
+from django.core.checks import Error, Tags, Warning, register
+
+from .cache import PROCESS_LOCAL_CACHES
+
+MACHINE_LOCAL_CACHES = (
+    'django.core.cache.backends.filebased.FileBasedCache',
+)
+
+
+@register(Tags.caches, Tags.security)
+def check_stateless_claims_cache(app_configs, **kwargs):
+    if not getattr(settings, 'JWT_STATELESS_CLAIMS', False):
+        return []
+
+    backend = settings.CACHES.get('default', {}).get('BACKEND')
+    if backend in PROCESS_LOCAL_CACHES:
+        return [Error(
+            "JWT_STATELESS_CLAIMS exige un cache partagé entre workers.",
+            hint="Définissez REDIS_CACHE_URL, ou désactivez JWT_STATELESS_CLAIMS.",
+            obj=backend,
+            id='api.E001',
+        )]
+    if backend in MACHINE_LOCAL_CACHES:
+        return [Warning(
+            "JWT_STATELESS_CLAIMS avec un cache fichier : partagé seulement par les workers d'une même machine.",
+            hint="Utilisez REDIS_CACHE_URL si l'application tourne sur plusieurs machines.",
+            obj=backend,
+            id='api.W001',
+        )]
+    return []
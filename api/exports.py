@@ -0,0 +1,580 @@
+"""
+Génération des exports (Excel, PDF) et exécution différée des rendus.
+
+Excel : les lignes sont lues par paquets (`.iterator()`) et écrites au fil de l'eau par
+xlsxwriter en mode `constant_memory` ; le classeur est assemblé dans un fichier
+temporaire puis envoyé par morceaux.
+
+PDF : les contextes des templates sont construits ici pour être partagés entre les
+vues (rendu immédiat) et les ExportJob rendus par `manage.py run_export_worker`
+dans un pool de processus, hors des workers gunicorn.
+
+Factures : une facture ne change plus après sa création ; son PDF est mis en cache
+sur disque sous une clé dérivée du contexte et du template, pré-rendu par le worker
+à la création et servi ensuite par simple lecture de fichier. Les lots de factures
+sont assemblés depuis ce cache (ZIP, ou PDF unique écrit au fil de l'eau par
+api/pdfmerge.py) ; chaque processus du worker réutilise la feuille de style analysée
+et la configuration des polices. Le rapport PDF des transactions
+est mis en page par paquets de lignes (lues avec les noms liés dans la même requête)
+dont les pages sont écrites une à une dans le fichier final : la mémoire ne dépend
+pas du nombre de lignes.
+"""
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
+import tempfile
+import uuid
+import zipfile
+from datetime import timedelta
+from itertools import islice
+
+import xlsxwriter
+from django.conf import settings
+from django.db.models import Count, F, Q, Sum
+from django.http import FileResponse
+from django.template.loader import get_template, render_to_string
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from weasyprint import CSS, HTML
+from weasyprint.text.fonts import FontConfiguration
+
+from .models import Account, ExportJob, FinancialTransaction, Invoice
+from .pdfmerge import PdfConcatenator
+from .utils import filter_invoices, filter_transactions
+
+logger = logging.getLogger(__name__)
+
+XLSX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+ITERATOR_CHUNK_SIZE = 2000
+MAX_COLUMN_WIDTH = 60
+
+TRANSACTION_HEADERS = [
+    "ID de Transaction", "Numéro de Transaction", "Montant", "Description",
+    "Type de Transaction", "Compte Source", "Compte Cible", "Créé Par", "Créé Le"
+]
+
+
+def transaction_rows(queryset):
+    """Lignes de l'export des transactions, lues par paquets avec les noms liés dans la même requête"""
+    type_labels = dict(FinancialTransaction.TRANSACTION_TYPES)
+    tz = timezone.get_current_timezone()
+    rows = queryset.order_by('-created_at', '-id').values_list(
+        'id', 'transaction_number', 'amount', 'description', 'transaction_type',
+        'from_account__name', 'to_account__name', 'created_by__fullname', 'created_at'
+    )
+    for pk, number, amount, description, transaction_type, from_name, to_name, created_by, created_at in rows.iterator(chunk_size=ITERATOR_CHUNK_SIZE):
+        yield [
+            pk,
+            number,
+            amount,
+            description or '',
+            type_labels.get(transaction_type, transaction_type),
+            from_name or '',
+            to_name or '',
+            created_by or '',
+            created_at.astimezone(tz).replace(tzinfo=None),
+        ]
+
+
+def write_xlsx(fileobj, headers, rows, sheet_name="Transactions"):
+    """
+    Écrit un classeur d'une feuille dans `fileobj`.
+    La largeur des colonnes est suivie au fil de l'écriture (xlsxwriter n'écrit
+    les colonnes qu'à l'assemblage final, après les données).
+    """
+    workbook = xlsxwriter.Workbook(fileobj, {'constant_memory': True})
+    worksheet = workbook.add_worksheet(sheet_name)
+    date_format = workbook.add_format({'num_format': 'dd/mm/yyyy hh:mm'})
+    amount_format = workbook.add_format({'num_format': '#,##0.00'})
+
+    widths = [len(header) for header in headers]
+    worksheet.write_row(0, 0, headers)
+
+    row_index = 0
+    for row_index, row in enumerate(rows, start=1):
+        for col, value in enumerate(row):
+            if hasattr(value, 'hour'):
+                worksheet.write_datetime(row_index, col, value, date_format)
+                length = 16
+            elif hasattr(value, 'quantize'):
+                worksheet.write_number(row_index, col, value, amount_format)
+                length = len(str(value))
+            else:
+                worksheet.write(row_index, col, value)
+                length = len(str(value))
+            if length > widths[col]:
+                widths[col] = length
+
+    for col, width in enumerate(widths):
+        worksheet.set_column(col, col, min(width + 2, MAX_COLUMN_WIDTH))
+
+    workbook.close()
+    return row_index
+
+
+def xlsx_response(headers, rows, filename, sheet_name="Transactions"):
+    """Réponse HTTP envoyant l'export par morceaux depuis un fichier temporaire"""
+    tmp = tempfile.TemporaryFile()
+    write_xlsx(tmp, headers, rows, sheet_name)
+    tmp.seek(0)
+    return FileResponse(tmp, as_attachment=True, filename=filename, content_type=XLSX_CONTENT_TYPE)
+
+
+# 📄 Contextes des PDF
+
+OUTFLOW_TYPES = ['sale', 'expense']
+
+
+def is_summary_only(params):
+    return str(params.get('summary', '')).lower() in ('1', 'true', 'yes')
+
+
+def transactions_pdf_context(transactions, store, params):
+    """Contexte commun aux paquets du rapport transactions_pdf.html (totaux calculés en une requête)"""
+    totals = transactions.aggregate(
+        transactions_count=Count('id'),
+        total_entrees=Sum('amount', filter=Q(transaction_type__in=['purchase', 'service', 'transfer'])),
+        total_sorties=Sum('amount', filter=Q(transaction_type__in=OUTFLOW_TYPES)),
+    )
+    total_entrees = totals['total_entrees'] or 0
+    total_sorties = totals['total_sorties'] or 0
+
+    context = {
+        'store': store,
+        'transactions_count': totals['transactions_count'],
+        'total_entrees': total_entrees,
+        'total_sorties': total_sorties,
+        'solde_net': total_entrees - total_sorties,
+        'date_from': parse_date(params.get('date_from') or ''),
+        'date_to': parse_date(params.get('date_to') or ''),
+        'account_name': '',
+        'summary_only': is_summary_only(params),
+    }
+
+    # Mode synthèse : totaux par type à la place de la liste des transactions
+    if context['summary_only']:
+        type_labels = dict(FinancialTransaction.TRANSACTION_TYPES)
+        context['by_type'] = [
+            {**item, 'label': type_labels.get(item['transaction_type'], item['transaction_type'])}
+            for item in transactions.order_by().values('transaction_type').annotate(
+                count=Count('id'), total=Sum('amount')
+            ).order_by('transaction_type')
+        ]
+
+    # Si un compte spécifique est sélectionné, récupérer son nom
+    account_id = params.get('account_id')
+    if account_id:
+        context['account_name'] = Account.objects.filter(
+            id=account_id, store=store
+        ).values_list('name', flat=True).first() or ''
+
+    return context
+
+
+def transaction_report_rows(queryset):
+    """Lignes du rapport PDF, avec les noms des comptes joints dans la même requête, lues par paquets"""
+    type_labels = dict(FinancialTransaction.TRANSACTION_TYPES)
+    rows = queryset.order_by('-created_at', '-id').values_list(
+        'transaction_number', 'transaction_type', 'amount', 'description',
+        'from_account__name', 'to_account__name', 'created_at'
+    )
+    for number, transaction_type, amount, description, from_name, to_name, created_at in rows.iterator(chunk_size=ITERATOR_CHUNK_SIZE):
+        yield {
+            'transaction_number': number,
+            'transaction_type': transaction_type,
+            'transaction_type_display': type_labels.get(transaction_type, transaction_type),
+            'is_outflow': transaction_type in OUTFLOW_TYPES,
+            'amount': amount,
+            'description': description,
+            'from_account_name': from_name,
+            'to_account_name': to_name,
+            'created_at': created_at,
+        }
+
+
+def invoice_pdf_context(invoice):
+    """Contexte du template invoice_pdf.html"""
+    stock_exit = invoice.stock_exit
+    customer = invoice.customer
+    context = {
+        'invoice': invoice,
+        'store': {
+            'name': stock_exit.warehouse.store.name,
+            'address': stock_exit.warehouse.store.description or 'Adresse non renseignée',
+            'phone': 'Téléphone non renseigné',  # Vous pouvez ajouter ce champ au modèle Store
+            'email': 'Email non renseigné',    # Vous pouvez ajouter ce champ au modèle Store
+        },
+        'customer': {
+            'name': customer.name if customer else invoice.customer_name,
+            'phone': customer.phone if customer else 'Non renseigné',
+            'email': customer.email if customer else 'Non renseigné',
+            'address': customer.address if customer else 'Non renseignée',
+        },
+        'items': [
+            {
+                'product': {
+                    'name': item.product.name,
+                    'barcode': item.product.reference
+                },
+                'quantity': item.quantity,
+                'unit_price': item.sale_price,
+                'total_amount': item.total_price
+            }
+            for item in stock_exit.items.all()
+        ]
+    }
+
+    # Calculer les totaux
+    subtotal = sum(float(item['total_amount']) for item in context['items'])
+    tax_rate = 0.18  # TVA 18%
+    tax_amount = subtotal * tax_rate
+    context.update({
+        'subtotal': subtotal,
+        'tax_amount': tax_amount,
+        'total_amount': subtotal + tax_amount,
+    })
+    return context
+
+
+_font_config = None
+_stylesheets = {}
+
+
+def font_config():
+    """Configuration des polices WeasyPrint, partagée par tous les rendus du processus"""
+    global _font_config
+    if _font_config is None:
+        _font_config = FontConfiguration()
+    return _font_config
+
+
+def stylesheet(template_name):
+    """Feuille de style analysée une seule fois par processus"""
+    if template_name not in _stylesheets:
+        source = get_template(template_name).template.source
+        _stylesheets[template_name] = CSS(string=source, font_config=font_config())
+    return _stylesheets[template_name]
+
+
+def render_pdf(template_name, context, target=None, stylesheets=None):
+    """Rend un template HTML en PDF avec WeasyPrint (retourne les octets si `target` est None)"""
+    return HTML(string=render_to_string(template_name, context)).write_pdf(
+        target, stylesheets=stylesheets, font_config=font_config()
+    )
+
+
+def invoice_filename(invoice):
+    return f"facture_{invoice.invoice_number}.pdf"
+
+
+# 📑 Rapport PDF des transactions par paquets
+
+TRANSACTIONS_TEMPLATE = 'transactions_pdf.html'
+TRANSACTIONS_STYLESHEET = 'transactions_pdf.css'
+TRANSACTIONS_PDF_CHUNK_ROWS = 500
+
+
+def write_transactions_pdf(fileobj, transactions, store, params):
+    """
+    Écrit le rapport PDF des transactions dans `fileobj`.
+    Chaque paquet de TRANSACTIONS_PDF_CHUNK_ROWS lignes est mis en page séparément (le premier
+    porte l'en-tête et les totaux, le dernier le pied de page) puis ses pages sont écrites dans
+    `fileobj` (api/pdfmerge.py) ; seule la mise en page d'un paquet est en mémoire à un instant donné.
+    Le pied de page « Page N sur M » est ajouté par PdfConcatenator une fois toutes les pages connues.
+    """
+    context = transactions_pdf_context(transactions, store, params)
+    rows = iter(()) if context['summary_only'] else transaction_report_rows(transactions)
+    stylesheets = [stylesheet(TRANSACTIONS_STYLESHEET)]
+
+    merged = PdfConcatenator(fileobj, footer=lambda number, total: f"Page {number} sur {total}")
+    chunk = list(islice(rows, TRANSACTIONS_PDF_CHUNK_ROWS))
+    first_chunk = True
+    while True:
+        next_chunk = list(islice(rows, TRANSACTIONS_PDF_CHUNK_ROWS))
+        html = render_to_string(TRANSACTIONS_TEMPLATE, {
+            **context,
+            'rows': chunk,
+            'first_chunk': first_chunk,
+            'last_chunk': not next_chunk,
+        })
+        document = HTML(string=html).render(stylesheets=stylesheets, font_config=font_config())
+        merged.append(io.BytesIO(document.write_pdf()))
+
+        if not next_chunk:
+            break
+        chunk, first_chunk = next_chunk, False
+
+    return merged.close()
+
+
+def transactions_pdf_filename(params):
+    return "synthese_transactions.pdf" if is_summary_only(params) else "rapport_transactions.pdf"
+
+
+# 🧾 Cache des PDF de factures
+
+INVOICE_TEMPLATE = 'invoice_pdf.html'
+INVOICE_STYLESHEET = 'invoice_pdf.css'
+_template_digests = {}
+
+
+def template_digest(template_name):
+    """Empreinte du source du template (calculée une fois par processus, donc par déploiement)"""
+    if template_name not in _template_digests:
+        source = get_template(template_name).template.source
+        _template_digests[template_name] = hashlib.sha256(source.encode()).hexdigest()
+    return _template_digests[template_name]
+
+
+def invoice_pdf_cache_path(invoice, context):
+    """Fichier du cache pour ce contexte : toute donnée imprimée qui change donne une nouvelle clé"""
+    printed = {key: value for key, value in context.items() if key != 'invoice'}
+    printed['invoice'] = [
+        invoice.invoice_number, invoice.created_at.isoformat(), invoice.stock_exit.notes
+    ]
+    payload = json.dumps(printed, sort_keys=True, default=str)
+    version = f"{template_digest(INVOICE_TEMPLATE)}:{template_digest(INVOICE_STYLESHEET)}"
+    digest = hashlib.sha256(f"{version}:{payload}".encode()).hexdigest()
+    return settings.INVOICE_PDF_CACHE_ROOT / f"{invoice.pk}-{digest[:32]}.pdf"
+
+
+def cached_invoice_pdf(invoice):
+    """
+    PDF de la facture ouvert en lecture, rendu seulement s'il n'est pas déjà en cache.
+    Le fichier est ouvert avant toute autre opération : s'il est évincé ensuite
+    (prune_invoice_pdf_cache), le descripteur ouvert reste lisible.
+    """
+    context = invoice_pdf_context(invoice)
+    path = invoice_pdf_cache_path(invoice, context)
+    try:
+        cached = open(path, 'rb')
+    except FileNotFoundError:
+        pass
+    else:
+        try:
+            # Un accès rafraîchit la date de modification : l'éviction est LRU
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return cached
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as fileobj:
+            render_pdf(INVOICE_TEMPLATE, context, fileobj, stylesheets=[stylesheet(INVOICE_STYLESHEET)])
+        rendered = open(tmp_path, 'rb')
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return rendered
+
+
+def prune_invoice_pdf_cache():
+    """
+    Supprime les PDF les moins récemment servis tant que le cache dépasse INVOICE_PDF_CACHE_MAX_MB.
+    Parcourt tout le répertoire : appelé par la maintenance périodique du worker d'exports,
+    jamais pendant une requête.
+    """
+    max_bytes = settings.INVOICE_PDF_CACHE_MAX_MB * 1024 * 1024
+    entries = []
+    try:
+        for entry in os.scandir(settings.INVOICE_PDF_CACHE_ROOT):
+            if not entry.name.endswith('.pdf'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    except FileNotFoundError:
+        return 0
+
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+    return removed
+
+
+def schedule_invoice_prerender(invoice):
+    """Demande au worker d'exports de pré-rendre le PDF d'une nouvelle facture"""
+    ExportJob.objects.create(
+        store_id=invoice.store_id,
+        created_by_id=invoice.stock_exit.created_by_id,
+        kind='invoice_pdf_cache',
+        params={'invoice_id': invoice.pk},
+    )
+
+
+def invoices_for_pdf(store_id):
+    return Invoice.objects.filter(store_id=store_id).select_related(
+        'customer', 'stock_exit__warehouse__store'
+    ).prefetch_related('stock_exit__items__product')
+
+
+# 📚 Factures par lot
+
+INVOICE_BATCH_CHUNK_SIZE = 50
+
+
+def cached_invoice_pdfs(store_id, invoice_ids):
+    """
+    (nom, PDF en cache ouvert) de chaque facture, dans l'ordre, lues par paquets ;
+    l'appelant ferme chaque fichier.
+    Le lot est rendu dans le processus du worker d'exports : le parallélisme vient du pool
+    du worker (plusieurs exports à la fois) et la plupart des factures sont déjà pré-rendues.
+    """
+    for start in range(0, len(invoice_ids), INVOICE_BATCH_CHUNK_SIZE):
+        chunk = invoice_ids[start:start + INVOICE_BATCH_CHUNK_SIZE]
+        for invoice in invoices_for_pdf(store_id).filter(pk__in=chunk).order_by('created_at', 'id'):
+            yield invoice_filename(invoice), cached_invoice_pdf(invoice)
+
+
+# 📦 Rendus différés (ExportJob)
+
+def render_transactions_xlsx_job(job, fileobj):
+    transactions = filter_transactions(FinancialTransaction.objects.filter(store=job.store), job.params)
+    write_xlsx(fileobj, TRANSACTION_HEADERS, transaction_rows(transactions))
+    return "transactions_export.xlsx"
+
+
+def render_transactions_pdf_job(job, fileobj):
+    transactions = filter_transactions(FinancialTransaction.objects.filter(store=job.store), job.params)
+    write_transactions_pdf(fileobj, transactions, job.store, job.params)
+    return transactions_pdf_filename(job.params)
+
+
+def render_invoice_pdf_job(job, fileobj):
+    invoice = invoices_for_pdf(job.store_id).get(pk=job.params['invoice_id'])
+    with cached_invoice_pdf(invoice) as cached:
+        shutil.copyfileobj(cached, fileobj)
+    return invoice_filename(invoice)
+
+
+def render_invoice_batch_job(job, fileobj):
+    invoice_ids = list(
+        filter_invoices(Invoice.objects.filter(store=job.store), job.params)
+        .values_list('pk', flat=True)[:settings.INVOICE_BATCH_MAX]
+    )
+    pdfs = cached_invoice_pdfs(job.store_id, invoice_ids)
+
+    if job.params.get('format') == 'pdf':
+        # Pages écrites au fil de l'eau : la mémoire ne dépend pas de la taille du lot
+        merged = PdfConcatenator(fileobj)
+        for _, cached in pdfs:
+            with cached:
+                merged.append(cached)
+        merged.close()
+        return "factures.pdf"
+
+    # Les PDF sont déjà compressés : archive sans recompression, copiée depuis le cache
+    with zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_STORED) as archive:
+        for filename, cached in pdfs:
+            with cached, archive.open(filename, 'w') as member:
+                shutil.copyfileobj(cached, member)
+    return "factures.zip"
+
+
+def prerender_invoice_pdf_job(job, fileobj):
+    cached_invoice_pdf(invoices_for_pdf(job.store_id).get(pk=job.params['invoice_id'])).close()
+    return None
+
+
+# type d'export -> fonction de rendu (job, fichier) retournant le nom proposé au téléchargement
+# (None : le rendu ne produit pas de fichier à télécharger)
+EXPORT_RENDERERS = {
+    'transactions_xlsx': render_transactions_xlsx_job,
+    'transactions_pdf': render_transactions_pdf_job,
+    'invoice_pdf': render_invoice_pdf_job,
+    'invoice_batch': render_invoice_batch_job,
+    'invoice_pdf_cache': prerender_invoice_pdf_job,
+}
+
+
+def export_path(job):
+    return settings.EXPORTS_ROOT / job.file_path
+
+
+def claim_job():
+    """Réserve le plus ancien export en attente (UPDATE conditionnel, sûr entre workers) ; retourne son id"""
+    pending = ExportJob.objects.filter(status='pending').order_by('created_at').values_list('pk', flat=True)
+    for job_id in pending[:20]:
+        claimed = ExportJob.objects.filter(pk=job_id, status='pending').update(
+            status='running', started_at=timezone.now(), attempts=F('attempts') + 1
+        )
+        if claimed:
+            return job_id
+    return None
+
+
+def run_export_job(job_id):
+    """Rend un export réservé (exécuté dans un processus du pool du worker)"""
+    job = ExportJob.objects.select_related('store').get(pk=job_id)
+    renderer = EXPORT_RENDERERS[job.kind]
+    directory = settings.EXPORTS_ROOT / str(job.store_id)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as fileobj:
+            filename = renderer(job, fileobj)
+        if filename is None:
+            os.remove(tmp_path)
+            relative_path, filename = '', ''
+        else:
+            relative_path = f"{job.store_id}/{job.pk}-{uuid.uuid4().hex}{os.path.splitext(filename)[1]}"
+            os.replace(tmp_path, settings.EXPORTS_ROOT / relative_path)
+    except Exception as e:
+        logger.exception("Échec de l'export %s", job.pk)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        ExportJob.objects.filter(pk=job.pk).update(status='failed', error=str(e), finished_at=timezone.now())
+        return False
+
+    ExportJob.objects.filter(pk=job.pk).update(
+        status='done', file_path=relative_path, filename=filename, error='', finished_at=timezone.now()
+    )
+    return True
+
+
+def requeue_stale_jobs():
+    """Remet en attente (ou en échec après EXPORT_JOB_MAX_ATTEMPTS) les rendus abandonnés par un worker arrêté"""
+    stale = ExportJob.objects.filter(
+        status='running',
+        started_at__lt=timezone.now() - timedelta(minutes=settings.EXPORT_JOB_TIMEOUT_MINUTES)
+    )
+    failed = stale.filter(attempts__gte=settings.EXPORT_JOB_MAX_ATTEMPTS).update(
+        status='failed', error="Rendu interrompu", finished_at=timezone.now()
+    )
+    return stale.update(status='pending'), failed
+
+
+def purge_expired_jobs():
+    """Supprime les exports terminés depuis plus de EXPORT_RETENTION_HOURS, et leurs fichiers"""
+    expired = ExportJob.objects.filter(
+        status__in=['done', 'failed'],
+        finished_at__lt=timezone.now() - timedelta(hours=settings.EXPORT_RETENTION_HOURS)
+    )
+    count = 0
+    for job in expired.iterator():
+        if job.file_path:
+            try:
+                os.remove(export_path(job))
+            except FileNotFoundError:
+                pass
+        job.delete()
+        count += 1
+    return count
@@ -0,0 +1,13 @@
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+
+class ConfigurablePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    PBKDF2-SHA256 dont le nombre d'itérations vient de PASSWORD_HASH_ITERATIONS.
+    Même algorithme que le hacheur par défaut : les hachés existants restent valides et
+    sont recalculés avec le nouveau coût à la connexion suivante (check_password).
+    """
+    @property
+    def iterations(self):
+        return settings.PASSWORD_HASH_ITERATIONS
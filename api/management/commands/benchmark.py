@@ -0,0 +1,163 @@
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from api.models import FinancialTransaction, Store, User, Warehouse, Product, ProductStock
+
+
+class Command(BaseCommand):
+    help = "Mesure les performances de certains chemins critiques sur des données synthétiques (annulées en fin d'exécution)"
+
+    scenarios = ['low_stock', 'login', 'transaction_stats']
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', choices=self.scenarios)
+        parser.add_argument('--sizes', nargs='+', type=int, default=[10000, 100000],
+                            help="Tailles de jeu de données à mesurer")
+        parser.add_argument('--repeat', type=int, default=3,
+                            help="Nombre de mesures par taille (on garde la meilleure)")
+
+    def handle(self, *args, **options):
+        bench = getattr(self, f"bench_{options['scenario']}")
+        for size in options['sizes']:
+            # Toutes les données créées pour la mesure sont annulées
+            with transaction.atomic():
+                bench(size, options['repeat'])
+                transaction.set_rollback(True)
+
+    def measure(self, label, func, repeat):
+        """Exécute `func` `repeat` fois et affiche la meilleure durée et le nombre de requêtes"""
+        timings = []
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as ctx:
+                start = time.perf_counter()
+                func()
+                timings.append(time.perf_counter() - start)
+        self.stdout.write(f"  {label}: {min(timings) * 1000:.1f} ms, {len(ctx.captured_queries)} requêtes")
+
+    def create_store(self):
+        suffix = uuid.uuid4().hex[:8]
+        store = Store.objects.create(name=f"Benchmark {suffix}", description="Données de benchmark")
+        user = User.objects.create_user(
+            username=f"bench-{suffix}",
+            email=f"bench-{suffix}@gesstock.com",
+            fullname="Benchmark",
+            store=store,
+        )
+        return store, user
+
+    def bench_low_stock(self, size, repeat):
+        from api.views import ProductViewSet
+
+        self.stdout.write(f"\n📦 low-stock sur {size} produits")
+        store, user = self.create_store()
+        warehouses = [
+            Warehouse.objects.create(name=f"Magasin {i}", store=store) for i in range(2)
+        ]
+
+        products = Product.objects.bulk_create([
+            Product(reference=f"BENCH-{store.id}-{i}", name=f"Produit {i}", store=store, min_stock_alert=5)
+            for i in range(size)
+        ], batch_size=5000)
+        # Environ un produit sur trois passe sous le seuil d'alerte
+        ProductStock.objects.bulk_create([
+            ProductStock(product=product, warehouse=warehouses[i % 2], quantity=i % 15)
+            for i, product in enumerate(products)
+        ], batch_size=5000)
+
+        factory = APIRequestFactory(HTTP_HOST=settings.ALLOWED_HOSTS[0])
+        view = ProductViewSet.as_view({'get': 'low_stock'})
+
+        def call(params):
+            request = factory.get('/api/products/low-stock/', params)
+            force_authenticate(request, user=user)
+            response = view(request)
+            assert response.status_code == 200, response.data
+
+        self.measure("première page", lambda: call({}), repeat)
+        self.measure("dernière page", lambda: call({'page': 'last'}), repeat)
+        self.measure("par magasin", lambda: call({'warehouse': warehouses[0].id}), repeat)
+
+    def bench_login(self, size, repeat):
+        self.stdout.write(
+            f"\n🔑 connexion, boutique de {size} utilisateurs "
+            f"(PBKDF2 {settings.PASSWORD_HASH_ITERATIONS} itérations)"
+        )
+        store, user = self.create_store()
+        password = "benchmark-password"
+        # Un seul hachage partagé : la création du jeu de données ne paie pas size hachages
+        hashed = make_password(password)
+        User.objects.filter(pk=user.pk).update(password=hashed)
+        User.objects.bulk_create([
+            User(
+                username=f"bench-user-{i}", email=f"bench-user-{i}@gesstock.com",
+                fullname=f"Utilisateur {i}", store=store, password=hashed,
+            )
+            for i in range(size)
+        ], batch_size=5000)
+        username = f"bench-user-{size // 2}"
+
+        def login(name, store_name, secret, expected):
+            logged = authenticate(username=name, password=secret, store_name=store_name)
+            assert (logged is not None) == expected, (name, store_name)
+
+        self.measure("connexion valide", lambda: login(username, store.name, password, True), repeat)
+        self.measure("mauvais mot de passe", lambda: login(username, store.name, "wrong", False), repeat)
+        self.measure("utilisateur inconnu", lambda: login("inconnu", store.name, password, False), repeat)
+        self.measure("boutique inconnue", lambda: login(username, "Inconnue", password, False), repeat)
+
+        # Débit d'un worker (un seul processus, connexions valides enchaînées)
+        count = max(repeat, 10)
+        start = time.perf_counter()
+        for _ in range(count):
+            login(username, store.name, password, True)
+        self.stdout.write(f"  débit : {count / (time.perf_counter() - start):.1f} connexions/s par worker")
+
+    def bench_transaction_stats(self, size, repeat):
+        import datetime
+        from decimal import Decimal
+        from django.utils import timezone
+        from api.views import FinancialTransactionViewSet
+
+        self.stdout.write(f"\n💰 statistiques sur {size} transactions (réparties sur un an)")
+        store, user = self.create_store()
+        types = ['sale', 'purchase', 'expense', 'service']
+        transactions = FinancialTransaction.objects.bulk_create([
+            FinancialTransaction(
+                transaction_number=f"BENCH-{store.id}-{i}", transaction_type=types[i % len(types)],
+                amount=Decimal(10 + i % 500), store=store, created_by=user,
+            )
+            for i in range(size)
+        ], batch_size=5000)
+        # created_at est renseigné à l'insertion : un jour par tranche d'identifiants consécutifs
+        today = timezone.localdate()
+        first_day = today - datetime.timedelta(days=364)
+        for day in range(365):
+            chunk = transactions[day * size // 365:(day + 1) * size // 365]
+            if chunk:
+                FinancialTransaction.objects.filter(pk__gte=chunk[0].pk, pk__lte=chunk[-1].pk).update(
+                    created_at=timezone.make_aware(
+                        datetime.datetime.combine(first_day + datetime.timedelta(days=day), datetime.time(12))
+                    )
+                )
+
+        factory = APIRequestFactory(HTTP_HOST=settings.ALLOWED_HOSTS[0])
+        view = FinancialTransactionViewSet.as_view({'get': 'stats'})
+
+        def call(params):
+            request = factory.get('/api/financial-transactions/stats/', params)
+            force_authenticate(request, user=user)
+            response = view(request)
+            assert response.status_code == 200, response.data
+
+        last_month = {'date_from': (today - datetime.timedelta(days=30)).isoformat(), 'date_to': today.isoformat()}
+        self.measure("dernier mois, par jour", lambda: call({**last_month, 'bucket': 'day'}), repeat)
+        self.measure("historique complet", lambda: call({}), repeat)
+        self.measure("historique complet, par mois", lambda: call({'bucket': 'month'}), repeat)
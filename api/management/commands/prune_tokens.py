@@ -0,0 +1,66 @@
+import time
+
+from django.db import connection, transaction
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+
+class Command(BaseCommand):
+    help = (
+        "Supprime par lots les tokens de rafraîchissement expirés (outstanding et blacklistés) "
+        "et affiche la taille des tables ; à planifier (cron, Heroku Scheduler)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help="Nombre de tokens supprimés par transaction")
+        parser.add_argument('--max-batches', type=int, default=0,
+                            help="Arrêt après ce nombre de lots (0 : jusqu'à épuisement)")
+        parser.add_argument('--pause', type=float, default=0.05,
+                            help="Pause (secondes) entre deux lots, pour laisser passer le trafic")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Affiche seulement les métriques, sans rien supprimer")
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        # OutstandingToken est trié par utilisateur par défaut : on parcourt l'index expires_at
+        expired = OutstandingToken.objects.filter(expires_at__lte=now).order_by('expires_at')
+
+        self.report_tables("avant")
+        self.stdout.write(f"  tokens expirés : {expired.count()}")
+        if options['dry_run']:
+            return
+
+        outstanding_deleted = blacklisted_deleted = batches = 0
+        start = time.perf_counter()
+        while not options['max_batches'] or batches < options['max_batches']:
+            ids = list(expired.values_list('pk', flat=True)[:options['batch_size']])
+            if not ids:
+                break
+            with transaction.atomic():
+                blacklisted_deleted += BlacklistedToken.objects.filter(token_id__in=ids).delete()[0]
+                outstanding_deleted += OutstandingToken.objects.filter(pk__in=ids).delete()[0]
+            batches += 1
+            if options['pause']:
+                time.sleep(options['pause'])
+        elapsed = time.perf_counter() - start
+
+        rate = (outstanding_deleted + blacklisted_deleted) / elapsed if elapsed else 0
+        self.stdout.write(
+            f"🧹 {outstanding_deleted} token(s) et {blacklisted_deleted} entrée(s) de blacklist supprimés "
+            f"en {batches} lot(s), {elapsed:.1f} s ({rate:.0f} lignes/s)"
+        )
+        self.report_tables("après")
+
+    def report_tables(self, label):
+        """Nombre de lignes (et taille sur disque avec PostgreSQL) des tables de tokens"""
+        self.stdout.write(f"📊 Tables de tokens ({label}) :")
+        for model in (OutstandingToken, BlacklistedToken):
+            table = model._meta.db_table
+            line = f"  {table} : {model.objects.order_by().count()} lignes"
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT pg_size_pretty(pg_total_relation_size(%s::regclass))", [table])
+                    line += f", {cursor.fetchone()[0]}"
+            self.stdout.write(line)
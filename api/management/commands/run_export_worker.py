@@ -0,0 +1,105 @@
+import multiprocessing
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.exports import (
+    claim_job, prune_invoice_pdf_cache, purge_expired_jobs, requeue_stale_jobs, run_export_job
+)
+from api.models import ExportJob
+from api.sequences import prune_transaction_sequences
+
+
+class Command(BaseCommand):
+    help = "Exécute les exports différés (ExportJob) dans un pool de processus, hors des workers web"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=settings.EXPORT_WORKER_PROCESSES,
+                            help="Nombre de rendus simultanés")
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help="Délai (secondes) entre deux recherches d'exports en attente")
+        parser.add_argument('--once', action='store_true',
+                            help="S'arrête quand il n'y a plus d'export en attente")
+        parser.add_argument('--cleanup-only', action='store_true',
+                            help="Supprime les exports expirés puis s'arrête")
+
+    def handle(self, *args, **options):
+        if options['cleanup_only']:
+            self.stdout.write(f"🧹 {purge_expired_jobs()} export(s) expiré(s) supprimé(s)")
+            self.stdout.write(f"🧹 {prune_invoice_pdf_cache()} PDF de facture évincé(s) du cache")
+            self.stdout.write(f"🧹 {prune_transaction_sequences()} compteur(s) de transactions des jours passés supprimé(s)")
+            return
+
+        processes = max(1, options['processes'])
+        self.stdout.write(f"📄 Worker d'exports démarré ({processes} processus)")
+        pool = self.create_pool(processes)
+        running = {}
+        last_maintenance = 0
+
+        try:
+            while True:
+                # Maintenance périodique : rendus abandonnés, fichiers expirés, taille du cache des factures,
+                # compteurs de transactions des jours passés
+                if time.monotonic() - last_maintenance > 60:
+                    requeued, failed = requeue_stale_jobs()
+                    purged = purge_expired_jobs()
+                    evicted = prune_invoice_pdf_cache()
+                    sequences = prune_transaction_sequences()
+                    if requeued or failed or purged or evicted or sequences:
+                        self.stdout.write(
+                            f"🔁 {requeued} relancé(s), {failed} en échec, 🧹 {purged} supprimé(s), "
+                            f"{evicted} PDF de facture évincé(s), {sequences} compteur(s) de transactions supprimé(s)"
+                        )
+                    last_maintenance = time.monotonic()
+
+                while len(running) < processes:
+                    job_id = claim_job()
+                    if job_id is None:
+                        break
+                    running[pool.submit(run_export_job, job_id)] = job_id
+
+                if not running:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                done, _ = wait(running, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+                for future in done:
+                    job_id = running.pop(future)
+                    try:
+                        ok = future.result()
+                    except BrokenProcessPool:
+                        # Un processus de rendu est mort (mémoire, crash natif) : on repart d'un pool neuf
+                        self.fail(job_id, "Processus de rendu interrompu")
+                        pool.shutdown(cancel_futures=True)
+                        for other_id in running.values():
+                            self.fail(other_id, "Processus de rendu interrompu")
+                        running.clear()
+                        pool = self.create_pool(processes)
+                        break
+                    except Exception as e:
+                        self.fail(job_id, str(e))
+                    else:
+                        self.stdout.write(f"{'✅' if ok else '❌'} Export {job_id}")
+        finally:
+            pool.shutdown(wait=True)
+
+    def create_pool(self, processes):
+        # 'spawn' : chaque processus initialise Django avec ses propres connexions à la base
+        return ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=django.setup,
+        )
+
+    def fail(self, job_id, error):
+        ExportJob.objects.filter(pk=job_id, status='running').update(
+            status='failed', error=error, finished_at=timezone.now()
+        )
+        self.stdout.write(f"❌ Export {job_id}: {error}")
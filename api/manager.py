@@ -1,5 +1,9 @@
 from django.contrib.auth.base_user import BaseUserManager
 from django.core.exceptions import ValidationError
+from django.db import connections, models
+from django.db.models import Case, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 
 class UserManager(BaseUserManager):
     def create_user(self, username, email, password=None, store=None, **extra_fields):
@@ -26,3 +30,111 @@ class UserManager(BaseUserManager):
         extra_fields.setdefault('is_superuser', True)
 
         return self.create_user(username=username, email=self.normalize_email(email), password=password, store=None, **extra_fields)
+
+
+class ProductQuerySet(models.QuerySet):
+    def with_total_stock(self, warehouse=None):
+        """
+        Annote chaque produit avec son stock total (somme des ProductStock) via une sous-requête.
+        Si `warehouse` est fourni, seul le stock de ce magasin est pris en compte.
+        """
+        from .models import ProductStock
+
+        stocks = ProductStock.objects.filter(product=OuterRef('pk'))
+        if warehouse is not None:
+            stocks = stocks.filter(warehouse=warehouse)
+        stock_subquery = stocks.values('product').annotate(total=Sum('quantity')).values('total')
+
+        return self.annotate(
+            total_stock=Coalesce(Subquery(stock_subquery, output_field=models.IntegerField()), 0)
+        )
+
+    def with_last_purchase_price(self):
+        """Annote chaque produit avec le prix d'achat de sa dernière entrée en stock"""
+        from .models import StockEntryItem
+
+        price_subquery = StockEntryItem.objects.filter(
+            product=OuterRef('pk')
+        ).order_by('-id').values('purchase_price')[:1]
+
+        return self.annotate(
+            last_purchase_price=Subquery(price_subquery, output_field=models.DecimalField(max_digits=10, decimal_places=2))
+        )
+
+    def low_stock(self, warehouse=None):
+        """
+        Produits dont le stock est inférieur ou égal au seuil d'alerte,
+        les plus critiques (plus grand déficit) en premier.
+        """
+        return self.with_total_stock(warehouse=warehouse).annotate(
+            stock_margin=F('total_stock') - F('min_stock_alert')
+        ).filter(
+            stock_margin__lte=0
+        ).order_by('stock_margin', 'total_stock', 'reference')
+
+
+class ProductStockQuerySet(models.QuerySet):
+    def increment(self, product, warehouse, quantity):
+        """Ajoute `quantity` au stock sans lecture préalable (UPDATE ... SET quantity = quantity + n)"""
+        stock = self.filter(product=product, warehouse=warehouse)
+        if not stock.update(quantity=F('quantity') + quantity, last_updated=timezone.now()):
+            _, created = self.get_or_create(product=product, warehouse=warehouse, defaults={'quantity': quantity})
+            if not created:
+                stock.update(quantity=F('quantity') + quantity, last_updated=timezone.now())
+
+    def decrement(self, product, warehouse, quantity):
+        """
+        Retire `quantity` du stock seulement s'il est suffisant
+        (UPDATE ... SET quantity = quantity - n WHERE quantity >= n).
+        Retourne False si le stock est insuffisant ou inexistant.
+        """
+        return bool(self.filter(
+            product=product, warehouse=warehouse, quantity__gte=quantity
+        ).update(quantity=F('quantity') - quantity, last_updated=timezone.now()))
+
+    def add_quantities(self, warehouse, quantities):
+        """
+        Ajoute en une seule requête les quantités {product_id: quantité} au stock d'un magasin :
+        INSERT ... ON CONFLICT (product_id, warehouse_id) DO UPDATE SET quantity = quantity + EXCLUDED.quantity
+        """
+        if not quantities:
+            return
+        connection = connections[self.db]
+        qn = connection.ops.quote_name
+        table = qn(self.model._meta.db_table)
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        warehouse_id = getattr(warehouse, 'pk', warehouse)
+
+        items = list(quantities.items())
+        with connection.cursor() as cursor:
+            for start in range(0, len(items), 1000):
+                chunk = items[start:start + 1000]
+                params = []
+                for product_id, quantity in chunk:
+                    params += [product_id, warehouse_id, quantity, now]
+                cursor.execute(
+                    f"INSERT INTO {table} ({qn('product_id')}, {qn('warehouse_id')}, {qn('quantity')}, {qn('last_updated')}) "
+                    f"VALUES {', '.join(['(%s, %s, %s, %s)'] * len(chunk))} "
+                    f"ON CONFLICT ({qn('product_id')}, {qn('warehouse_id')}) DO UPDATE SET "
+                    f"{qn('quantity')} = {table}.{qn('quantity')} + EXCLUDED.{qn('quantity')}, "
+                    f"{qn('last_updated')} = EXCLUDED.{qn('last_updated')}",
+                    params
+                )
+
+    def remove_quantities(self, warehouse, quantities):
+        """
+        Retire en une seule requête les quantités {product_id: quantité} du stock d'un magasin.
+        Seules les lignes dont le stock suffit sont décrémentées ; retourne le nombre de lignes
+        mises à jour (à comparer à len(quantities) pour détecter un stock insuffisant).
+        """
+        if not quantities:
+            return 0
+        requested = Case(
+            *[When(product_id=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+            output_field=IntegerField()
+        )
+        return self.filter(
+            warehouse=warehouse,
+            product_id__in=list(quantities),
+            quantity__gte=requested
+        ).update(quantity=F('quantity') - requested, last_updated=timezone.now())
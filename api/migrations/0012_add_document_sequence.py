@@ -0,0 +1,28 @@
+# Generated by Django 5.2.1 on 2026-10-18 09:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_add_debt_payment_functionality'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('document_type', models.CharField(max_length=30)),
+                ('last_value', models.PositiveBigIntegerField(default=0)),
+                ('store', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='document_sequences', to='api.store')),
+            ],
+            options={
+                'verbose_name': 'Compteur de Documents',
+                'verbose_name_plural': 'Compteurs de Documents',
+                'unique_together': {('store', 'document_type')},
+            },
+        ),
+    ]
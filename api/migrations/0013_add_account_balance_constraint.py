@@ -0,0 +1,39 @@
+# Generated by Django 5.2.1 on 2026-10-18 09:57
+
+from django.db import migrations, models
+
+
+def check_negative_balances(apps, schema_editor):
+    """
+    La contrainte échoue si un compte existant a un solde négatif (possible avant cette
+    migration, par l'admin ou une correction manuelle). Les soldes ne sont pas modifiés
+    automatiquement : on liste les comptes concernés pour qu'ils soient régularisés
+    (transaction d'ajustement ou correction du solde) avant de relancer la migration.
+    """
+    Account = apps.get_model('api', 'Account')
+    negative = list(
+        Account.objects.filter(balance__lt=0).order_by('store_id', 'name')
+        .values_list('store__name', 'name', 'balance')
+    )
+    if negative:
+        accounts = '\n'.join(f"  - {store} / {name} : {balance}" for store, name, balance in negative)
+        raise RuntimeError(
+            f"{len(negative)} compte(s) avec un solde négatif empêchent l'ajout de la contrainte "
+            f"account_balance_non_negative :\n{accounts}\n"
+            "Régularisez ces soldes puis relancez la migration."
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_add_document_sequence'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_negative_balances, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='account',
+            constraint=models.CheckConstraint(condition=models.Q(('balance__gte', 0)), name='account_balance_non_negative'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.1 on 2026-10-18 10:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_store(apps, schema_editor):
+    """Renseigne la boutique des transactions existantes (même ordre que FinancialTransaction.get_store_id)"""
+    FinancialTransaction = apps.get_model('api', 'FinancialTransaction')
+    Account = apps.get_model('api', 'Account')
+    Customer = apps.get_model('api', 'Customer')
+    StockEntry = apps.get_model('api', 'StockEntry')
+    StockExit = apps.get_model('api', 'StockExit')
+    User = apps.get_model('api', 'User')
+
+    sources = [
+        ('from_account', Account.objects.filter(pk=OuterRef('from_account_id')).values('store_id')),
+        ('to_account', Account.objects.filter(pk=OuterRef('to_account_id')).values('store_id')),
+        ('customer', Customer.objects.filter(pk=OuterRef('customer_id')).values('store_id')),
+        ('stock_entry', StockEntry.objects.filter(pk=OuterRef('stock_entry_id')).values('warehouse__store_id')),
+        ('stock_exit', StockExit.objects.filter(pk=OuterRef('stock_exit_id')).values('warehouse__store_id')),
+        ('created_by', User.objects.filter(pk=OuterRef('created_by_id')).values('store_id')),
+    ]
+    for field, store_subquery in sources:
+        FinancialTransaction.objects.filter(
+            store__isnull=True, **{f'{field}__isnull': False}
+        ).update(store_id=Subquery(store_subquery))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_add_account_balance_constraint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='financialtransaction',
+            name='store',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='financial_transactions', to='api.store'),
+        ),
+        migrations.RunPython(backfill_store, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='financialtransaction',
+            index=models.Index(fields=['store', 'created_at'], name='transaction_store_created_idx'),
+        ),
+    ]
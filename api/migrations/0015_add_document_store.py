@@ -0,0 +1,87 @@
+# Generated by Django 5.2.1 on 2026-10-18 10:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_store(apps, schema_editor):
+    """Renseigne la boutique des documents existants à partir de leur entrepôt"""
+    Warehouse = apps.get_model('api', 'Warehouse')
+    StockExit = apps.get_model('api', 'StockExit')
+
+    for model_name, warehouse_field in [
+        ('StockEntry', 'warehouse_id'),
+        ('StockExit', 'warehouse_id'),
+        ('StockTransfer', 'from_warehouse_id'),
+    ]:
+        apps.get_model('api', model_name).objects.filter(store__isnull=True).update(
+            store_id=Subquery(Warehouse.objects.filter(pk=OuterRef(warehouse_field)).values('store_id'))
+        )
+
+    apps.get_model('api', 'Invoice').objects.filter(store__isnull=True).update(
+        store_id=Subquery(StockExit.objects.filter(pk=OuterRef('stock_exit_id')).values('store_id'))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_add_financialtransaction_store'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='store',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='invoices', to='api.store'),
+        ),
+        migrations.AddField(
+            model_name='stockentry',
+            name='store',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='stock_entries', to='api.store'),
+        ),
+        migrations.AddField(
+            model_name='stockexit',
+            name='store',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='stock_exits', to='api.store'),
+        ),
+        migrations.AddField(
+            model_name='stocktransfer',
+            name='store',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='stock_transfers', to='api.store'),
+        ),
+        migrations.RunPython(backfill_store, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['store', 'created_at'], name='invoice_store_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['store', 'id'], name='invoice_store_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockentry',
+            index=models.Index(fields=['store', 'created_at'], name='stock_entry_store_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockentry',
+            index=models.Index(fields=['store', 'id'], name='stock_entry_store_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockexit',
+            index=models.Index(fields=['store', 'created_at'], name='stock_exit_store_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockexit',
+            index=models.Index(fields=['store', 'id'], name='stock_exit_store_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stocktransfer',
+            index=models.Index(fields=['store', 'created_at'], name='transfer_store_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stocktransfer',
+            index=models.Index(fields=['store', 'id'], name='transfer_store_id_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 10:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_add_export_job'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='exportjob',
+            name='kind',
+            field=models.CharField(choices=[('transactions_xlsx', 'Transactions (Excel)'), ('transactions_pdf', 'Transactions (PDF)'), ('invoice_pdf', 'Facture (PDF)'), ('invoice_pdf_cache', 'Pré-rendu facture (cache)')], max_length=30),
+        ),
+    ]
@@ -0,0 +1,31 @@
+from django.db import migrations
+
+INDEX_NAME = 'token_outstanding_expires_idx'
+TABLE_NAME = 'token_blacklist_outstandingtoken'
+
+
+def create_index(apps, schema_editor):
+    """Index sur expires_at pour la purge des tokens expirés (manage.py prune_tokens)"""
+    # Table d'un paquet tiers : l'index est créé directement en SQL, sans construction
+    # bloquante sur PostgreSQL (CONCURRENTLY, d'où une migration non atomique)
+    concurrently = 'CONCURRENTLY ' if schema_editor.connection.vendor == 'postgresql' else ''
+    schema_editor.execute(
+        f'CREATE INDEX {concurrently}IF NOT EXISTS {INDEX_NAME} ON {TABLE_NAME} (expires_at)'
+    )
+
+
+def drop_index(apps, schema_editor):
+    schema_editor.execute(f'DROP INDEX IF EXISTS {INDEX_NAME}')
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('api', '0018_add_invoice_batch_export'),
+        ('token_blacklist', '0012_alter_outstandingtoken_user'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
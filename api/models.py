@@ -1,9 +1,11 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
 from django.contrib.auth.models import  PermissionsMixin, AbstractBaseUser
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
 from decimal import Decimal
 
-from .manager import UserManager
+from .manager import UserManager, ProductQuerySet, ProductStockQuerySet
 
 class Store(models.Model):
     name = models.CharField(max_length=100, unique=True)
@@ -186,6 +188,8 @@ class Product(models.Model):
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    objects = ProductQuerySet.as_manager()
+    
     def __str__(self):
         return f"{self.reference} - {self.name}"
     
@@ -211,9 +215,11 @@ class Product(models.Model):
 class ProductStock(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stocks')
     warehouse = models.ForeignKey(Warehouse, on_delete=models.CASCADE, related_name='stocks')
-    quantity = models.PositiveIntegerField(default=0)
+    quantity = models.PositiveIntegerField(default=0)  # PositiveIntegerField : contrainte CHECK (quantity >= 0) en base
     last_updated = models.DateTimeField(auto_now=True)
     
+    objects = ProductStockQuerySet.as_manager()
+    
     def __str__(self):
         return f"{self.product.reference} - {self.warehouse.name}: {self.quantity}"
     
@@ -242,6 +248,12 @@ class Account(models.Model):
     
     class Meta:
         unique_together = [['name', 'store']]
+        constraints = [
+            models.CheckConstraint(
+                condition=models.Q(balance__gte=0),
+                name='account_balance_non_negative'
+            ),
+        ]
         verbose_name = "Compte"
         verbose_name_plural = "Comptes"
 
@@ -252,6 +264,8 @@ class StockEntry(models.Model):
     supplier = models.ForeignKey(Supplier, on_delete=models.CASCADE, related_name='stock_entries')
     warehouse = models.ForeignKey(Warehouse, on_delete=models.CASCADE, related_name='stock_entries')
     account = models.ForeignKey(Account, on_delete=models.CASCADE, related_name='stock_entries', blank=True, null=True)  # Compte source pour le paiement
+    # Boutique dénormalisée (renseignée à l'enregistrement) : filtrage et comptage sans jointure
+    store = models.ForeignKey(Store, on_delete=models.CASCADE, related_name='stock_entries', blank=True, null=True)
     total_amount = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('0.00'))
     notes = models.TextField(blank=True, null=True)
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='created_stock_entries')
@@ -261,21 +275,22 @@ class StockEntry(models.Model):
         return f"Entrée {self.entry_number} - {self.supplier.name}"
     
     def save(self, *args, **kwargs):
+        if not self.store_id:
+            self.store_id = self.warehouse.store_id
+        
         if not self.entry_number:
             # Génération automatique du numéro d'entrée
-            last_entry = StockEntry.objects.filter(
-                warehouse__store=self.warehouse.store
-            ).order_by('-id').first()
-            if last_entry:
-                last_number = int(last_entry.entry_number.split('-')[-1])
-                self.entry_number = f"ENT-{self.warehouse.store.id}-{last_number + 1:05d}"
-            else:
-                self.entry_number = f"ENT-{self.warehouse.store.id}-00001"
+            from .sequences import next_document_number
+            self.entry_number = next_document_number(self.store_id, 'stock_entry')
         super().save(*args, **kwargs)
     
     class Meta:
         verbose_name = "Bon d'Entrée"
         verbose_name_plural = "Bons d'Entrée"
+        indexes = [
+            models.Index(fields=['store', 'created_at'], name='stock_entry_store_created_idx'),
+            models.Index(fields=['store', 'id'], name='stock_entry_store_id_idx'),
+        ]
 
 
 # 📥 DÉTAILS DES BONS D'ENTRÉE
@@ -288,16 +303,14 @@ class StockEntryItem(models.Model):
     
     def save(self, *args, **kwargs):
         self.total_price = self.quantity * self.purchase_price
-        super().save(*args, **kwargs)
+        is_new = self._state.adding
         
-        # Mise à jour du stock
-        stock, created = ProductStock.objects.get_or_create(
-            product=self.product,
-            warehouse=self.stock_entry.warehouse,
-            defaults={'quantity': 0}
-        )
-        stock.quantity += self.quantity
-        stock.save()
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            
+            # Mise à jour du stock (incrément atomique, uniquement à la création de l'article)
+            if is_new:
+                ProductStock.objects.increment(self.product, self.stock_entry.warehouse, self.quantity)
     
     def __str__(self):
         return f"{self.product.reference} x{self.quantity}"
@@ -315,6 +328,8 @@ class StockExit(models.Model):
     customer_name = models.CharField(max_length=100, blank=True, null=True)  # Pour clients non enregistrés
     warehouse = models.ForeignKey(Warehouse, on_delete=models.CASCADE, related_name='stock_exits')
     account = models.ForeignKey(Account, on_delete=models.CASCADE, related_name='stock_exits', blank=True, null=True)  # Compte de destination des encaissements
+    # Boutique dénormalisée (renseignée à l'enregistrement) : filtrage et comptage sans jointure
+    store = models.ForeignKey(Store, on_delete=models.CASCADE, related_name='stock_exits', blank=True, null=True)
     total_amount = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('0.00'))  # Montant total à payer
     paid_amount = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('0.00'))  # Montant payé par le client
     remaining_amount = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('0.00'))  # Montant restant dû
@@ -330,16 +345,13 @@ class StockExit(models.Model):
         # Éviter la mise à jour automatique de la dette si on utilise add_payment
         skip_debt_update = kwargs.pop('skip_debt_update', False)
         
+        if not self.store_id:
+            self.store_id = self.warehouse.store_id
+        
         if not self.exit_number:
             # Génération automatique du numéro de sortie
-            last_exit = StockExit.objects.filter(
-                warehouse__store=self.warehouse.store
-            ).order_by('-id').first()
-            if last_exit:
-                last_number = int(last_exit.exit_number.split('-')[-1])
-                self.exit_number = f"SOR-{self.warehouse.store.id}-{last_number + 1:05d}"
-            else:
-                self.exit_number = f"SOR-{self.warehouse.store.id}-00001"
+            from .sequences import next_document_number
+            self.exit_number = next_document_number(self.store_id, 'stock_exit')
         
         # Calculer le montant restant
         old_remaining = Decimal('0.00')
@@ -401,6 +413,10 @@ class StockExit(models.Model):
     class Meta:
         verbose_name = "Bon de Sortie"
         verbose_name_plural = "Bons de Sortie"
+        indexes = [
+            models.Index(fields=['store', 'created_at'], name='stock_exit_store_created_idx'),
+            models.Index(fields=['store', 'id'], name='stock_exit_store_id_idx'),
+        ]
 
 
 # 📤 DÉTAILS DES BONS DE SORTIE
@@ -417,21 +433,18 @@ class StockExitItem(models.Model):
             self.sale_price = self.product.sale_price
         
         self.total_price = self.quantity * self.sale_price
-        super().save(*args, **kwargs)
+        is_new = self._state.adding
         
-        # Mise à jour du stock (retrait)
-        try:
-            stock = ProductStock.objects.get(
-                product=self.product,
-                warehouse=self.stock_exit.warehouse
-            )
-            if stock.quantity >= self.quantity:
-                stock.quantity -= self.quantity
-                stock.save()
-            else:
+        with transaction.atomic():
+            # Mise à jour du stock (retrait conditionnel, uniquement à la création de l'article)
+            warehouse = self.stock_exit.warehouse
+            if is_new and not ProductStock.objects.decrement(self.product, warehouse, self.quantity):
+                stock = ProductStock.objects.filter(product=self.product, warehouse=warehouse).first()
+                if stock is None:
+                    raise ValueError(f"Aucun stock disponible pour {self.product.reference} dans l'entrepôt {warehouse.name}")
                 raise ValueError(f"Stock insuffisant pour {self.product.reference}. Stock disponible: {stock.quantity}, quantité demandée: {self.quantity}")
-        except ProductStock.DoesNotExist:
-            raise ValueError(f"Aucun stock disponible pour {self.product.reference} dans l'entrepôt {self.stock_exit.warehouse.name}")
+            
+            super().save(*args, **kwargs)
     
     def __str__(self):
         return f"{self.product.reference} x{self.quantity} à {self.sale_price} F/u"
@@ -449,6 +462,8 @@ class Invoice(models.Model):
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='invoices', blank=True, null=True)
     customer_name = models.CharField(max_length=100, blank=True, null=True)
     total_amount = models.DecimalField(max_digits=15, decimal_places=2)
+    # Boutique dénormalisée (renseignée à l'enregistrement) : filtrage et comptage sans jointure
+    store = models.ForeignKey(Store, on_delete=models.CASCADE, related_name='invoices', blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
     def __str__(self):
@@ -456,16 +471,13 @@ class Invoice(models.Model):
         return f"Facture {self.invoice_number} - {customer_display}"
     
     def save(self, *args, **kwargs):
+        if not self.store_id:
+            self.store_id = self.stock_exit.store_id or self.stock_exit.warehouse.store_id
+        
         if not self.invoice_number:
             # Génération automatique du numéro de facture
-            last_invoice = Invoice.objects.filter(
-                stock_exit__warehouse__store=self.stock_exit.warehouse.store
-            ).order_by('-id').first()
-            if last_invoice:
-                last_number = int(last_invoice.invoice_number.split('-')[-1])
-                self.invoice_number = f"FAC-{self.stock_exit.warehouse.store.id}-{last_number + 1:05d}"
-            else:
-                self.invoice_number = f"FAC-{self.stock_exit.warehouse.store.id}-00001"
+            from .sequences import next_document_number
+            self.invoice_number = next_document_number(self.store_id, 'invoice')
         
         # Synchronisation du montant total avec le bon de sortie
         self.total_amount = self.stock_exit.total_amount
@@ -474,6 +486,10 @@ class Invoice(models.Model):
     class Meta:
         verbose_name = "Facture"
         verbose_name_plural = "Factures"
+        indexes = [
+            models.Index(fields=['store', 'created_at'], name='invoice_store_created_idx'),
+            models.Index(fields=['store', 'id'], name='invoice_store_id_idx'),
+        ]
 
 
 # 💰 MOUVEMENTS DE FONDS
@@ -499,6 +515,9 @@ class FinancialTransaction(models.Model):
     stock_exit = models.ForeignKey(StockExit, on_delete=models.CASCADE, related_name='transactions', blank=True, null=True)
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='debt_payments', blank=True, null=True)
     
+    # Boutique dénormalisée (renseignée à l'enregistrement) : filtrage par index au lieu d'un OR sur les comptes
+    store = models.ForeignKey(Store, on_delete=models.CASCADE, related_name='financial_transactions', blank=True, null=True)
+    
     description = models.TextField(blank=True, null=True)
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='created_transactions')
     created_at = models.DateTimeField(auto_now_add=True)
@@ -506,36 +525,68 @@ class FinancialTransaction(models.Model):
     def __str__(self):
         return f"{self.transaction_number} - {self.get_transaction_type_display()}: {self.amount}"
     
+    def get_store_id(self):
+        """Boutique de la transaction, déduite des comptes, du client ou du document source"""
+        if self.store_id:
+            return self.store_id
+        for account in (self.from_account, self.to_account):
+            if account:
+                return account.store_id
+        if self.customer:
+            return self.customer.store_id
+        if self.stock_entry:
+            return self.stock_entry.store_id or self.stock_entry.warehouse.store_id
+        if self.stock_exit:
+            return self.stock_exit.store_id or self.stock_exit.warehouse.store_id
+        return self.created_by.store_id if self.created_by_id else None
+    
     def save(self, *args, **kwargs):
-        if not self.transaction_number:
-            # Génération automatique du numéro de transaction
-            from datetime import datetime
-            today = datetime.now().strftime("%Y%m%d")
-            last_transaction = FinancialTransaction.objects.filter(
-                transaction_number__startswith=f"TRX-{today}"
-            ).order_by('-id').first()
-            if last_transaction:
-                last_number = int(last_transaction.transaction_number.split('-')[-1])
-                self.transaction_number = f"TRX-{today}-{last_number + 1:04d}"
-            else:
-                self.transaction_number = f"TRX-{today}-0001"
+        is_new = self._state.adding
         
-        super().save(*args, **kwargs)
+        if not self.store_id:
+            self.store_id = self.get_store_id()
+        if not self.store_id:
+            # Ex: superutilisateur du support (sans boutique) sans compte, client ni document source
+            raise ValidationError({
+                'store': "Impossible de déterminer la boutique de la transaction : "
+                         "indiquez un compte, un client ou un document source."
+            })
         
-        # Mise à jour des soldes des comptes avec vérification
+        with transaction.atomic():
+            if not self.transaction_number:
+                # Génération automatique du numéro de transaction (compteur journalier par boutique)
+                from .sequences import next_transaction_number
+                self.transaction_number = next_transaction_number(self.store_id)
+            
+            super().save(*args, **kwargs)
+            
+            # Mise à jour des soldes des comptes, uniquement à la création de la transaction
+            if is_new:
+                self.apply_to_balances()
+    
+    def apply_to_balances(self):
+        """
+        Débite/crédite les comptes par des UPDATE atomiques (balance = balance ± montant).
+        Le débit est conditionnel (WHERE balance >= montant) : pas de verrou ni de lecture préalable.
+        """
         if self.from_account:
-            if self.from_account.balance < self.amount:
+            debited = Account.objects.filter(
+                pk=self.from_account.pk, balance__gte=self.amount
+            ).update(balance=F('balance') - self.amount)
+            self.from_account.refresh_from_db(fields=['balance'])
+            if not debited:
                 raise ValueError(f"Solde insuffisant dans le compte '{self.from_account.name}'. Solde disponible: {self.from_account.balance} F, montant demandé: {self.amount} F")
-            self.from_account.balance -= self.amount
-            self.from_account.save()
         
         if self.to_account:
-            self.to_account.balance += self.amount
-            self.to_account.save()
+            Account.objects.filter(pk=self.to_account.pk).update(balance=F('balance') + self.amount)
+            self.to_account.refresh_from_db(fields=['balance'])
     
     class Meta:
         verbose_name = "Transaction Financière"
         verbose_name_plural = "Transactions Financières"
+        indexes = [
+            models.Index(fields=['store', 'created_at'], name='transaction_store_created_idx'),
+        ]
 
 
 # 🔄 TRANSFERTS DE STOCK
@@ -550,6 +601,8 @@ class StockTransfer(models.Model):
     from_warehouse = models.ForeignKey(Warehouse, on_delete=models.CASCADE, related_name='outgoing_transfers')
     to_warehouse = models.ForeignKey(Warehouse, on_delete=models.CASCADE, related_name='incoming_transfers')
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    # Boutique dénormalisée (renseignée à l'enregistrement) : filtrage et comptage sans jointure
+    store = models.ForeignKey(Store, on_delete=models.CASCADE, related_name='stock_transfers', blank=True, null=True)
     notes = models.TextField(blank=True, null=True)
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='created_transfers')
     created_at = models.DateTimeField(auto_now_add=True)
@@ -559,16 +612,13 @@ class StockTransfer(models.Model):
         return f"Transfert {self.transfer_number} - {self.from_warehouse.name} → {self.to_warehouse.name}"
     
     def save(self, *args, **kwargs):
+        if not self.store_id:
+            self.store_id = self.from_warehouse.store_id
+        
         if not self.transfer_number:
             # Génération automatique du numéro de transfert
-            last_transfer = StockTransfer.objects.filter(
-                from_warehouse__store=self.from_warehouse.store
-            ).order_by('-id').first()
-            if last_transfer:
-                last_number = int(last_transfer.transfer_number.split('-')[-1])
-                self.transfer_number = f"TRF-{self.from_warehouse.store.id}-{last_number + 1:05d}"
-            else:
-                self.transfer_number = f"TRF-{self.from_warehouse.store.id}-00001"
+            from .sequences import next_document_number
+            self.transfer_number = next_document_number(self.store_id, 'stock_transfer')
         super().save(*args, **kwargs)
     
     def complete_transfer(self):
@@ -577,37 +627,34 @@ class StockTransfer(models.Model):
             raise ValueError("Seuls les transferts en attente peuvent être terminés")
         
         from django.utils import timezone
+        completed_at = timezone.now()
         
-        # Mettre à jour les stocks pour chaque article
-        for item in self.items.all():
-            # Retirer du stock source
-            source_stock = ProductStock.objects.get(
-                product=item.product,
-                warehouse=self.from_warehouse
-            )
-            if source_stock.quantity < item.quantity:
-                raise ValueError(f"Stock insuffisant pour {item.product.reference} dans {self.from_warehouse.name}")
-            
-            source_stock.quantity -= item.quantity
-            source_stock.save()
+        with transaction.atomic():
+            # Marquer comme terminé de façon conditionnelle : un transfert ne peut être exécuté qu'une fois
+            if not StockTransfer.objects.filter(pk=self.pk, status='pending').update(
+                status='completed', completed_at=completed_at
+            ):
+                raise ValueError("Seuls les transferts en attente peuvent être terminés")
             
-            # Ajouter au stock destination
-            dest_stock, created = ProductStock.objects.get_or_create(
-                product=item.product,
-                warehouse=self.to_warehouse,
-                defaults={'quantity': 0}
-            )
-            dest_stock.quantity += item.quantity
-            dest_stock.save()
+            # Mettre à jour les stocks pour chaque article
+            for item in self.items.select_related('product'):
+                # Retirer du stock source
+                if not ProductStock.objects.decrement(item.product, self.from_warehouse, item.quantity):
+                    raise ValueError(f"Stock insuffisant pour {item.product.reference} dans {self.from_warehouse.name}")
+                
+                # Ajouter au stock destination
+                ProductStock.objects.increment(item.product, self.to_warehouse, item.quantity)
         
-        # Marquer comme terminé
         self.status = 'completed'
-        self.completed_at = timezone.now()
-        self.save()
+        self.completed_at = completed_at
     
     class Meta:
         verbose_name = "Transfert de Stock"
         verbose_name_plural = "Transferts de Stock"
+        indexes = [
+            models.Index(fields=['store', 'created_at'], name='transfer_store_created_idx'),
+            models.Index(fields=['store', 'id'], name='transfer_store_id_idx'),
+        ]
 
 
 # 🔄 ARTICLES DES TRANSFERTS
@@ -630,4 +677,63 @@ class StockTransferItem(models.Model):
         unique_together = [['stock_transfer', 'product']]
         verbose_name = "Article de Transfert"
         verbose_name_plural = "Articles de Transfert"
-    
\ No newline at end of file
+    
+
+
+# 🔢 COMPTEURS DE NUMÉROTATION DES DOCUMENTS
+class DocumentSequence(models.Model):
+    """Dernier numéro attribué pour un type de document dans une boutique (voir api/sequences.py)"""
+    store = models.ForeignKey(Store, on_delete=models.CASCADE, related_name='document_sequences')
+    document_type = models.CharField(max_length=30)
+    last_value = models.PositiveBigIntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.store_id} - {self.document_type}: {self.last_value}"
+    
+    class Meta:
+        unique_together = [['store', 'document_type']]
+        verbose_name = "Compteur de Documents"
+        verbose_name_plural = "Compteurs de Documents"
+
+
+# 📄 EXPORTS DIFFÉRÉS
+class ExportJob(models.Model):
+    """Rendu d'export (PDF/Excel) exécuté hors requête par `manage.py run_export_worker` (voir api/exports.py)"""
+    KIND_CHOICES = [
+        ('transactions_xlsx', 'Transactions (Excel)'),
+        ('transactions_pdf', 'Transactions (PDF)'),
+        ('invoice_pdf', 'Facture (PDF)'),
+        ('invoice_batch', 'Factures par lot (ZIP ou PDF)'),
+        ('invoice_pdf_cache', 'Pré-rendu facture (cache)'),  # Interne : alimente le cache des PDF
+    ]
+    # Types pouvant être demandés par l'API (les autres sont planifiés par l'application)
+    USER_KINDS = ['transactions_xlsx', 'transactions_pdf', 'invoice_pdf', 'invoice_batch']
+    STATUS_CHOICES = [
+        ('pending', 'En attente'),
+        ('running', 'En cours'),
+        ('done', 'Terminé'),
+        ('failed', 'Échec'),
+    ]
+    
+    store = models.ForeignKey(Store, on_delete=models.CASCADE, related_name='export_jobs')
+    created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='export_jobs')
+    kind = models.CharField(max_length=30, choices=KIND_CHOICES)
+    params = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    file_path = models.CharField(max_length=255, blank=True)  # Relatif à EXPORTS_ROOT
+    filename = models.CharField(max_length=150, blank=True)  # Nom proposé au téléchargement
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    
+    def __str__(self):
+        return f"Export {self.pk} - {self.get_kind_display()} ({self.get_status_display()})"
+    
+    class Meta:
+        verbose_name = "Export"
+        verbose_name_plural = "Exports"
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='export_job_status_idx'),
+        ]
@@ -0,0 +1,97 @@
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination, PageNumberPagination
+
+
+class StandardPagination(PageNumberPagination):
+    """Pagination par numéro de page (par défaut) ; taille ajustable avec ?page_size="""
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class CreatedAtCursorPagination(CursorPagination):
+    """
+    Pagination par curseur sur (created_at, id) : pas de COUNT(*) ni d'OFFSET,
+    une page profonde coûte autant que la première.
+    Le tri est imposé (du plus récent au plus ancien) ; ?ordering= est ignoré dans ce mode.
+    Le curseur porte le couple (created_at, id), unique : contrairement au curseur de DRF
+    (created_at seul, plus un décalage pour les égalités), aucune ligne n'est sautée ni
+    répétée quand plusieurs lignes ont le même created_at, y compris en revenant en arrière.
+    """
+    ordering = ('-created_at', '-id')
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.cursor = self.decode_cursor(request)
+        reverse = bool(self.cursor and self.cursor.reverse)
+        position = self.decode_position(self.cursor.position) if self.cursor and self.cursor.position else None
+
+        queryset = queryset.order_by(*(('created_at', 'id') if reverse else self.ordering))
+        if position is not None:
+            created_at, pk = position
+            if reverse:
+                queryset = queryset.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk))
+            else:
+                queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+
+        # Une ligne de plus que la page : indique s'il reste des lignes dans ce sens
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_more = len(results) > self.page_size
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        position = self.encode_position(self.page[-1]) if self.page else self.cursor.position
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=position))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        position = self.encode_position(self.page[0]) if self.page else self.cursor.position
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=position))
+
+    def encode_position(self, instance):
+        return f"{instance.created_at.isoformat()}|{instance.pk}"
+
+    def decode_position(self, position):
+        created_at, _, pk = position.rpartition('|')
+        created_at = parse_datetime(created_at)
+        if created_at is None or not pk.isdigit():
+            raise NotFound(self.invalid_cursor_message)
+        return created_at, int(pk)
+
+
+class CursorPaginationMixin:
+    """
+    Mixin pour les listes volumineuses : la pagination par curseur est activée
+    avec ?pagination=cursor (ou dès qu'un ?cursor= est fourni, pour suivre les liens next/previous).
+    """
+    cursor_pagination_class = CreatedAtCursorPagination
+
+    def use_cursor_pagination(self):
+        params = self.request.query_params if self.request is not None else {}
+        return params.get('pagination') == 'cursor' or 'cursor' in params
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator') and self.use_cursor_pagination():
+            self._paginator = self.cursor_pagination_class()
+        return super().paginator
@@ -0,0 +1,187 @@
+"""
+Concaténation de PDF écrite au fil de l'eau.
+
+pypdf.PdfWriter garde en mémoire toutes les pages (et leurs flux) jusqu'à l'écriture
+finale : la mémoire croît avec la taille du document produit. Ici chaque PDF source
+est lu (pypdf.PdfReader), ses objets sont renumérotés et écrits immédiatement dans le
+fichier de sortie, puis le lecteur est libéré. Seules la liste des pages et la table
+des positions des objets restent en mémoire jusqu'à la fin.
+
+Seules les pages et ce qu'elles référencent (contenus, polices, images, annotations)
+sont copiés : les signets et destinations nommées des sources ne sont pas repris.
+
+Pied de page : le nombre total de pages n'est connu qu'à la fin. Avec `footer`, les
+dictionnaires des pages (quelques centaines d'octets chacun) sont gardés jusqu'à `close`,
+qui ajoute à chaque page un court flux de contenu écrivant le texte du pied de page
+(« Page N sur M ») centré en bas de page, en Helvetica (police standard, non embarquée).
+"""
+from collections import deque
+
+from pypdf import PdfReader
+from pypdf.generic import (
+    ArrayObject, DecodedStreamObject, DictionaryObject, IndirectObject, NameObject, NumberObject
+)
+
+PAGES_ROOT = 1
+CATALOG = 2
+
+FOOTER_FONT = '/GesStockFooter'
+FOOTER_FONT_SIZE = 7.5  # 10px
+FOOTER_BASELINE = 26  # points depuis le bas : centré dans une marge de 2 cm
+# Chasses Helvetica (millièmes d'em) des caractères du pied de page ; 556 par défaut (chiffres, minuscules)
+HELVETICA_WIDTHS = {' ': 278, 'P': 667, 'r': 333, 's': 500, 'f': 278, 'i': 222, 'l': 222, 't': 278}
+
+
+class PdfConcatenator:
+    """
+    Écrit dans `fileobj` un PDF formé des pages de chaque source ajoutée avec `append`,
+    dans l'ordre ; `close` termine le document (arbre des pages, table xref).
+    """
+
+    def __init__(self, fileobj, footer=None):
+        """`footer(numéro, total)` : texte du pied de page de chaque page, ajouté à `close`"""
+        self.fileobj = fileobj
+        self.footer = footer
+        self.position = 0
+        self.offsets = {}
+        self.next_number = CATALOG + 1
+        self.pages = []
+        self.deferred_pages = {}
+        self.write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+
+    def write(self, data):
+        self.fileobj.write(data)
+        self.position += len(data)
+
+    def append(self, source):
+        """Ajoute les pages d'un PDF (chemin ou fichier ouvert)"""
+        reader = PdfReader(source)
+        numbers = {}
+        pending = deque()
+
+        def renumber(reference):
+            key = (reference.idnum, reference.generation)
+            if key not in numbers:
+                target = reference.get_object()
+                object_type = target.get('/Type') if isinstance(target, DictionaryObject) else None
+                # Les racines de la source sont remplacées par celles du document produit
+                if object_type == '/Pages':
+                    numbers[key] = PAGES_ROOT
+                elif object_type == '/Catalog':
+                    numbers[key] = CATALOG
+                else:
+                    numbers[key] = self.next_number
+                    self.next_number += 1
+                    pending.append((numbers[key], target))
+            return IndirectObject(numbers[key], 0, None)
+
+        def remap(value):
+            if isinstance(value, IndirectObject):
+                # Sans lecteur : référence déjà renumérotée (objet direct partagé entre plusieurs pages)
+                return value if value.pdf is None else renumber(value)
+            # Valeurs brutes : l'accès habituel de pypdf (value[key]) résout les références
+            if isinstance(value, DictionaryObject):
+                for key in list(value):
+                    value[key] = remap(value.raw_get(key))
+            elif isinstance(value, ArrayObject):
+                for index, item in enumerate(list.__iter__(value)):
+                    value[index] = remap(item)
+            return value
+
+        page_centers = {}
+        for page in reader.pages:
+            # Les attributs hérités (ressources, format) sont recopiés sur chaque page par pypdf
+            page[NameObject('/Parent')] = IndirectObject(PAGES_ROOT, 0, None)
+            if self.footer:
+                own_resources(page)
+            reference = renumber(page.indirect_reference)
+            self.pages.append(reference)
+            page_centers[reference.idnum] = (page.mediabox.left + page.mediabox.right) / 2
+
+        while pending:
+            number, target = pending.popleft()
+            if self.footer and number in page_centers:
+                # Écrit à `close`, une fois le pied de page ajouté
+                self.deferred_pages[number] = (remap(target), page_centers[number])
+            else:
+                self.write_object(number, remap(target))
+
+    def write_object(self, number, value):
+        self.offsets[number] = self.position
+        self.write(f"{number} 0 obj\n".encode())
+        value.write_to_stream(self)
+        self.write(b"\nendobj\n")
+
+    def add_object(self, value):
+        number = self.next_number
+        self.next_number += 1
+        self.write_object(number, value)
+        return IndirectObject(number, 0, None)
+
+    def write_footers(self):
+        """Ajoute le pied de page à chaque page gardée en mémoire puis l'écrit"""
+        font = self.add_object(DictionaryObject({
+            NameObject('/Type'): NameObject('/Font'),
+            NameObject('/Subtype'): NameObject('/Type1'),
+            NameObject('/BaseFont'): NameObject('/Helvetica'),
+            NameObject('/Encoding'): NameObject('/WinAnsiEncoding'),
+        }))
+        # Le contenu de la page est isolé (q ... Q) : son état graphique n'affecte pas le pied de page
+        save_state = self.add_object(content_stream(b"q"))
+
+        total = len(self.pages)
+        for index, reference in enumerate(self.pages, start=1):
+            page, center = self.deferred_pages.pop(reference.idnum)
+            text = self.footer(index, total)
+            width = sum(HELVETICA_WIDTHS.get(char, 556) for char in text) * FOOTER_FONT_SIZE / 1000
+            escaped = text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+            footer = self.add_object(content_stream(
+                f"Q BT {FOOTER_FONT} {FOOTER_FONT_SIZE} Tf {float(center) - width / 2:.2f} {FOOTER_BASELINE} Td "
+                f"({escaped}) Tj ET".encode('cp1252')
+            ))
+
+            contents = page.get('/Contents')
+            contents = list(contents) if isinstance(contents, ArrayObject) else [contents] if contents else []
+            page[NameObject('/Contents')] = ArrayObject([save_state, *contents, footer])
+            page['/Resources'][NameObject('/Font')][NameObject(FOOTER_FONT)] = font
+            self.write_object(reference.idnum, page)
+
+    def close(self):
+        """Écrit l'arbre des pages, le catalogue et la table xref ; retourne le nombre de pages"""
+        if self.footer:
+            self.write_footers()
+        self.write_object(PAGES_ROOT, DictionaryObject({
+            NameObject('/Type'): NameObject('/Pages'),
+            NameObject('/Kids'): ArrayObject(self.pages),
+            NameObject('/Count'): NumberObject(len(self.pages)),
+        }))
+        self.write_object(CATALOG, DictionaryObject({
+            NameObject('/Type'): NameObject('/Catalog'),
+            NameObject('/Pages'): IndirectObject(PAGES_ROOT, 0, None),
+        }))
+
+        xref_position = self.position
+        size = self.next_number
+        self.write(f"xref\n0 {size}\n0000000000 65535 f \n".encode())
+        for number in range(1, size):
+            self.write(f"{self.offsets[number]:010d} 00000 n \n".encode())
+        self.write(
+            f"trailer\n<< /Size {size} /Root {CATALOG} 0 R >>\nstartxref\n{xref_position}\n%%EOF\n".encode()
+        )
+        return len(self.pages)
+
+
+def own_resources(page):
+    """
+    Remplace les ressources de la page (et leur dictionnaire de polices) par des copies propres
+    à la page : la police du pied de page y est ajoutée sans modifier des ressources partagées
+    """
+    resources = DictionaryObject(page.get('/Resources') or {})
+    resources[NameObject('/Font')] = DictionaryObject(resources.get('/Font') or {})
+    page[NameObject('/Resources')] = resources
+
+
+def content_stream(data):
+    stream = DecodedStreamObject()
+    stream.set_data(data)
+    return stream
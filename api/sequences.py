@@ -0,0 +1,189 @@
+"""
+Numérotation des documents par boutique.
+
+Chaque couple (boutique, type de document) possède une ligne DocumentSequence
+incrémentée atomiquement (UPDATE ... SET last_value = last_value + n), ce qui rend
+l'attribution d'un numéro O(1) et sûre entre plusieurs workers gunicorn. Les
+transactions financières utilisent un compteur par boutique et par jour : les compteurs
+des jours passés ne servent plus et sont supprimés (prune_transaction_sequences).
+
+Avec DOCUMENT_SEQUENCE_BLOCK_SIZE > 1, chaque processus réserve un bloc de numéros
+d'un coup et le consomme en mémoire : moins d'écritures sur la ligne compteur, au prix
+de numéros non consécutifs entre workers (et de trous au redémarrage).
+"""
+import re
+import threading
+
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Length
+from django.utils import timezone
+
+from .models import DocumentSequence
+
+
+# type de document -> (préfixe, modèle, champ du numéro)
+DOCUMENT_TYPES = {
+    'stock_entry': ('ENT', 'api.StockEntry', 'entry_number'),
+    'stock_exit': ('SOR', 'api.StockExit', 'exit_number'),
+    'invoice': ('FAC', 'api.Invoice', 'invoice_number'),
+    'stock_transfer': ('TRF', 'api.StockTransfer', 'transfer_number'),
+}
+
+_blocks = {}
+_blocks_lock = threading.Lock()
+_blocks_day = None
+
+
+def next_document_number(store_id, document_type):
+    """Retourne le prochain numéro formaté, ex: ENT-3-00042"""
+    prefix = DOCUMENT_TYPES[document_type][0]
+    return f"{prefix}-{store_id}-{allocate(store_id, document_type):05d}"
+
+
+def next_transaction_number(store_id, day=None):
+    """
+    Retourne le prochain numéro de transaction financière, ex: TRX-3-20250803-0042.
+    Le compteur est propre à chaque boutique et à chaque jour ; au-delà de 9999
+    transactions dans la journée le numéro s'allonge simplement.
+    """
+    today = timezone.localdate().strftime('%Y%m%d')
+    forget_past_days(today)
+    day = day.strftime('%Y%m%d') if day else today
+    return f"TRX-{store_id}-{day}-{allocate(store_id, f'transaction-{day}'):04d}"
+
+
+def forget_past_days(today):
+    """Retire de _blocks les blocs des compteurs journaliers des jours passés (une fois par jour)"""
+    global _blocks_day
+    if today == _blocks_day:
+        return
+    with _blocks_lock:
+        for key in [key for key in _blocks if is_past_day(key[1], today)]:
+            del _blocks[key]
+        _blocks_day = today
+
+
+def is_past_day(document_type, today):
+    return document_type.startswith('transaction-') and document_type < f'transaction-{today}'
+
+
+def prune_transaction_sequences():
+    """
+    Supprime les compteurs journaliers des transactions des jours passés ; retourne leur nombre.
+    Sans risque pour une transaction en cours sur un jour passé : un compteur supprimé
+    est recréé à partir du plus grand numéro déjà attribué ce jour-là (initial_value).
+    """
+    today = timezone.localdate().strftime('%Y%m%d')
+    forget_past_days(today)
+    deleted, _ = DocumentSequence.objects.filter(
+        document_type__startswith='transaction-', document_type__lt=f'transaction-{today}'
+    ).delete()
+    return deleted
+
+
+class PendingBlock:
+    """
+    Bloc réservé par la transaction en cours : consommé par cette transaction, puis publié
+    dans _blocks au commit (callback on_commit). Si la transaction ou le savepoint qui l'a
+    réservé est annulé, Django abandonne le callback, et le bloc avec lui.
+    """
+
+    def __init__(self, key, first, end):
+        self.key = key
+        self.next = first
+        self.end = end
+
+    def take(self):
+        if self.next >= self.end:
+            return None
+        value = self.next
+        self.next += 1
+        return value
+
+    def __call__(self):
+        with _blocks_lock:
+            _blocks[self.key] = [self.next, self.end]
+        # Publié : le reste n'appartient plus à la transaction
+        self.next = self.end
+
+
+def pending_block(key):
+    """Bloc encore ouvert réservé pour `key` par la transaction en cours"""
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        return None
+    for _, callback, _ in connection.run_on_commit:
+        if isinstance(callback, PendingBlock) and callback.key == key:
+            return callback
+    return None
+
+
+def allocate(store_id, document_type):
+    """Attribue la prochaine valeur du compteur (depuis le bloc local si disponible)"""
+    key = (store_id, document_type)
+    with _blocks_lock:
+        block = _blocks.get(key)
+        if block and block[0] < block[1]:
+            value = block[0]
+            block[0] += 1
+            return value
+
+    block_size = max(1, getattr(settings, 'DOCUMENT_SEQUENCE_BLOCK_SIZE', 1))
+    if block_size > 1:
+        # Bloc réservé plus tôt dans la même transaction, pas encore publié
+        block = pending_block(key)
+        value = block.take() if block else None
+        if value is not None:
+            return value
+
+    first = reserve(store_id, document_type, block_size)
+
+    if block_size > 1:
+        # Le reste du bloc n'est mis à disposition des autres transactions qu'une fois la
+        # réservation validée : en cas de rollback le compteur revient en arrière et le bloc est abandonné.
+        transaction.on_commit(PendingBlock(key, first + 1, first + block_size))
+
+    return first
+
+
+def reserve(store_id, document_type, count=1):
+    """Réserve `count` valeurs consécutives et retourne la première"""
+    sequence = DocumentSequence.objects.filter(store_id=store_id, document_type=document_type)
+
+    with transaction.atomic():
+        if not sequence.update(last_value=F('last_value') + count):
+            DocumentSequence.objects.get_or_create(
+                store_id=store_id,
+                document_type=document_type,
+                defaults={'last_value': initial_value(store_id, document_type)}
+            )
+            sequence.update(last_value=F('last_value') + count)
+
+        # La ligne reste verrouillée par l'UPDATE jusqu'à la fin de la transaction
+        last_value = sequence.values_list('last_value', flat=True).get()
+
+    return last_value - count + 1
+
+
+def initial_value(store_id, document_type):
+    """
+    Valeur de départ d'un nouveau compteur : le plus grand numéro déjà attribué
+    avec le format de la boutique, pour ne pas entrer en collision avec l'historique.
+    Calculé en base : le numéro le plus long puis le plus grand (les numéros sont complétés
+    par des zéros à une largeur minimale, un numéro plus long est donc plus grand).
+    """
+    if document_type.startswith('transaction-'):
+        day = document_type[len('transaction-'):]
+        model_label, field = 'api.FinancialTransaction', 'transaction_number'
+        number_prefix = f"TRX-{store_id}-{day}-"
+    else:
+        prefix, model_label, field = DOCUMENT_TYPES[document_type]
+        number_prefix = f"{prefix}-{store_id}-"
+    last_number = apps.get_model(model_label).objects.filter(
+        **{f"{field}__startswith": number_prefix, f"{field}__regex": rf"^{re.escape(number_prefix)}[0-9]+$"}
+    ).order_by(Length(field).desc(), F(field).desc()).values_list(field, flat=True).first()
+
+    return int(last_number[len(number_prefix):]) if last_number else 0
@@ -1,9 +1,10 @@
 from rest_framework import serializers
 from djoser.serializers import UserSerializer, SendEmailResetSerializer
 from djoser.conf import settings
+from django.conf import settings as django_settings
 from django.contrib.auth import get_user_model
 from decimal import Decimal
-from .models import Store, Product, StockEntry, StockExit, StockEntryItem, StockExitItem, Supplier, Warehouse, Customer, Account, Invoice, FinancialTransaction, StockTransfer, StockTransferItem
+from .models import Store, Product, StockEntry, StockExit, StockEntryItem, StockExitItem, Supplier, Warehouse, Customer, Account, Invoice, FinancialTransaction, StockTransfer, StockTransferItem, ExportJob
 # Permission
 import random
 import string
@@ -39,11 +40,6 @@ class CustomTokenObtainPairSerializer(TokenObtainSerializer):
         refresh =self.get_token(user)
         access = refresh.access_token 
 
-        print(f"""For DebugPurpose in apps/authentications/serializers
-                refrseh: {refresh}
-                access: {access}
-                user: {user}
-              """)
         if not refresh or not access:
             raise serializers.ValidationError(_('Token generation failed'))
 
@@ -59,6 +55,13 @@ class CustomTokenObtainPairSerializer(TokenObtainSerializer):
         if not token:
             raise ValueError("Token generation failed")
         token['phone'] = user.phone  # Custom claim
+        
+        # Mode sans état : de quoi authentifier et filtrer par store les lectures sans requête
+        if django_settings.JWT_STATELESS_CLAIMS and user.store_id:
+            from .cache import store_state_version
+            token['store_id'] = user.store_id
+            token['is_staff'] = user.is_staff
+            token['store_version'] = store_state_version(user.store_id)
         return token
 
 class SotoreSerializer(serializers.ModelSerializer):
@@ -159,20 +162,35 @@ class CustomerSerializer(serializers.ModelSerializer):
 
 class ProductSerializer(serializers.ModelSerializer):
     total_stock = serializers.SerializerMethodField()
+    stock_by_warehouse = serializers.SerializerMethodField()
     
     class Meta:
         model = Product
         exclude = ['store']
         
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Le détail par magasin n'est renvoyé que sur demande (?with_warehouses=true)
+        if not self.context.get('with_warehouses'):
+            self.fields.pop('stock_by_warehouse')
     
     def get_total_stock(self, obj):
-        # Calculer le stock total basé sur les entrées et sorties
-        from django.db.models import Sum
-        entries = StockEntryItem.objects.filter(product=obj).aggregate(
-            total=Sum('quantity'))['total'] or 0
-        exits = StockExitItem.objects.filter(product=obj).aggregate(
-            total=Sum('quantity'))['total'] or 0
-        return entries - exits
+        # Utiliser l'annotation du queryset (ProductQuerySet.with_total_stock) si présente
+        total_stock = getattr(obj, 'total_stock', None)
+        if total_stock is None:
+            total_stock = obj.get_total_stock()
+        return total_stock
+    
+    def get_stock_by_warehouse(self, obj):
+        # obj.stocks est préchargé par ProductViewSet.get_queryset
+        return [
+            {
+                'warehouse': stock.warehouse_id,
+                'warehouse_name': stock.warehouse.name,
+                'quantity': stock.quantity,
+            }
+            for stock in obj.stocks.all()
+        ]
 
 
 class StockEntryItemSerializer(serializers.ModelSerializer):
@@ -194,6 +212,7 @@ class StockEntrySerializer(serializers.ModelSerializer):
     class Meta:
         model = StockEntry
         fields = '__all__'
+        read_only_fields = ['store']
 
 
 class StockExitItemSerializer(serializers.ModelSerializer):
@@ -224,6 +243,7 @@ class StockExitSerializer(serializers.ModelSerializer):
     class Meta:
         model = StockExit
         fields = '__all__'
+        read_only_fields = ['store']
     
     def get_customer_name(self, obj):
         if obj.customer:
@@ -281,7 +301,9 @@ class InvoiceSerializer(serializers.ModelSerializer):
     customer_name = serializers.SerializerMethodField()
     stock_exit_number = serializers.CharField(source='stock_exit.exit_number', read_only=True)
     warehouse_name = serializers.CharField(source='stock_exit.warehouse.name', read_only=True)
-    items = serializers.SerializerMethodField()
+    # Sérialiseur imbriqué lié une seule fois pour toute la page ; lit les articles préchargés
+    # par InvoiceViewSet.get_queryset (articles et produits en une requête)
+    items = StockExitItemSerializer(source='stock_exit.items', many=True, read_only=True)
     
     class Meta:
         model = Invoice
@@ -294,10 +316,6 @@ class InvoiceSerializer(serializers.ModelSerializer):
         if obj.customer:
             return obj.customer.name
         return obj.customer_name or 'Client anonyme'
-    
-    def get_items(self, obj):
-        """Récupère les items du bon de sortie associé"""
-        return StockExitItemSerializer(obj.stock_exit.items.all(), many=True).data
 
 
 # Serializer pour les transactions financières
@@ -371,7 +389,7 @@ class StockTransferSerializer(serializers.ModelSerializer):
     class Meta:
         model = StockTransfer
         fields = '__all__'
-        read_only_fields = ['transfer_number', 'completed_at']
+        read_only_fields = ['transfer_number', 'completed_at', 'store']
 
 
 class StockTransferFormSerializer(serializers.Serializer):
@@ -442,4 +460,73 @@ class DebtPaymentSerializer(serializers.Serializer):
                 f"Le montant à rembourser ({data['amount']}) ne peut pas dépasser la dette actuelle ({customer.debt})"
             )
         
-        return data
\ No newline at end of file
+        return data
+
+
+class ExportJobSerializer(serializers.ModelSerializer):
+    kind_display = serializers.CharField(source='get_kind_display', read_only=True)
+    status_display = serializers.CharField(source='get_status_display', read_only=True)
+    
+    class Meta:
+        model = ExportJob
+        fields = [
+            'id', 'kind', 'kind_display', 'params', 'status', 'status_display', 'error',
+            'filename', 'created_at', 'started_at', 'finished_at'
+        ]
+        read_only_fields = ['status', 'error', 'filename', 'created_at', 'started_at', 'finished_at']
+    
+    def validate_kind(self, value):
+        if value not in ExportJob.USER_KINDS:
+            raise serializers.ValidationError("Type d'export non disponible")
+        return value
+    
+    def validate(self, data):
+        params = data.get('params') or {}
+        if not isinstance(params, dict):
+            raise serializers.ValidationError({'params': "Les paramètres doivent être un objet"})
+        
+        # Ne conserver que les paramètres compris par le rendu
+        if data['kind'] == 'invoice_pdf':
+            invoice_id = params.get('invoice_id')
+            store = self.context.get('store')
+            if not invoice_id or not Invoice.objects.filter(id=invoice_id, store=store).exists():
+                raise serializers.ValidationError({'params': "Facture introuvable"})
+            data['params'] = {'invoice_id': int(invoice_id)}
+        elif data['kind'] == 'invoice_batch':
+            data['params'] = self.validate_invoice_batch(params)
+        else:
+            data['params'] = {
+                key: str(params[key]) for key in ('account_id', 'date_from', 'date_to', 'summary') if params.get(key)
+            }
+        return data
+    
+    def validate_invoice_batch(self, params):
+        """Lot de factures : invoice_ids et/ou date_from/date_to, format 'zip' (défaut) ou 'pdf'"""
+        from .utils import filter_invoices
+        
+        batch = {'format': params.get('format') or 'zip'}
+        if batch['format'] not in ('zip', 'pdf'):
+            raise serializers.ValidationError({'params': "Format invalide (zip ou pdf)"})
+        
+        invoice_ids = params.get('invoice_ids')
+        if invoice_ids:
+            try:
+                batch['invoice_ids'] = sorted({int(invoice_id) for invoice_id in invoice_ids})
+            except (TypeError, ValueError):
+                raise serializers.ValidationError({'params': "Identifiants de factures invalides"})
+        for key in ('date_from', 'date_to'):
+            if params.get(key):
+                batch[key] = str(params[key])
+        if len(batch) == 1:
+            raise serializers.ValidationError(
+                {'params': "Indiquez les factures (invoice_ids) ou une période (date_from, date_to)"}
+            )
+        
+        count = filter_invoices(Invoice.objects.filter(store=self.context.get('store')), batch).count()
+        if not count:
+            raise serializers.ValidationError({'params': "Aucune facture ne correspond"})
+        if count > django_settings.INVOICE_BATCH_MAX:
+            raise serializers.ValidationError(
+                {'params': f"Trop de factures ({count}) : {django_settings.INVOICE_BATCH_MAX} au maximum par lot"}
+            )
+        return batch
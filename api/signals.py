@@ -1,10 +1,70 @@
-from django.db.models.signals import post_save, pre_save
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
 from decimal import Decimal
 from .models import (
-    StockExit, Invoice, StockEntry, FinancialTransaction, 
-    StockEntryItem, StockExitItem, StockTransfer, StockTransferItem
+    User, Store, StockExit, Invoice, StockEntry, FinancialTransaction, 
+    StockEntryItem, StockExitItem, StockTransfer, StockTransferItem,
+    Account, Warehouse, Supplier
 )
+from .cache import bump_reference, bump_store_state, bump_version
+from .totals import mark_dirty, refresh_total
+
+
+@receiver([post_save, post_delete], sender=User)
+@receiver([post_save, post_delete], sender=Store)
+def invalidate_auth_cache(sender, instance, **kwargs):
+    """
+    Invalide les utilisateurs authentifiés en cache (api/cache.py) qui dépendent de cet objet,
+    après le commit : une requête concurrente ne peut pas remettre en cache la ligne d'avant
+    la modification sous la nouvelle version
+    """
+    model_name, pk = sender._meta.model_name, instance.pk
+    transaction.on_commit(lambda: bump_version(model_name, pk))
+    
+    # Tokens "claims" (JWT_STATELESS_CLAIMS) du store : contrôle complet à la prochaine lecture.
+    # La mise à jour de last_login et le re-hachage du mot de passe à la connexion
+    # (CustomAuthenticationBackend) ne révoquent rien ; un changement de mot de passe, si.
+    update_fields = set(kwargs.get('update_fields') or ())
+    if update_fields == {'last_login'}:
+        return
+    if update_fields == {'password'} and getattr(instance, '_password_rehash', False):
+        return
+    store_id = instance.pk if sender is Store else instance.store_id
+    if store_id:
+        transaction.on_commit(lambda: bump_store_state(store_id))
+
+
+REFERENCE_DATASETS = {Account: 'accounts', Warehouse: 'warehouses', Supplier: 'suppliers'}
+
+
+@receiver([post_save, post_delete], sender=Account)
+@receiver([post_save, post_delete], sender=Warehouse)
+@receiver([post_save, post_delete], sender=Supplier)
+def invalidate_reference_cache(sender, instance, **kwargs):
+    """
+    Invalide les données de référence en cache du store (api/cache.py), après le commit :
+    une lecture concurrente ne peut pas remettre en cache l'état d'avant la modification
+    """
+    store_id, dataset = instance.store_id, REFERENCE_DATASETS[sender]
+    transaction.on_commit(lambda: bump_reference(store_id, dataset))
+
+
+def default_account(store_id):
+    """
+    Compte utilisé quand un bon n'en précise pas : le premier compte de caisse actif
+    du store, à défaut le premier compte bancaire actif. Résolu en une requête, sans cache :
+    le compte est débité ou crédité, il ne doit jamais être un compte désactivé ou supprimé entre-temps.
+    """
+    from .authentication import deferred_instance
+
+    # 'cash' > 'bank' : le tri décroissant sur le type place les caisses en premier
+    values = Account.objects.filter(
+        store_id=store_id, account_type__in=['cash', 'bank'], is_active=True
+    ).order_by('-account_type', 'pk').values('id', 'name', 'account_type', 'store_id', 'is_active').first()
+    # Solde non chargé : lu par FinancialTransaction.apply_to_balances après la mise à jour
+    return deferred_instance(Account, **values) if values else None
 
 
 @receiver(post_save, sender=StockExit)
@@ -21,6 +81,17 @@ def create_invoice_for_stock_exit(sender, instance, created, **kwargs):
         )
 
 
+@receiver(post_save, sender=Invoice)
+def prerender_invoice_pdf(sender, instance, created, **kwargs):
+    """
+    Planifie le pré-rendu du PDF d'une nouvelle facture, après le commit
+    (les articles du bon de sortie sont alors enregistrés)
+    """
+    if created and settings.INVOICE_PDF_PRERENDER:
+        from .exports import schedule_invoice_prerender
+        transaction.on_commit(lambda: schedule_invoice_prerender(instance))
+
+
 @receiver(post_save, sender=StockEntry)
 def create_financial_transaction_for_purchase(sender, instance, created, **kwargs):
     """
@@ -58,21 +129,9 @@ def create_financial_transaction_for_purchase(sender, instance, created, **kwarg
         from_account = instance.account
         if not from_account:
             print("🔍 Aucun compte spécifié pour l'achat, recherche d'un compte par défaut...")
-            # Si aucun compte n'est spécifié, utilise le premier compte de caisse actif de la boutique
-            from .models import Account
-            from_account = Account.objects.filter(
-                store=instance.warehouse.store,
-                account_type='cash',
-                is_active=True
-            ).first()
-            
-            # Si pas de caisse, utilise le premier compte bancaire actif
-            if not from_account:
-                from_account = Account.objects.filter(
-                    store=instance.warehouse.store,
-                    account_type='bank',
-                    is_active=True
-                ).first()
+            # Si aucun compte n'est spécifié, utilise le premier compte de caisse actif de la boutique,
+            # à défaut le premier compte bancaire actif
+            from_account = default_account(instance.store_id)
             
             if from_account:
                 print(f"📊 Compte par défaut trouvé: {from_account.name}")
@@ -132,21 +191,9 @@ def create_financial_transaction_for_sale(sender, instance, created, **kwargs):
         to_account = instance.account
         if not to_account:
             print("🔍 Aucun compte spécifié, recherche d'un compte par défaut...")
-            # Si aucun compte n'est spécifié, utilise le premier compte de caisse actif de la boutique
-            from .models import Account
-            to_account = Account.objects.filter(
-                store=instance.warehouse.store,
-                account_type='cash',
-                is_active=True
-            ).first()
-            
-            # Si pas de caisse, utilise le premier compte bancaire actif
-            if not to_account:
-                to_account = Account.objects.filter(
-                    store=instance.warehouse.store,
-                    account_type='bank',
-                    is_active=True
-                ).first()
+            # Si aucun compte n'est spécifié, utilise le premier compte de caisse actif de la boutique,
+            # à défaut le premier compte bancaire actif
+            to_account = default_account(instance.store_id)
             
             if to_account:
                 print(f"📊 Compte par défaut trouvé: {to_account.name}")
@@ -172,65 +219,39 @@ def create_financial_transaction_for_sale(sender, instance, created, **kwargs):
 
 
 @receiver(pre_save, sender=StockEntry)
-def calculate_stock_entry_total(sender, instance, **kwargs):
+def calculate_stock_entry_total(sender, instance, update_fields=None, **kwargs):
     """
-    Calcule automatiquement le montant total du bon d'entrée
+    Recalcule le montant total du bon d'entrée (SUM SQL des articles)
     """
-    if instance.pk:
-        total = sum(
-            item.total_price for item in instance.items.all()
-        )
-        instance.total_amount = total
+    if instance.pk and update_fields is None:
+        refresh_total(instance)
 
 
 @receiver(pre_save, sender=StockExit)
-def calculate_stock_exit_total(sender, instance, **kwargs):
+def calculate_stock_exit_total(sender, instance, update_fields=None, **kwargs):
     """
-    Calcule automatiquement le montant total du bon de sortie
+    Recalcule le montant total du bon de sortie (SUM SQL des articles)
     """
-    if instance.pk:
-        total = sum(
-            item.total_price for item in instance.items.all()
-        )
-        instance.total_amount = total
+    if instance.pk and update_fields is None:
+        refresh_total(instance)
 
 
 @receiver(post_save, sender=StockEntryItem)
 def update_stock_entry_total_on_item_change(sender, instance, **kwargs):
     """
     Met à jour le total du bon d'entrée quand un article est modifié
+    (à la fin du bloc deferred_totals() en cours, voir api/totals.py)
     """
-    stock_entry = instance.stock_entry
-    total = sum(
-        item.total_price for item in stock_entry.items.all()
-    )
-    if stock_entry.total_amount != total:
-        stock_entry.total_amount = total
-        stock_entry.save(update_fields=['total_amount'])
+    mark_dirty(instance.stock_entry)
 
 
 @receiver(post_save, sender=StockExitItem)
 def update_stock_exit_total_on_item_change(sender, instance, **kwargs):
     """
-    Met à jour le total du bon de sortie quand un article est modifié
-    """
-    stock_exit = instance.stock_exit
-    total = sum(
-        item.total_price for item in stock_exit.items.all()
-    )
-    if stock_exit.total_amount != total:
-        # Calculer la différence pour la dette avant de mettre à jour
-        if stock_exit.customer:
-            old_remaining = stock_exit.remaining_amount
-            new_remaining = total - stock_exit.paid_amount
-            debt_difference = new_remaining - old_remaining
-            if debt_difference != 0:
-                stock_exit.customer.debt += debt_difference
-                stock_exit.customer.save()
-        
-        stock_exit.total_amount = total
-        stock_exit.remaining_amount = total - stock_exit.paid_amount
-        stock_exit.save(update_fields=['total_amount', 'remaining_amount'], skip_debt_update=True)
+    Met à jour le total du bon de sortie (et la dette du client) quand un article est modifié
+    (à la fin du bloc deferred_totals() en cours, voir api/totals.py)
+    """
+    mark_dirty(instance.stock_exit)
 
 
 @receiver(post_save, sender=FinancialTransaction)
@@ -0,0 +1,156 @@
+"""
+Relevé de compte : mouvements signés, solde courant après chaque mouvement,
+soldes d'ouverture et de clôture sur une période.
+
+Le solde réel du compte (Account.balance) sert d'ancre : le solde après un mouvement
+est le solde actuel moins la somme des mouvements plus récents. La page est lue en
+une requête avec une somme cumulée (fonction fenêtre) et les noms liés ; les soldes
+d'ouverture/clôture d'une période coûtent un agrégat supplémentaire.
+
+La pagination se fait par curseur signé sur (created_at, id) qui transporte aussi le
+solde de reprise : une page profonde coûte autant que la première (ni COUNT, ni OFFSET,
+ni re-somme des mouvements plus récents).
+"""
+import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.core import signing
+from django.db.models import Case, DecimalField, F, Q, Sum, Value, When, Window
+from django.db.models.expressions import RowRange
+from django.db.models.functions import Coalesce
+
+from .models import FinancialTransaction
+
+AMOUNT_FIELD = DecimalField(max_digits=15, decimal_places=2)
+CENT = Decimal('0.01')
+CURSOR_SALT = 'api.statements.cursor'
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(account, created_at, pk, balance):
+    """Curseur signé : position (created_at, id) et solde du compte juste avant ce mouvement"""
+    return signing.dumps([account.pk, created_at.isoformat(), pk, str(balance)], salt=CURSOR_SALT, compress=True)
+
+
+def decode_cursor(account, cursor):
+    """Retourne (created_at, id, solde) à partir d'un curseur émis pour ce compte"""
+    try:
+        account_id, created_at, pk, balance = signing.loads(cursor, salt=CURSOR_SALT)
+        if account_id != account.pk:
+            raise ValueError(account_id)
+        return datetime.datetime.fromisoformat(created_at), int(pk), Decimal(balance)
+    except (signing.BadSignature, ValueError, TypeError, InvalidOperation) as e:
+        raise InvalidCursor("Curseur invalide") from e
+
+
+def signed_amount(account):
+    """Montant signé du point de vue du compte : + entrée, - sortie, 0 pour un virement sur lui-même"""
+    return Case(
+        When(from_account=account, to_account=account, then=Value(Decimal('0.00'))),
+        When(to_account=account, then=F('amount')),
+        default=-F('amount'),
+        output_field=AMOUNT_FIELD,
+    )
+
+
+def sum_signed(account, condition):
+    return Coalesce(
+        Sum(signed_amount(account), filter=condition), Value(Decimal('0.00')), output_field=AMOUNT_FIELD
+    )
+
+
+def account_statement(account, date_from=None, date_to=None, cursor=None, page_size=20):
+    """
+    Relevé du compte du plus récent au plus ancien.
+    `date_from` / `date_to` sont des datetimes (bornes [date_from, date_to[),
+    `cursor` le curseur `next` d'une page précédente.
+    """
+    movements = FinancialTransaction.objects.filter(
+        # store_id est redondant mais permet d'utiliser l'index (store, created_at)
+        Q(from_account=account) | Q(to_account=account), store_id=account.store_id
+    )
+
+    # Soldes de la période : somme des mouvements postérieurs à chaque borne, en une requête
+    # restreinte à l'intervalle le plus large (parcours de l'index (store, created_at))
+    balance = account.balance
+    bounds = {'after_period': date_to, 'from_period_start': date_from}
+    bounds = {name: bound for name, bound in bounds.items() if bound}
+    sums = {}
+    if bounds:
+        sums = movements.filter(created_at__gte=min(bounds.values())).aggregate(**{
+            name: sum_signed(account, Q(created_at__gte=bound)) for name, bound in bounds.items()
+        })
+    closing_balance = balance - sums.get('after_period', Decimal('0.00'))
+    opening_balance = balance - sums['from_period_start'] if date_from else None
+
+    # Solde juste avant (plus récent que) le premier mouvement de la page
+    page_anchor = closing_balance
+    if cursor:
+        cursor_at, cursor_id, page_anchor = decode_cursor(account, cursor)
+
+    page = movements
+    if date_from:
+        page = page.filter(created_at__gte=date_from)
+    if date_to:
+        page = page.filter(created_at__lt=date_to)
+    if cursor:
+        page = page.filter(Q(created_at__lt=cursor_at) | Q(created_at=cursor_at, id__lt=cursor_id))
+
+    ordering = [F('created_at').desc(), F('id').desc()]
+    rows = list(
+        page.annotate(
+            signed_amount=signed_amount(account),
+            newer_total=Window(
+                Sum(signed_amount(account)), order_by=ordering, frame=RowRange(start=None, end=0)
+            ),
+        ).order_by(*ordering).values(
+            'id', 'transaction_number', 'transaction_type', 'amount', 'signed_amount', 'newer_total',
+            'description', 'created_at', 'from_account_id', 'to_account_id',
+            'from_account__name', 'to_account__name', 'stock_exit__exit_number',
+            'stock_entry__entry_number', 'created_by__fullname',
+        )[:page_size + 1]
+    )
+
+    has_next = len(rows) > page_size
+    rows = rows[:page_size]
+    type_labels = dict(FinancialTransaction.TRANSACTION_TYPES)
+
+    results = []
+    for row in rows:
+        # Solde après le mouvement = ancre - mouvements plus récents de la page
+        balance_after = page_anchor - row['newer_total'] + row['signed_amount']
+        results.append({
+            'id': row['id'],
+            'transaction_number': row['transaction_number'],
+            'transaction_type': row['transaction_type'],
+            'transaction_type_display': type_labels.get(row['transaction_type'], row['transaction_type']),
+            'amount': str(row['amount']),
+            # Montants calculés : SQLite ne conserve pas l'échelle (0.00 devient 0)
+            'signed_amount': str(row['signed_amount'].quantize(CENT)),
+            'movement_type': 'credit' if row['to_account_id'] == account.pk else 'debit',
+            'balance_after': str(balance_after.quantize(CENT)),
+            'description': row['description'],
+            'from_account_name': row['from_account__name'],
+            'to_account_name': row['to_account__name'],
+            'stock_exit_number': row['stock_exit__exit_number'],
+            'stock_entry_number': row['stock_entry__entry_number'],
+            'created_by_name': row['created_by__fullname'],
+            'created_at': row['created_at'].isoformat(),
+        })
+
+    next_cursor = None
+    if has_next:
+        last = rows[-1]
+        next_cursor = encode_cursor(account, last['created_at'], last['id'], balance_after - last['signed_amount'])
+
+    return {
+        'account': {'id': account.pk, 'name': account.name, 'balance': str(balance)},
+        'opening_balance': str(opening_balance.quantize(CENT)) if opening_balance is not None else None,
+        'closing_balance': str(closing_balance.quantize(CENT)),
+        'next': next_cursor,
+        'previous': bool(cursor),
+        'results': results,
+    }
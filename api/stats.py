@@ -0,0 +1,85 @@
+from decimal import Decimal
+
+from django.db import models
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Trunc
+
+from .models import FinancialTransaction, Product, StockEntry, StockExit
+
+# Granularités acceptées pour le découpage temporel des statistiques financières
+TRANSACTION_STATS_BUCKETS = ('day', 'week', 'month')
+
+
+def compute_stock_stats(store):
+    """
+    Calcule les statistiques du dashboard stock d'une boutique.
+
+    Le nombre de requêtes est constant (3) quelle que soit la taille du catalogue :
+    le stock et le dernier prix d'achat de chaque produit sont obtenus par
+    sous-requêtes annotées puis agrégés directement en base.
+    """
+    product_stats = Product.objects.filter(
+        store=store
+    ).with_total_stock().with_last_purchase_price().aggregate(
+        products_count=Count('id'),
+        total_stock_value=Sum(
+            F('total_stock') * F('last_purchase_price'),
+            filter=Q(total_stock__gt=0),
+            output_field=models.DecimalField(max_digits=20, decimal_places=2)
+        ),
+        low_stock_count=Count('id', filter=Q(total_stock__lte=F('min_stock_alert'))),
+    )
+
+    return {
+        'products_count': product_stats['products_count'],
+        'entries_count': StockEntry.objects.filter(store=store).count(),
+        'exits_count': StockExit.objects.filter(store=store).count(),
+        'total_stock_value': float(product_stats['total_stock_value'] or 0),
+        'low_stock_count': product_stats['low_stock_count'],
+    }
+
+
+def compute_transaction_stats(queryset, bucket=None):
+    """
+    Statistiques des transactions financières en une seule requête GROUP BY :
+    nombre et montant par type de transaction, et si `bucket` est fourni
+    ('day', 'week' ou 'month'), la même ventilation par période.
+    """
+    columns = ['transaction_type']
+    if bucket:
+        columns.insert(0, 'period')
+        queryset = queryset.annotate(period=Trunc('created_at', bucket))
+
+    rows = queryset.order_by().values(*columns).annotate(
+        count=Count('id'), total=Sum('amount')
+    ).order_by(*columns)
+
+    by_type = {
+        transaction_type: {'count': 0, 'total': Decimal('0.00')}
+        for transaction_type, _ in FinancialTransaction.TRANSACTION_TYPES
+    }
+    series = {}
+    for row in rows:
+        totals = by_type.setdefault(row['transaction_type'], {'count': 0, 'total': Decimal('0.00')})
+        totals['count'] += row['count']
+        totals['total'] += row['total']
+        if bucket:
+            period = series.setdefault(row['period'].date().isoformat(), {})
+            period[row['transaction_type']] = {'count': row['count'], 'total': row['total']}
+
+    stats = {
+        'total_transactions': sum(totals['count'] for totals in by_type.values()),
+        'total_sales': by_type['sale']['total'],
+        'total_purchases': by_type['purchase']['total'],
+        'net_balance': by_type['sale']['total'] - by_type['purchase']['total'],
+        'sales_count': by_type['sale']['count'],
+        'purchases_count': by_type['purchase']['count'],
+        'by_type': by_type,
+    }
+    if bucket:
+        stats['bucket'] = bucket
+        stats['series'] = [
+            {'period': period, 'by_type': period_by_type}
+            for period, period_by_type in series.items()
+        ]
+    return stats
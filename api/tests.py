@@ -1,3 +1,1843 @@
-from django.test import TestCase
+import threading
+from decimal import Decimal
+from unittest import skipIf
 
-# Create your tests here.
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+
+from .models import (
+    User, Store, Warehouse, Supplier, Customer, Product, ProductStock, StockEntry, StockEntryItem,
+    StockExit, StockExitItem, Invoice, Account, FinancialTransaction
+)
+
+
+class StockFixturesMixin:
+    """Jeu de données minimal partagé par les tests"""
+
+    def create_store(self, name='Boutique Test'):
+        store = Store.objects.create(name=name, description='Boutique de test')
+        user = User.objects.create_user(
+            username=f'manager-{store.id}',
+            email=f'manager-{store.id}@test.com',
+            password='secret',
+            store=store,
+            fullname='Manager Test',
+        )
+        warehouse = Warehouse.objects.create(name='Principal', store=store)
+        supplier = Supplier.objects.create(name='Fournisseur', store=store)
+        return store, user, warehouse, supplier
+
+    def create_catalog(self, store, user, warehouse, supplier, size, quantity=10, purchase_price=Decimal('100.00')):
+        """Crée `size` produits avec leur stock et une entrée d'achat, sans passer par les save()"""
+        offset = Product.objects.count()
+        products = Product.objects.bulk_create([
+            Product(reference=f'REF-{offset + i}', name=f'Produit {offset + i}', store=store, min_stock_alert=5)
+            for i in range(size)
+        ])
+        ProductStock.objects.bulk_create([
+            ProductStock(product=product, warehouse=warehouse, quantity=quantity)
+            for product in products
+        ])
+        entry = StockEntry.objects.create(supplier=supplier, warehouse=warehouse, created_by=user)
+        StockEntryItem.objects.bulk_create([
+            StockEntryItem(
+                stock_entry=entry, product=product, quantity=quantity,
+                purchase_price=purchase_price, total_price=quantity * purchase_price
+            )
+            for product in products
+        ])
+        return products
+
+
+class StockStatsTests(StockFixturesMixin, APITestCase):
+    def setUp(self):
+        self.store, self.user, self.warehouse, self.supplier = self.create_store()
+        self.client.force_authenticate(self.user)
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/stock-stats/')
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response.data
+
+    def test_stats_values(self):
+        self.create_catalog(self.store, self.user, self.warehouse, self.supplier, 3)
+        low = self.create_catalog(self.store, self.user, self.warehouse, self.supplier, 2, quantity=2)
+        ProductStock.objects.filter(product=low[0]).update(quantity=0)
+
+        _, data = self.count_queries()
+
+        self.assertEqual(data['products_count'], 5)
+        self.assertEqual(data['entries_count'], 2)
+        self.assertEqual(data['exits_count'], 0)
+        self.assertEqual(data['total_stock_value'], 3 * 10 * 100.0 + 2 * 100.0)
+        self.assertEqual(data['low_stock_count'], 2)
+
+    def test_query_count_does_not_grow_with_catalog(self):
+        self.create_catalog(self.store, self.user, self.warehouse, self.supplier, 5)
+        small_catalog_queries, _ = self.count_queries()
+
+        self.create_catalog(self.store, self.user, self.warehouse, self.supplier, 200)
+        large_catalog_queries, data = self.count_queries()
+
+        self.assertEqual(data['products_count'], 205)
+        self.assertEqual(small_catalog_queries, large_catalog_queries)
+
+
+
+class LowStockTests(StockFixturesMixin, APITestCase):
+    def setUp(self):
+        self.store, self.user, self.warehouse, self.supplier = self.create_store()
+        self.client.force_authenticate(self.user)
+        # Seuil d'alerte : 5 ; stocks 10 (suffisant), 5 (au seuil), 1 (déficit de 4)
+        self.enough, self.at_threshold, self.critical = [
+            self.create_catalog(self.store, self.user, self.warehouse, self.supplier, 1, quantity=quantity)[0]
+            for quantity in (10, 5, 1)
+        ]
+        self.reserve = Warehouse.objects.create(name='Réserve', store=self.store)
+        ProductStock.objects.create(product=self.critical, warehouse=self.reserve, quantity=20)
+
+    def low_stock(self, **params):
+        response = self.client.get('/api/products/low-stock/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_products_at_or_below_threshold_most_critical_first(self):
+        data = self.low_stock()
+        self.assertEqual(data['count'], 1)
+        self.assertEqual([product['id'] for product in data['results']], [self.at_threshold.pk])
+
+        # Stock du seul magasin principal : la réserve ne compte plus
+        data = self.low_stock(warehouse=self.warehouse.pk)
+        self.assertEqual([product['id'] for product in data['results']], [self.critical.pk, self.at_threshold.pk])
+        self.assertEqual([product['total_stock'] for product in data['results']], [1, 5])
+
+        # Produits sans stock dans le magasin demandé : stock nul, même déficit, triés par référence
+        data = self.low_stock(warehouse=self.reserve.pk)
+        self.assertEqual([product['id'] for product in data['results']], [self.enough.pk, self.at_threshold.pk])
+
+    def test_results_are_paginated(self):
+        data = self.low_stock(warehouse=self.warehouse.pk, page_size=1)
+        self.assertEqual((data['count'], len(data['results'])), (2, 1))
+        self.assertIsNotNone(data['next'])
+        self.assertEqual(data['results'][0]['id'], self.critical.pk)
+
+    def test_invalid_or_foreign_warehouse_is_rejected(self):
+        self.assertEqual(self.client.get('/api/products/low-stock/', {'warehouse': 'abc'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/products/low-stock/', {'warehouse': '-1'}).status_code, 400)
+        _, _, other_warehouse, _ = self.create_store('Autre boutique')
+        self.assertEqual(
+            self.client.get('/api/products/low-stock/', {'warehouse': other_warehouse.pk}).status_code, 404
+        )
+
+
+class TransactionStatsTests(StockFixturesMixin, APITestCase):
+    def setUp(self):
+        import datetime
+        from django.utils import timezone
+        self.store, self.user, _, _ = self.create_store()
+        self.client.force_authenticate(self.user)
+        cash = Account.objects.create(name='Caisse', account_type='cash', store=self.store, balance=Decimal('1000.00'))
+
+        # (date, type, montant) : lundi 6 et mercredi 8 janvier (même semaine), lundi 13 janvier, 3 février
+        for day, kind, amount in [
+            ('2025-01-06', 'sale', '100.00'), ('2025-01-06', 'purchase', '40.00'),
+            ('2025-01-08', 'sale', '50.00'), ('2025-01-13', 'sale', '25.00'), ('2025-02-03', 'purchase', '10.00'),
+        ]:
+            accounts = {'to_account': cash} if kind == 'sale' else {'from_account': cash}
+            movement = FinancialTransaction.objects.create(
+                transaction_type=kind, amount=Decimal(amount), created_by=self.user, **accounts
+            )
+            created_at = timezone.make_aware(datetime.datetime.fromisoformat(f'{day}T10:00'))
+            FinancialTransaction.objects.filter(pk=movement.pk).update(created_at=created_at)
+
+    def stats(self, bucket=None):
+        from .stats import compute_transaction_stats
+        with self.assertNumQueries(1):
+            return compute_transaction_stats(FinancialTransaction.objects.filter(store=self.store), bucket)
+
+    def series(self, bucket):
+        return {
+            period['period']: {kind: (totals['count'], totals['total']) for kind, totals in period['by_type'].items()}
+            for period in self.stats(bucket)['series']
+        }
+
+    def test_totals_by_type(self):
+        stats = self.stats()
+        self.assertEqual(stats['total_transactions'], 5)
+        self.assertEqual((stats['sales_count'], stats['total_sales']), (3, Decimal('175.00')))
+        self.assertEqual((stats['purchases_count'], stats['total_purchases']), (2, Decimal('50.00')))
+        self.assertEqual(stats['net_balance'], Decimal('125.00'))
+        self.assertEqual(stats['by_type']['expense'], {'count': 0, 'total': Decimal('0.00')})
+        self.assertNotIn('series', stats)
+
+    def test_bucket_totals(self):
+        self.assertEqual(self.series('day'), {
+            '2025-01-06': {'purchase': (1, Decimal('40.00')), 'sale': (1, Decimal('100.00'))},
+            '2025-01-08': {'sale': (1, Decimal('50.00'))},
+            '2025-01-13': {'sale': (1, Decimal('25.00'))},
+            '2025-02-03': {'purchase': (1, Decimal('10.00'))},
+        })
+        self.assertEqual(self.series('week'), {
+            '2025-01-06': {'purchase': (1, Decimal('40.00')), 'sale': (2, Decimal('150.00'))},
+            '2025-01-13': {'sale': (1, Decimal('25.00'))},
+            '2025-02-03': {'purchase': (1, Decimal('10.00'))},
+        })
+        self.assertEqual(self.series('month'), {
+            '2025-01-01': {'purchase': (1, Decimal('40.00')), 'sale': (3, Decimal('175.00'))},
+            '2025-02-01': {'purchase': (1, Decimal('10.00'))},
+        })
+        self.assertEqual([period['period'] for period in self.stats('month')['series']], ['2025-01-01', '2025-02-01'])
+
+    def test_api_filters_and_rejects_an_invalid_bucket(self):
+        response = self.client.get('/api/financial-transactions/stats/', {
+            'bucket': 'month', 'date_from': '2025-01-07', 'date_to': '2025-01-31'
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total_transactions'], 2)
+        self.assertEqual([period['period'] for period in response.data['series']], ['2025-01-01'])
+
+        response = self.client.get('/api/financial-transactions/stats/', {'bucket': 'hour'})
+        self.assertEqual(response.status_code, 400)
+
+class CursorPaginationTests(StockFixturesMixin, APITestCase):
+    def setUp(self):
+        import datetime
+        from django.utils import timezone
+        self.store, self.user, _, _ = self.create_store()
+        self.client.force_authenticate(self.user)
+
+        # 11 transactions sur 3 horodatages seulement : les égalités de created_at traversent les pages
+        transactions = FinancialTransaction.objects.bulk_create([
+            FinancialTransaction(
+                transaction_number=f"CUR-{i}", transaction_type='expense', amount=Decimal('10.00'),
+                store=self.store, created_by=self.user,
+            )
+            for i in range(11)
+        ])
+        now = timezone.now().replace(microsecond=0)
+        for index, transaction in enumerate(transactions):
+            transaction.created_at = now - datetime.timedelta(hours=index % 3)
+        FinancialTransaction.objects.bulk_update(transactions, ['created_at'])
+        self.expected = [
+            transaction.pk for transaction in sorted(transactions, key=lambda t: (t.created_at, t.pk), reverse=True)
+        ]
+
+    def walk(self, url, direction='next'):
+        pages = []
+        while url:
+            data = self.client.get(url).json()
+            self.assertNotIn('count', data)
+            pages.append([transaction['id'] for transaction in data['results']])
+            url = data[direction]
+        return pages
+
+    def test_cursor_pages_skip_and_repeat_nothing(self):
+        pages = self.walk('/api/financial-transactions/?pagination=cursor&page_size=2')
+
+        self.assertEqual([len(page) for page in pages], [2, 2, 2, 2, 2, 1])
+        self.assertEqual([pk for page in pages for pk in page], self.expected)
+
+    def test_previous_links_walk_back_to_the_first_page(self):
+        url = '/api/financial-transactions/?pagination=cursor&page_size=3'
+        for _ in range(3):
+            url = self.client.get(url).json()['next']
+
+        pages = self.walk(url, direction='previous')
+
+        self.assertEqual([pk for page in reversed(pages) for pk in page], self.expected)
+
+    def test_changing_direction_mid_walk(self):
+        url = '/api/financial-transactions/?pagination=cursor&page_size=4'
+        first = self.client.get(url).json()
+        second = self.client.get(first['next']).json()
+
+        back = self.client.get(second['previous']).json()
+        self.assertEqual([t['id'] for t in back['results']], self.expected[:4])
+        self.assertIsNone(back['previous'])
+        forward = self.client.get(back['next']).json()
+        self.assertEqual([t['id'] for t in forward['results']], self.expected[4:8])
+
+    def test_tampered_cursor_is_rejected(self):
+        from base64 import b64encode
+        for position in ('pas-une-date|3', '2026-01-01T00:00:00+00:00|x'):
+            cursor = b64encode(f"p={position}".encode()).decode()
+            response = self.client.get('/api/financial-transactions/', {'pagination': 'cursor', 'cursor': cursor})
+            self.assertEqual(response.status_code, 404)
+
+    def test_cursor_ordering_ignores_the_ordering_parameter(self):
+        pages = self.walk('/api/financial-transactions/?pagination=cursor&page_size=4&ordering=amount')
+        self.assertEqual([pk for page in pages for pk in page], self.expected)
+
+    def test_page_number_pagination_stays_the_default(self):
+        from django.conf import settings
+        data = self.client.get('/api/financial-transactions/').json()
+
+        self.assertEqual(data['count'], 11)
+        self.assertEqual(len(data['results']), settings.REST_FRAMEWORK['PAGE_SIZE'])
+        self.assertEqual(len(self.client.get('/api/financial-transactions/', {'page_size': 11}).json()['results']), 11)
+
+
+class InvoiceListQueriesTests(StockFixturesMixin, APITestCase):
+    # COUNT, factures (+ bon de sortie, magasin, client), articles (+ produits)
+    expected_queries = 3
+
+    def setUp(self):
+        self.store, self.user, self.warehouse, self.supplier = self.create_store()
+        self.client.force_authenticate(self.user)
+
+    def create_invoices(self, count, lines):
+        """Crée `count` factures (via leurs bons de sortie) de `lines` articles chacune"""
+        products = self.create_catalog(self.store, self.user, self.warehouse, self.supplier, lines)
+        customer = Customer.objects.create(name='Client', store=self.store)
+        exits = [
+            StockExit.objects.create(warehouse=self.warehouse, created_by=self.user, customer=customer if i % 2 else None)
+            for i in range(count)
+        ]
+        StockExitItem.objects.bulk_create([
+            StockExitItem(
+                stock_exit=stock_exit, product=product, quantity=1,
+                sale_price=Decimal('150.00'), total_price=Decimal('150.00')
+            )
+            for stock_exit in exits
+            for product in products
+        ])
+
+    def list_invoices(self, page_size):
+        with self.assertNumQueries(self.expected_queries):
+            response = self.client.get('/api/invoices/', {'page_size': page_size})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_page_of_100_invoices_with_20_lines(self):
+        self.create_invoices(100, 20)
+
+        data = self.list_invoices(100)
+
+        self.assertEqual(data['count'], Invoice.objects.count())
+        self.assertEqual(len(data['results']), 100)
+        for invoice in data['results']:
+            self.assertEqual(len(invoice['items']), 20)
+        item = data['results'][0]['items'][0]
+        self.assertTrue(item['product_name'].startswith('Produit'))
+        self.assertIn('product_sale_price', item)
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        self.create_invoices(10, 3)
+
+        self.assertEqual(len(self.list_invoices(1)['results']), 1)
+        self.assertEqual(len(self.list_invoices(10)['results']), 10)
+
+
+
+class InvoicePdfCacheTests(StockFixturesMixin, APITestCase):
+    def setUp(self):
+        import tempfile
+        from pathlib import Path
+        from unittest import mock
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = Path(directory.name)
+        override = override_settings(INVOICE_PDF_CACHE_ROOT=self.root, INVOICE_PDF_CACHE_MAX_MB=1)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        # Rendu factice : on compte les rendus, WeasyPrint n'est pas exercé ici
+        self.renders = []
+
+        def render_pdf(template_name, context, target=None, stylesheets=None):
+            self.renders.append(context['invoice'].pk)
+            target.write(make_pdf([context['invoice'].invoice_number]).read())
+
+        for name, replacement in (('render_pdf', render_pdf), ('stylesheet', lambda name: None)):
+            patcher = mock.patch(f'api.exports.{name}', replacement)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.store, self.user, self.warehouse, _ = self.create_store()
+        self.client.force_authenticate(self.user)
+        stock_exit = StockExit.objects.create(warehouse=self.warehouse, created_by=self.user, notes='Livraison')
+        self.invoice = stock_exit.invoice
+
+    def cached(self, invoice=None):
+        from .exports import cached_invoice_pdf, invoice_pdf_cache_path, invoice_pdf_context, invoices_for_pdf
+        invoice = invoices_for_pdf(self.store.pk).get(pk=(invoice or self.invoice).pk)
+        with cached_invoice_pdf(invoice) as cached:
+            return invoice_pdf_cache_path(invoice, invoice_pdf_context(invoice)), cached.read()
+
+    def test_pdf_is_rendered_once_per_printed_content(self):
+        first_path, content = self.cached()
+        self.assertEqual(self.cached(), (first_path, content))
+        self.assertEqual(self.renders, [self.invoice.pk])
+        self.assertTrue(content.startswith(b'%PDF'))
+
+        # Une donnée imprimée change : nouvelle clé, nouveau rendu
+        StockExit.objects.filter(pk=self.invoice.stock_exit_id).update(notes='Retrait en boutique')
+        second_path, _ = self.cached()
+        self.assertNotEqual(second_path, first_path)
+        self.assertEqual(len(self.renders), 2)
+
+    def test_template_change_invalidates_the_cache(self):
+        from unittest import mock
+        first_path, _ = self.cached()
+
+        with mock.patch.dict('api.exports._template_digests', {'invoice_pdf.html': 'nouvelle-version'}):
+            second_path, _ = self.cached()
+        self.assertNotEqual(second_path, first_path)
+        self.assertEqual(len(self.renders), 2)
+
+    def test_open_file_survives_eviction(self):
+        import os
+        from .exports import cached_invoice_pdf, invoices_for_pdf
+        self.cached()
+
+        with cached_invoice_pdf(invoices_for_pdf(self.store.pk).get(pk=self.invoice.pk)) as cached:
+            os.remove(cached.name)
+            self.assertTrue(cached.read().startswith(b'%PDF'))
+
+        # Fichier évincé avant l'ouverture : rendu à nouveau
+        response = self.client.get(f'/api/invoices/{self.invoice.pk}/download-pdf/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+        self.assertEqual(len(self.renders), 2)
+
+    def test_batch_reads_the_cached_pdfs(self):
+        import io
+        import zipfile
+        from pypdf import PdfReader
+        from .exports import render_invoice_batch_job
+        from .models import ExportJob
+        second = StockExit.objects.create(warehouse=self.warehouse, created_by=self.user).invoice
+        numbers = [self.invoice.invoice_number, second.invoice_number]
+
+        def render(format):
+            job = ExportJob.objects.create(
+                store=self.store, created_by=self.user, kind='invoice_batch', params={'format': format}
+            )
+            output = io.BytesIO()
+            filename = render_invoice_batch_job(job, output)
+            output.seek(0)
+            return filename, output
+
+        filename, output = render('zip')
+        self.assertEqual(filename, 'factures.zip')
+        with zipfile.ZipFile(output) as archive:
+            self.assertEqual(archive.namelist(), [f'facture_{number}.pdf' for number in numbers])
+
+        filename, output = render('pdf')
+        self.assertEqual(filename, 'factures.pdf')
+        self.assertEqual([page.extract_text() for page in PdfReader(output, strict=True).pages], numbers)
+        # Chaque facture n'a été rendue qu'une fois pour les deux lots
+        self.assertEqual(sorted(self.renders), sorted([self.invoice.pk, second.pk]))
+
+    def test_prune_evicts_least_recently_served_files(self):
+        import os
+        from .exports import prune_invoice_pdf_cache
+        for age, name in enumerate(['recent', 'ancien', 'plus-ancien']):
+            path = self.root / f'{name}.pdf'
+            path.write_bytes(b'0' * 400 * 1024)
+            os.utime(path, (1_000_000 - age * 100, 1_000_000 - age * 100))
+        (self.root / 'rendu-en-cours.part').write_bytes(b'0' * 400 * 1024)
+
+        # 1200 Ko de PDF pour 1 Mo maximum : le plus ancien suffit
+        self.assertEqual(prune_invoice_pdf_cache(), 1)
+        self.assertEqual(
+            sorted(path.name for path in self.root.iterdir()), ['ancien.pdf', 'recent.pdf', 'rendu-en-cours.part']
+        )
+
+        # Un accès rafraîchit la date : le fichier servi n'est plus le moins récent
+        path, _ = self.cached()
+        os.utime(path, (1, 1))
+        self.cached()
+        self.assertGreater(os.stat(path).st_mtime, 1_000_000)
+
+class ReferenceCacheTests(StockFixturesMixin, APITestCase):
+    def setUp(self):
+        import tempfile
+        from django.core.cache import caches
+        # Cache 'reference' en fichiers (partagé par les workers d'une machine), vidé par test
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.use_caches(
+            default={'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            reference={'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory.name},
+        )
+        caches['reference'].clear()
+        self.store, self.user, self.warehouse, self.supplier = self.create_store()
+        self.client.force_authenticate(self.user)
+        self.bank = Account.objects.create(name='Banque', account_type='bank', store=self.store)
+        self.cash = Account.objects.create(name='Caisse', account_type='cash', store=self.store)
+
+    def use_caches(self, **aliases):
+        override = override_settings(CACHES=aliases)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def active_accounts(self, queries):
+        with self.assertNumQueries(queries):
+            response = self.client.get('/api/accounts/active/')
+        self.assertEqual(response.status_code, 200)
+        return {account['name']: account['balance'] for account in response.data}
+
+    def test_active_accounts_cached_with_fresh_balances(self):
+        self.assertEqual(self.active_accounts(2), {'Banque': '0.00', 'Caisse': '0.00'})
+        self.assertEqual(self.active_accounts(1), {'Banque': '0.00', 'Caisse': '0.00'})
+
+        # Solde modifié sans invalidation (autre worker, cache encore valide) : lu en base quand même
+        Account.objects.filter(pk=self.cash.pk).update(balance=Decimal('250.00'))
+        self.assertEqual(self.active_accounts(1)['Caisse'], '250.00')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bank.is_active = False
+            self.bank.save()
+        self.assertEqual(self.active_accounts(2), {'Caisse': '250.00'})
+        self.assertEqual(self.active_accounts(1), {'Caisse': '250.00'})
+
+    def test_versions_are_kept_in_the_shared_default_cache(self):
+        import tempfile
+        from django.core.cache import caches
+        from .cache import bump_reference, reference_version_key
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        # Données en mémoire locale du worker, versions dans le cache partagé
+        self.use_caches(
+            default={'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory.name},
+            reference={'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'reference-tests'},
+        )
+        caches['reference'].clear()
+
+        self.active_accounts(2)
+        self.active_accounts(1)
+        self.assertIsNotNone(caches['default'].get(reference_version_key(self.store.pk, 'accounts')))
+
+        # Modification faite par un autre worker : seule la version partagée change
+        bump_reference(self.store.pk, 'accounts')
+        self.active_accounts(2)
+
+    def test_process_local_caches_disable_the_reference_cache(self):
+        self.use_caches(
+            default={'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            reference={'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'reference-tests'},
+        )
+        self.active_accounts(2)
+        self.active_accounts(2)
+
+    def test_default_account_is_resolved_fresh(self):
+        from .signals import default_account
+
+        with self.assertNumQueries(1):
+            self.assertEqual(default_account(self.store.id).pk, self.cash.pk)
+
+        # Sans invalidation (modification faite par un autre worker) : jamais un compte désactivé
+        Account.objects.filter(pk=self.cash.pk).update(is_active=False)
+        self.assertEqual(default_account(self.store.id).pk, self.bank.pk)
+        self.bank.delete()
+        self.assertIsNone(default_account(self.store.id))
+
+        other_store, *_ = self.create_store('Autre boutique')
+        self.assertIsNone(default_account(other_store.id))
+
+
+class StockEntryPostingTests(StockFixturesMixin, APITestCase):
+    def setUp(self):
+        self.store, self.user, self.warehouse, self.supplier = self.create_store()
+        self.client.force_authenticate(self.user)
+        self.account = Account.objects.create(
+            name='Caisse', account_type='cash', store=self.store, balance=Decimal('1000000.00')
+        )
+
+    def create_products(self, count, stock=None):
+        """Produits du store, avec une ligne de stock de `stock` unités dans l'entrepôt si précisé"""
+        offset = Product.objects.count()
+        products = Product.objects.bulk_create([
+            Product(reference=f'NEW-{offset + i}', name=f'Produit {offset + i}', store=self.store)
+            for i in range(count)
+        ])
+        if stock is not None:
+            ProductStock.objects.bulk_create([
+                ProductStock(product=product, warehouse=self.warehouse, quantity=stock) for product in products
+            ])
+        return products
+
+    def post_entry(self, lines, account=None):
+        return self.client.post('/api/stock-entries/', {
+            'supplier': self.supplier.id,
+            'warehouse': self.warehouse.id,
+            'account': (account or self.account).id,
+            'items': [
+                {'product': str(product.id), 'quantity': str(quantity), 'purchase_price': price}
+                for product, quantity, price in lines
+            ],
+        }, format='json')
+
+    def stock(self, product):
+        return ProductStock.objects.get(product=product, warehouse=self.warehouse).quantity
+
+    def test_entry_updates_existing_rows_and_creates_missing_ones(self):
+        stocked, = self.create_products(1, stock=10)
+        new, = self.create_products(1)
+
+        response = self.post_entry([(stocked, 5, '100.00'), (new, 3, '50.00')])
+
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(self.stock(stocked), 15)
+        self.assertEqual(self.stock(new), 3)
+        entry = StockEntry.objects.get(pk=response.data['id'])
+        self.assertEqual(entry.total_amount, Decimal('650.00'))
+        self.assertEqual(entry.items.count(), 2)
+        purchase = FinancialTransaction.objects.get(stock_entry=entry, transaction_type='purchase')
+        self.assertEqual(purchase.amount, Decimal('650.00'))
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal('999350.00'))
+
+    def test_add_quantities_in_chunks_past_1000_products(self):
+        stocked = self.create_products(600, stock=4)
+        new = self.create_products(600)
+
+        # Une requête INSERT ... ON CONFLICT par tranche de 1000 produits
+        with self.assertNumQueries(2):
+            ProductStock.objects.add_quantities(self.warehouse, {product.id: 2 for product in stocked + new})
+
+        quantities = dict(ProductStock.objects.filter(warehouse=self.warehouse).values_list('product_id', 'quantity'))
+        self.assertEqual(len(quantities), 1200)
+        self.assertEqual({quantities[product.id] for product in stocked}, {6})
+        self.assertEqual({quantities[product.id] for product in new}, {2})
+
+    def test_query_count_does_not_depend_on_line_count(self):
+        def count_queries(lines):
+            products = self.create_products(lines // 2, stock=1) + self.create_products(lines - lines // 2)
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.post_entry([(product, 2, '10.00') for product in products])
+            self.assertEqual(response.status_code, 201, response.data)
+            return len(ctx.captured_queries)
+
+        # Première entrée : création des compteurs de numérotation (une seule fois par store)
+        count_queries(1)
+        self.assertEqual(count_queries(3), count_queries(40))
+
+    def test_insufficient_balance_rolls_back_the_whole_entry(self):
+        stocked, = self.create_products(1, stock=10)
+        poor = Account.objects.create(name='Banque', account_type='bank', store=self.store, balance=Decimal('10.00'))
+
+        response = self.post_entry([(stocked, 5, '100.00')], account=poor)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.stock(stocked), 10)
+        self.assertFalse(StockEntry.objects.filter(account=poor).exists())
+        poor.refresh_from_db()
+        self.assertEqual(poor.balance, Decimal('10.00'))
+
+
+class StockExitPostingTests(StockFixturesMixin, APITestCase):
+    def setUp(self):
+        self.store, self.user, self.warehouse, self.supplier = self.create_store()
+        self.client.force_authenticate(self.user)
+        self.account = Account.objects.create(name='Caisse', account_type='cash', store=self.store)
+        self.customer = Customer.objects.create(name='Client', store=self.store)
+        self.products = self.create_catalog(self.store, self.user, self.warehouse, self.supplier, 3, quantity=10)
+
+    def post_exit(self, lines, **data):
+        return self.client.post('/api/stock-exits/', {
+            'warehouse': self.warehouse.id,
+            'account': self.account.id,
+            'items': [
+                {'product': str(product.id), 'quantity': str(quantity), 'sale_price': price}
+                for product, quantity, price in lines
+            ],
+            **data,
+        }, format='json')
+
+    def stocks(self):
+        return list(
+            ProductStock.objects.filter(warehouse=self.warehouse, product__in=self.products)
+            .order_by('product_id').values_list('quantity', flat=True)
+        )
+
+    def test_exit_decrements_stock_and_writes_totals_invoice_and_sale(self):
+        a, b, c = self.products
+
+        response = self.post_exit([(a, 2, '150.00'), (b, 3, '100.00'), (c, 4, '0')], customer=self.customer.id)
+
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(self.stocks(), [8, 7, 6])
+        stock_exit = StockExit.objects.get(pk=response.data['id'])
+        # Prix nul : prix de vente du produit (0 dans le catalogue de test)
+        self.assertEqual(stock_exit.total_amount, Decimal('600.00'))
+        self.assertEqual(stock_exit.remaining_amount, Decimal('600.00'))
+        self.assertEqual(stock_exit.items.count(), 3)
+        self.assertEqual(Invoice.objects.get(stock_exit=stock_exit).total_amount, Decimal('600.00'))
+        sale = FinancialTransaction.objects.get(stock_exit=stock_exit, transaction_type='sale')
+        self.assertEqual(sale.to_account_id, self.account.id)
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal('600.00'))
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.debt, Decimal('600.00'))
+
+    def test_insufficient_stock_is_rejected_without_changes(self):
+        a, b, _ = self.products
+
+        response = self.post_exit([(a, 2, '150.00'), (b, 11, '100.00')])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['requested_quantity'] for error in response.data['stock_errors']], [11])
+        self.assertEqual(self.stocks(), [10, 10, 10])
+        self.assertFalse(StockExit.objects.exists())
+
+    def test_remove_quantities_skips_rows_without_enough_stock(self):
+        a, b, c = self.products
+
+        updated = ProductStock.objects.remove_quantities(self.warehouse, {a.id: 4, b.id: 11, c.id: 10})
+
+        self.assertEqual(updated, 2)
+        self.assertEqual(self.stocks(), [6, 10, 0])
+
+    def test_stock_changed_during_validation_rolls_back(self):
+        from unittest import mock
+        from .manager import ProductStockQuerySet
+        a, b, _ = self.products
+        remove_quantities = ProductStockQuerySet.remove_quantities
+
+        def concurrent_exit(queryset, warehouse, quantities):
+            # Une autre sortie a vidé le stock de `b` entre la lecture et le retrait
+            ProductStock.objects.filter(product=b, warehouse=warehouse).update(quantity=0)
+            return remove_quantities(queryset, warehouse, quantities)
+
+        with mock.patch.object(ProductStockQuerySet, 'remove_quantities', concurrent_exit):
+            response = self.post_exit([(a, 2, '150.00'), (b, 3, '100.00')])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.stocks(), [10, 10, 10])
+        self.assertFalse(StockExit.objects.exists())
+        self.assertFalse(Invoice.objects.exists())
+
+    def test_query_count_does_not_depend_on_line_count(self):
+        products = self.create_catalog(self.store, self.user, self.warehouse, self.supplier, 40, quantity=10)
+
+        def count_queries(lines):
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.post_exit([(product, 1, '10.00') for product in lines])
+            self.assertEqual(response.status_code, 201, response.data)
+            return len(ctx.captured_queries)
+
+        # Première sortie : création des compteurs de numérotation (une seule fois par store)
+        count_queries(products[:1])
+        self.assertEqual(count_queries(products[:3]), count_queries(products))
+
+
+
+class ConditionalUpdateTests(StockFixturesMixin, TestCase):
+    def setUp(self):
+        self.store, self.user, self.warehouse, self.supplier = self.create_store()
+        self.product, = self.create_catalog(self.store, self.user, self.warehouse, self.supplier, 1)
+        self.cash = Account.objects.create(name='Caisse', account_type='cash', store=self.store)
+
+    def quantity(self, warehouse=None):
+        return ProductStock.objects.get(product=self.product, warehouse=warehouse or self.warehouse).quantity
+
+    def test_decrement_never_goes_below_zero(self):
+        other = Warehouse.objects.create(name='Réserve', store=self.store)
+
+        self.assertFalse(ProductStock.objects.decrement(self.product, self.warehouse, 11))
+        self.assertEqual(self.quantity(), 10)
+        self.assertTrue(ProductStock.objects.decrement(self.product, self.warehouse, 10))
+        self.assertEqual(self.quantity(), 0)
+        # Pas de ligne de stock dans ce magasin : rien à retirer
+        self.assertFalse(ProductStock.objects.decrement(self.product, other, 1))
+        self.assertFalse(ProductStock.objects.filter(product=self.product, warehouse=other).exists())
+
+    def test_debit_beyond_balance_raises_and_changes_nothing(self):
+        FinancialTransaction.objects.create(
+            transaction_type='service', amount=Decimal('100.00'), to_account=self.cash, created_by=self.user
+        )
+        count = FinancialTransaction.objects.count()
+
+        with self.assertRaisesMessage(ValueError, 'Solde insuffisant'):
+            FinancialTransaction.objects.create(
+                transaction_type='expense', amount=Decimal('100.01'), from_account=self.cash, created_by=self.user
+            )
+        self.cash.refresh_from_db()
+        self.assertEqual(self.cash.balance, Decimal('100.00'))
+        self.assertEqual(FinancialTransaction.objects.count(), count)
+
+    def test_transfer_is_completed_only_once(self):
+        from .models import StockTransfer, StockTransferItem
+        reserve = Warehouse.objects.create(name='Réserve', store=self.store)
+        transfer = StockTransfer.objects.create(from_warehouse=self.warehouse, to_warehouse=reserve, created_by=self.user)
+        StockTransferItem.objects.create(stock_transfer=transfer, product=self.product, quantity=4)
+        # Deux requêtes concurrentes ont chargé le transfert encore en attente
+        stale = StockTransfer.objects.get(pk=transfer.pk)
+
+        transfer.complete_transfer()
+        with self.assertRaisesMessage(ValueError, 'Seuls les transferts en attente'):
+            stale.complete_transfer()
+
+        self.assertEqual((self.quantity(), self.quantity(reserve)), (6, 4))
+        transfer.refresh_from_db()
+        self.assertEqual(transfer.status, 'completed')
+
+    @skipIf(connection.vendor == 'sqlite', "SQLite ne peut pas retirer une contrainte dans une transaction")
+    def test_balance_constraint_migration_lists_negative_balances(self):
+        from importlib import import_module
+        from django.apps import apps
+        migration = import_module('api.migrations.0013_add_account_balance_constraint')
+        migration.check_negative_balances(apps, None)
+
+        # Solde négatif antérieur à la contrainte (admin, correction manuelle)
+        constraint, = [c for c in Account._meta.constraints if c.name == 'account_balance_non_negative']
+        with connection.cursor() as cursor:
+            # Clés étrangères différées des insertions du test : vérifiées avant l'ALTER TABLE
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        with connection.schema_editor() as editor:
+            editor.remove_constraint(Account, constraint)
+        Account.objects.filter(pk=self.cash.pk).update(balance=Decimal('-5.00'))
+
+        with self.assertRaisesMessage(RuntimeError, 'Boutique Test / Caisse : -5.00'):
+            migration.check_negative_balances(apps, None)
+
+class DocumentTotalsTests(StockFixturesMixin, TestCase):
+    def setUp(self):
+        self.store, self.user, self.warehouse, self.supplier = self.create_store()
+        self.products = self.create_catalog(self.store, self.user, self.warehouse, self.supplier, 3, quantity=10)
+        self.account = Account.objects.create(
+            name='Caisse', account_type='cash', store=self.store, balance=Decimal('1000.00')
+        )
+
+    def create_entry(self, prices):
+        """Bon d'entrée dont les articles sont enregistrés un par un (signaux post_save)"""
+        entry = StockEntry.objects.create(
+            supplier=self.supplier, warehouse=self.warehouse, account=self.account, created_by=self.user
+        )
+        for product, price in zip(self.products, prices):
+            StockEntryItem.objects.create(
+                stock_entry=entry, product=product, quantity=1, purchase_price=Decimal(price)
+            )
+        return entry
+
+    def stock(self):
+        return sum(ProductStock.objects.filter(warehouse=self.warehouse).values_list('quantity', flat=True))
+
+    def test_total_is_visible_inside_the_transaction(self):
+        from django.db import transaction
+
+        with transaction.atomic():
+            entry = self.create_entry(['100.00', '50.00'])
+            self.assertEqual(StockEntry.objects.get(pk=entry.pk).total_amount, Decimal('150.00'))
+
+    def test_deferred_totals_recalculates_once_with_the_full_amount(self):
+        from .totals import deferred_totals
+
+        with deferred_totals():
+            entry = self.create_entry(['100.00', '50.00', '25.00'])
+
+        entry.refresh_from_db()
+        self.assertEqual(entry.total_amount, Decimal('175.00'))
+        purchase = FinancialTransaction.objects.get(stock_entry=entry)
+        self.assertEqual(purchase.amount, Decimal('175.00'))
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal('825.00'))
+
+    def test_exit_total_updates_remaining_amount_and_customer_debt(self):
+        from .totals import deferred_totals
+        customer = Customer.objects.create(name='Client', store=self.store)
+
+        with deferred_totals():
+            stock_exit = StockExit.objects.create(
+                warehouse=self.warehouse, customer=customer, account=self.account, created_by=self.user
+            )
+            for product in self.products[:2]:
+                StockExitItem.objects.create(stock_exit=stock_exit, product=product, quantity=2, sale_price=Decimal('30.00'))
+
+        stock_exit.refresh_from_db()
+        customer.refresh_from_db()
+        self.assertEqual(stock_exit.total_amount, Decimal('120.00'))
+        self.assertEqual(stock_exit.remaining_amount, Decimal('120.00'))
+        self.assertEqual(customer.debt, Decimal('120.00'))
+
+    def test_insufficient_balance_rolls_back_items_stock_and_document(self):
+        from django.db import transaction
+        from .totals import deferred_totals
+        stock_before = self.stock()
+
+        for block in (deferred_totals, transaction.atomic):
+            with self.subTest(block=block.__name__):
+                with self.assertRaises(ValueError):
+                    with block():
+                        self.create_entry(['1200.00', '50.00'])
+
+                self.assertFalse(StockEntry.objects.filter(account=self.account).exists())
+                self.assertFalse(FinancialTransaction.objects.exists())
+                self.assertEqual(self.stock(), stock_before)
+                self.account.refresh_from_db()
+                self.assertEqual(self.account.balance, Decimal('1000.00'))
+
+
+
+class AccountStatementTests(StockFixturesMixin, APITestCase):
+    def setUp(self):
+        import datetime
+        from django.utils import timezone
+        self.store, self.user, _, _ = self.create_store()
+        self.cash = Account.objects.create(name='Caisse', account_type='cash', store=self.store)
+        self.bank = Account.objects.create(name='Banque', account_type='bank', store=self.store)
+        self.start = timezone.make_aware(datetime.datetime(2025, 1, 1))
+
+        # (jour, type, compte débité, compte crédité, montant) ; plusieurs mouvements le même instant
+        movements = [
+            (0, 'service', None, self.cash, '1000.00'),
+            (0, 'expense', self.cash, None, '120.00'),
+            (1, 'transfer', self.cash, self.bank, '300.00'),
+            (1, 'transfer', self.cash, self.cash, '50.00'),
+            (2, 'service', None, self.bank, '999.00'),
+            (2, 'transfer', self.bank, self.cash, '75.50'),
+            (3, 'expense', self.cash, None, '10.25'),
+            (3, 'service', None, self.cash, '40.00'),
+            (4, 'expense', self.cash, None, '200.00'),
+            (5, 'service', None, self.cash, '15.00'),
+        ]
+        self.expected = []
+        balance = Decimal('0.00')
+        for day, kind, from_account, to_account, amount in movements:
+            movement = FinancialTransaction.objects.create(
+                transaction_type=kind, amount=Decimal(amount), from_account=from_account,
+                to_account=to_account, created_by=self.user
+            )
+            created_at = self.start + datetime.timedelta(days=day)
+            FinancialTransaction.objects.filter(pk=movement.pk).update(created_at=created_at)
+            if self.cash in (from_account, to_account):
+                signed = Decimal('0.00') if from_account == to_account else (
+                    Decimal(amount) if to_account == self.cash else -Decimal(amount)
+                )
+                balance += signed
+                self.expected.append((created_at, movement.pk, signed, balance))
+        self.cash.refresh_from_db()
+
+    def day(self, offset):
+        import datetime
+        return self.start + datetime.timedelta(days=offset)
+
+    def balance_before(self, bound):
+        """Solde du compte juste avant `bound`, recalculé à la main"""
+        balances = [balance for created_at, _, _, balance in self.expected if created_at < bound]
+        return balances[-1] if balances else Decimal('0.00')
+
+    def test_pages_carry_the_running_balance(self):
+        from .statements import account_statement
+        self.assertEqual(self.cash.balance, self.expected[-1][3])
+
+        seen, cursor, pages = [], None, 0
+        while True:
+            statement = account_statement(self.cash, cursor=cursor, page_size=3)
+            self.assertEqual(statement['previous'], cursor is not None)
+            seen += [(row['id'], Decimal(row['balance_after'])) for row in statement['results']]
+            pages += 1
+            cursor = statement['next']
+            if cursor is None:
+                break
+
+        newest_first = sorted(self.expected, key=lambda movement: (movement[0], movement[1]), reverse=True)
+        self.assertEqual(pages, 3)
+        self.assertEqual(seen, [(pk, balance) for _, pk, _, balance in newest_first])
+
+    def test_opening_and_closing_balances(self):
+        from .statements import account_statement
+
+        statement = account_statement(self.cash)
+        self.assertIsNone(statement['opening_balance'])
+        self.assertEqual(Decimal(statement['closing_balance']), self.cash.balance)
+
+        statement = account_statement(self.cash, date_from=self.day(1), date_to=self.day(3), page_size=100)
+        self.assertEqual(Decimal(statement['opening_balance']), self.balance_before(self.day(1)))
+        self.assertEqual(Decimal(statement['closing_balance']), self.balance_before(self.day(3)))
+        self.assertEqual(
+            {row['id'] for row in statement['results']},
+            {pk for created_at, pk, _, _ in self.expected if self.day(1) <= created_at < self.day(3)}
+        )
+        # Le dernier mouvement de la période aboutit au solde de clôture
+        self.assertEqual(statement['results'][0]['balance_after'], statement['closing_balance'])
+
+        statement = account_statement(self.cash, date_from=self.day(4))
+        self.assertEqual(Decimal(statement['opening_balance']), self.balance_before(self.day(4)))
+        self.assertEqual(Decimal(statement['closing_balance']), self.cash.balance)
+
+    def test_self_transfer_contributes_nothing(self):
+        from .statements import account_statement
+        self_transfer = FinancialTransaction.objects.get(from_account=self.cash, to_account=self.cash)
+
+        rows = {row['id']: row for row in account_statement(self.cash, page_size=100)['results']}
+        self.assertEqual(rows[self_transfer.pk]['signed_amount'], '0.00')
+        self.assertEqual(len(rows), len(self.expected))
+
+    def test_foreign_or_tampered_cursor_is_rejected(self):
+        from .statements import account_statement
+        self.client.force_authenticate(self.user)
+        url = f'/api/accounts/{self.cash.pk}/transactions/'
+
+        response = self.client.get(url, {'page_size': 3})
+        self.assertEqual(response.status_code, 200)
+        cursor = response.data['next']
+        self.assertEqual(self.client.get(url, {'page_size': 3, 'cursor': cursor}).status_code, 200)
+
+        bank_cursor = account_statement(self.bank, page_size=1)['next']
+        self.assertEqual(self.client.get(url, {'cursor': bank_cursor}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'cursor': cursor[:-2] + 'xx'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'cursor': 'abc'}).status_code, 400)
+
+class AuthUserCacheTests(StockFixturesMixin, APITestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from .cache import auth_users
+        # Caches mémoire partagés entre les tests : un id réutilisé retrouverait ses entrées
+        cache.clear()
+        auth_users.clear()
+        self.store, self.user, self.warehouse, self.supplier = self.create_store()
+
+    def authenticate(self, user=None):
+        from rest_framework_simplejwt.tokens import AccessToken
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user or self.user)}')
+
+    def get_accounts(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/accounts/')
+        return response.status_code, len(ctx.captured_queries)
+
+    def test_ttl_cache_evicts_least_recently_read_and_expired_entries(self):
+        from unittest import mock
+        from .cache import TTLCache
+
+        entries = TTLCache(maxsize=2, ttl=60)
+        entries.set('a', 1)
+        entries.set('b', 2)
+        entries.get('a')
+        entries.set('c', 3)
+        self.assertEqual((entries.get('a'), entries.get('b'), entries.get('c')), (1, None, 3))
+
+        with mock.patch('api.cache.time.monotonic', return_value=10 ** 9):
+            self.assertIsNone(entries.get('a'))
+
+        disabled = TTLCache(maxsize=2, ttl=0)
+        disabled.set('a', 1)
+        self.assertIsNone(disabled.get('a'))
+
+    def test_cached_user_is_loaded_once_and_served_as_copies(self):
+        from .cache import get_cached_user
+        loads = []
+
+        def load_user(user_id):
+            loads.append(user_id)
+            return User.objects.select_related('store').get(pk=user_id)
+
+        first = get_cached_user(self.user.pk, 'jti-1', load_user)
+        first.fullname = 'Modifié par une requête'
+        first.store.name = 'Modifiée'
+        with self.assertNumQueries(0):
+            second = get_cached_user(self.user.pk, 'jti-1', load_user)
+
+        self.assertEqual(loads, [self.user.pk])
+        self.assertEqual(second.fullname, 'Manager Test')
+        self.assertEqual(second.store.name, 'Boutique Test')
+        get_cached_user(self.user.pk, 'jti-2', load_user)
+        self.assertEqual(len(loads), 2)
+
+    def test_warm_requests_skip_the_user_and_store_queries(self):
+        self.authenticate()
+        status_code, cold = self.get_accounts()
+        self.assertEqual(status_code, 200)
+        self.assertEqual(self.get_accounts(), (200, cold - 1))
+
+    def test_versions_are_bumped_only_after_commit(self):
+        from .cache import current_versions
+        versions = current_versions(self.user.pk, self.store.pk)
+
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            self.user.fullname = 'Nouveau nom'
+            self.user.save()
+            # Avant le commit, une requête concurrente lirait encore l'ancienne ligne
+            self.assertEqual(current_versions(self.user.pk, self.store.pk), versions)
+
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(current_versions(self.user.pk, self.store.pk), versions)
+
+    def test_user_and_store_changes_reach_cached_requests(self):
+        self.authenticate()
+        _, cold = self.get_accounts()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.fullname = 'Nouveau nom'
+            self.user.save()
+        self.assertEqual(self.get_accounts(), (200, cold))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.store.name = 'Boutique renommée'
+            self.store.save()
+        self.assertEqual(self.get_accounts(), (200, cold))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(self.get_accounts()[0], 401)
+
+    def test_permission_changes_apply_without_invalidation(self):
+        from django.contrib.auth.models import Permission
+        from .cache import get_cached_user
+        load_user = lambda user_id: User.objects.select_related('store').get(pk=user_id)
+
+        self.assertFalse(get_cached_user(self.user.pk, 'jti', load_user).has_perm('api.view_account'))
+        self.user.user_permissions.add(Permission.objects.get(codename='view_account'))
+
+        # Les permissions ne sont pas en cache : chaque requête reçoit une copie sans _perm_cache
+        self.assertTrue(get_cached_user(self.user.pk, 'jti', load_user).has_perm('api.view_account'))
+
+
+
+@override_settings(JWT_STATELESS_CLAIMS=True)
+class StatelessClaimsTests(StockFixturesMixin, APITestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from .cache import auth_users
+        cache.clear()
+        auth_users.clear()
+        self.store, self.user, self.warehouse, self.supplier = self.create_store()
+
+    def issue_token(self):
+        from .serializers import CustomTokenObtainPairSerializer
+        access = CustomTokenObtainPairSerializer.get_token(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        return access
+
+    def test_tokens_carry_store_claims(self):
+        from .cache import store_state_version
+        access = self.issue_token()
+
+        self.assertEqual(access['store_id'], self.store.pk)
+        self.assertEqual(access['is_staff'], self.user.is_staff)
+        self.assertEqual(access['store_version'], store_state_version(self.store.pk))
+
+        with override_settings(JWT_STATELESS_CLAIMS=False):
+            self.assertNotIn('store_id', self.issue_token())
+
+    def test_reads_skip_the_user_and_store_queries(self):
+        from unittest import mock
+        from .authentication import CustomJWTAuthentication
+        self.issue_token()
+
+        with mock.patch.object(CustomJWTAuthentication, 'get_user', wraps=CustomJWTAuthentication().get_user) as get_user:
+            self.assertEqual(self.client.get('/api/accounts/').status_code, 200)
+        get_user.assert_not_called()
+
+    def test_stale_store_version_falls_back_to_the_full_check(self):
+        self.issue_token()
+        self.assertEqual(self.client.get('/api/accounts/').status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(self.client.get('/api/accounts/').status_code, 401)
+
+    def test_writes_bypass_the_claims(self):
+        from unittest import mock
+        from .authentication import CustomJWTAuthentication
+        self.issue_token()
+
+        with mock.patch.object(CustomJWTAuthentication, 'get_stateless_user') as get_stateless_user:
+            self.client.post('/api/logout/')
+        get_stateless_user.assert_not_called()
+
+    def test_logout_revokes_the_access_token(self):
+        self.issue_token()
+        self.assertEqual(self.client.get('/api/accounts/').status_code, 200)
+
+        self.assertEqual(self.client.post('/api/logout/').status_code, 205)
+        self.assertEqual(self.client.get('/api/accounts/').status_code, 401)
+        with override_settings(JWT_STATELESS_CLAIMS=False):
+            self.assertEqual(self.client.get('/api/accounts/').status_code, 401)
+
+    def test_process_local_cache_is_refused(self):
+        from .checks import check_stateless_claims_cache
+        locmem = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        filebased = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache'}}
+        redis = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache'}}
+
+        with override_settings(CACHES=locmem):
+            self.assertEqual([m.id for m in check_stateless_claims_cache(None)], ['api.E001'])
+        with override_settings(CACHES=filebased):
+            self.assertEqual([m.id for m in check_stateless_claims_cache(None)], ['api.W001'])
+        with override_settings(CACHES=redis):
+            self.assertEqual(check_stateless_claims_cache(None), [])
+        with override_settings(CACHES=locmem, JWT_STATELESS_CLAIMS=False):
+            self.assertEqual(check_stateless_claims_cache(None), [])
+
+
+class CustomAuthenticationBackendTests(StockFixturesMixin, TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        # Coût réduit : les tests comptent les requêtes et les re-hachages, pas la durée
+        override = override_settings(PASSWORD_HASH_ITERATIONS=1000)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.store, self.user, _, _ = self.create_store()
+
+    def authenticate(self, username='manager', password='secret', store_name='Boutique Test'):
+        from .authentication import CustomAuthenticationBackend
+        if username == 'manager':
+            username = self.user.username
+        return CustomAuthenticationBackend().authenticate(
+            None, username=username, password=password, store_name=store_name
+        )
+
+    def test_login_reads_user_and_store_in_one_query(self):
+        with self.assertNumQueries(1):
+            user = self.authenticate()
+
+        self.assertEqual(user, self.user)
+        with self.assertNumQueries(0):
+            self.assertEqual(user.store, self.store)
+
+    def test_refused_logins(self):
+        self.assertIsNone(self.authenticate(password='wrong'))
+        self.assertIsNone(self.authenticate(store_name='Boutique Inconnue'))
+
+        other_store, _, _, _ = self.create_store('Autre Boutique')
+        self.assertIsNone(self.authenticate(store_name='Autre Boutique'))
+
+        Store.objects.filter(pk=self.store.pk).update(is_active=False)
+        self.assertIsNone(self.authenticate())
+
+    def test_superuser_without_store_logs_in_without_store_name(self):
+        support = User.objects.create_superuser(
+            username='support', email='support@test.com', password='support-secret', fullname='Support'
+        )
+
+        self.assertEqual(self.authenticate('support', 'support-secret', store_name=None), support)
+        self.assertIsNone(self.authenticate('support', 'support-secret'))
+        # Un utilisateur de boutique ne se connecte pas sans boutique
+        self.assertIsNone(self.authenticate(store_name=None))
+
+    def test_password_is_rehashed_when_iterations_change(self):
+        from .cache import store_state_version
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$1000$'))
+        version = store_state_version(self.store.pk)
+
+        with override_settings(PASSWORD_HASH_ITERATIONS=2000), self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.authenticate(), self.user)
+
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$2000$'))
+        # Même mot de passe re-haché : les tokens du store restent valides
+        self.assertEqual(store_state_version(self.store.pk), version)
+        self.assertFalse(hasattr(self.user, '_password_rehash'))
+
+    def test_password_change_revokes_store_claims(self):
+        from .cache import store_state_version
+        version = store_state_version(self.store.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.set_password('nouveau')
+            self.user.save(update_fields=['password'])
+        self.assertGreater(store_state_version(self.store.pk), version)
+
+        version = store_state_version(self.store.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save(update_fields=['last_login'])
+        self.assertEqual(store_state_version(self.store.pk), version)
+
+
+class PruneTokensTests(StockFixturesMixin, TestCase):
+    def setUp(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+        _, self.user, _, _ = self.create_store()
+        now = timezone.now()
+
+        def tokens(prefix, count, expires_at):
+            return OutstandingToken.objects.bulk_create(
+                OutstandingToken(user=self.user, jti=f'{prefix}-{i}', token=f'{prefix}-{i}', expires_at=expires_at)
+                for i in range(count)
+            )
+
+        expired = tokens('expire', 7, now - timedelta(days=1))
+        valid = tokens('valide', 3, now + timedelta(days=1))
+        BlacklistedToken.objects.bulk_create(BlacklistedToken(token=token) for token in expired[:2] + valid[:1])
+
+    def prune(self, *args):
+        from io import StringIO
+        from django.core.management import call_command
+        out = StringIO()
+        call_command('prune_tokens', '--pause', '0', *args, stdout=out)
+        return out.getvalue()
+
+    def remaining(self):
+        from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+        return (
+            sorted(OutstandingToken.objects.values_list('jti', flat=True)),
+            sorted(BlacklistedToken.objects.values_list('token__jti', flat=True)),
+        )
+
+    def test_expired_tokens_are_deleted_in_batches(self):
+        output = self.prune('--batch-size', '3')
+
+        self.assertIn('7 token(s) et 2 entrée(s) de blacklist supprimés en 3 lot(s)', output)
+        self.assertEqual(self.remaining(), (['valide-0', 'valide-1', 'valide-2'], ['valide-0']))
+
+    def test_max_batches_stops_early(self):
+        self.prune('--batch-size', '3', '--max-batches', '1')
+        self.assertEqual(len(self.remaining()[0]), 7)
+
+    def test_dry_run_deletes_nothing(self):
+        before = self.remaining()
+        output = self.prune('--dry-run')
+
+        self.assertIn('tokens expirés : 7', output)
+        self.assertEqual(self.remaining(), before)
+
+
+def make_pdf(labels):
+    """PDF d'une page par libellé : police et ressources partagées, lien vers la page suivante"""
+    from io import BytesIO
+    from pypdf import PdfWriter
+    from pypdf.generic import ArrayObject, DecodedStreamObject, DictionaryObject, FloatObject, NameObject
+
+    writer = PdfWriter()
+    font = writer._add_object(DictionaryObject({
+        NameObject('/Type'): NameObject('/Font'),
+        NameObject('/Subtype'): NameObject('/Type1'),
+        NameObject('/BaseFont'): NameObject('/Helvetica'),
+    }))
+    resources = DictionaryObject({NameObject('/Font'): DictionaryObject({NameObject('/F1'): font})})
+    for label in labels:
+        page = writer.add_blank_page(200, 200)
+        content = DecodedStreamObject()
+        content.set_data(f"BT /F1 12 Tf 20 100 Td ({label}) Tj ET".encode())
+        page[NameObject('/Contents')] = writer._add_object(content)
+        page[NameObject('/Resources')] = resources
+    for index, page in enumerate(writer.pages):
+        target = writer.pages[(index + 1) % len(writer.pages)]
+        link = writer._add_object(DictionaryObject({
+            NameObject('/Type'): NameObject('/Annot'),
+            NameObject('/Subtype'): NameObject('/Link'),
+            NameObject('/Rect'): ArrayObject([FloatObject(v) for v in (10, 10, 60, 30)]),
+            NameObject('/Dest'): ArrayObject([target.indirect_reference, NameObject('/Fit')]),
+        }))
+        page[NameObject('/Annots')] = ArrayObject([link])
+    output = BytesIO()
+    writer.write(output)
+    output.seek(0)
+    return output
+
+
+class PdfConcatenatorTests(SimpleTestCase):
+    def concatenate(self, *sources, footer=None):
+        from io import BytesIO
+        from pypdf import PdfReader
+        from .pdfmerge import PdfConcatenator
+
+        output = BytesIO()
+        merged = PdfConcatenator(output, footer=footer)
+        for labels in sources:
+            merged.append(make_pdf(labels))
+        page_count = merged.close()
+        output.seek(0)
+        return page_count, PdfReader(output, strict=True)
+
+    def test_pages_are_concatenated_in_order(self):
+        page_count, reader = self.concatenate(['A1', 'A2'], ['B1'], ['C1', 'C2', 'C3'])
+
+        self.assertEqual(page_count, 6)
+        self.assertEqual(len(reader.pages), 6)
+        self.assertEqual([page.extract_text() for page in reader.pages], ['A1', 'A2', 'B1', 'C1', 'C2', 'C3'])
+        self.assertEqual(reader.trailer['/Root']['/Pages']['/Count'], 6)
+        for page in reader.pages:
+            self.assertEqual(page['/Parent'].indirect_reference, reader.trailer['/Root'].raw_get('/Pages'))
+
+    def test_shared_resources_are_written_once_per_source(self):
+        _, reader = self.concatenate(['A1', 'A2'], ['B1', 'B2'])
+        fonts = [page['/Resources']['/Font'].raw_get('/F1').idnum for page in reader.pages]
+
+        self.assertEqual(fonts[0], fonts[1])
+        self.assertEqual(fonts[2], fonts[3])
+        self.assertNotEqual(fonts[0], fonts[2])
+
+    def test_annotations_point_to_the_renumbered_pages(self):
+        _, reader = self.concatenate(['A1', 'A2'], ['B1', 'B2', 'B3'])
+        pages = [page.indirect_reference.idnum for page in reader.pages]
+        destinations = [page['/Annots'][0].get_object()['/Dest'][0].idnum for page in reader.pages]
+
+        # Chaque lien pointe vers la page suivante de sa propre source
+        self.assertEqual(destinations, [pages[1], pages[0], pages[3], pages[4], pages[2]])
+
+    def test_empty_sources_add_no_page(self):
+        page_count, reader = self.concatenate([], ['A1'], [])
+        self.assertEqual(page_count, 1)
+        self.assertEqual([page.extract_text() for page in reader.pages], ['A1'])
+
+        page_count, reader = self.concatenate()
+        self.assertEqual(page_count, 0)
+        self.assertEqual(len(reader.pages), 0)
+
+    def test_footer_is_numbered_over_all_sources(self):
+        page_count, reader = self.concatenate(
+            ['A1', 'A2'], ['B1'], footer=lambda number, total: f"Page {number} sur {total}"
+        )
+
+        self.assertEqual(page_count, 3)
+        self.assertEqual(
+            [page.extract_text().split('\n') for page in reader.pages],
+            [['A1', 'Page 1 sur 3'], ['A2', 'Page 2 sur 3'], ['B1', 'Page 3 sur 3']]
+        )
+        # Les polices des sources restent partagées ; celle du pied de page est écrite une fois
+        fonts = [page['/Resources']['/Font'] for page in reader.pages]
+        self.assertEqual(fonts[0].raw_get('/F1').idnum, fonts[1].raw_get('/F1').idnum)
+        self.assertEqual(len({font.raw_get('/GesStockFooter').idnum for font in fonts}), 1)
+        self.assertEqual(fonts[0]['/GesStockFooter']['/BaseFont'], '/Helvetica')
+
+    def test_footer_is_centered(self):
+        _, reader = self.concatenate(['A1'], footer=lambda number, total: "Page")
+        footer = reader.pages[0]['/Contents'][-1].get_object().get_data().decode()
+
+        # « Page » : 667 + 556 * 3 millièmes d'em à 7,5 pt, centré sur une page de 200 pt
+        width = (667 + 556 * 3) * 7.5 / 1000
+        self.assertIn(f"{100 - width / 2:.2f} 26 Td (Page) Tj", footer)
+
+
+class TransactionsPdfTests(StockFixturesMixin, TestCase):
+    """Rapport PDF par paquets : WeasyPrint est remplacé par un rendu factice d'une page par 200 lignes"""
+
+    def setUp(self):
+        from unittest import mock
+        self.chunks = []
+        tests = self
+
+        class FakeDocument:
+            def __init__(self, html):
+                self.html = html
+                rows = html.count('class="transaction-number"')
+                self.pages = [f"{len(tests.chunks)}.{page}" for page in range(max(1, -(-rows // 200)))]
+
+            def write_pdf(self):
+                return make_pdf(self.pages).read()
+
+        class FakeHTML:
+            def __init__(self, string):
+                self.html = string
+
+            def render(self, stylesheets=None, font_config=None):
+                document = FakeDocument(self.html)
+                tests.chunks.append(self.html)
+                return document
+
+        for name, replacement in (('HTML', FakeHTML), ('stylesheet', lambda name: None), ('font_config', lambda: None)):
+            patcher = mock.patch(f'api.exports.{name}', replacement)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.store, self.user, _, _ = self.create_store()
+
+    def create_transactions(self, size):
+        FinancialTransaction.objects.bulk_create([
+            FinancialTransaction(
+                transaction_number=f"RPT-{i}", transaction_type='expense', amount=Decimal('10.00'),
+                store=self.store, created_by=self.user,
+            )
+            for i in range(size)
+        ])
+
+    def write(self, params=None):
+        from io import BytesIO
+        from pypdf import PdfReader
+        from .exports import write_transactions_pdf
+
+        output = BytesIO()
+        page_count = write_transactions_pdf(
+            output, FinancialTransaction.objects.filter(store=self.store), self.store, params or {}
+        )
+        output.seek(0)
+        return page_count, PdfReader(output, strict=True)
+
+    def assert_chunks(self, sizes):
+        self.assertEqual([html.count('class="transaction-number"') for html in self.chunks], sizes)
+        # En-tête et totaux sur le premier paquet, pied de rapport sur le dernier
+        self.assertEqual(['RAPPORT DES TRANSACTIONS' in html for html in self.chunks], [True] + [False] * (len(sizes) - 1))
+        self.assertEqual(['Rapport généré automatiquement' in html for html in self.chunks], [False] * (len(sizes) - 1) + [True])
+
+    def assert_numbered(self, reader, page_count):
+        self.assertEqual(len(reader.pages), page_count)
+        self.assertEqual(
+            [page.extract_text().split('\n')[-1] for page in reader.pages],
+            [f"Page {number} sur {page_count}" for number in range(1, page_count + 1)]
+        )
+
+    def test_chunk_boundaries(self):
+        from .exports import TRANSACTIONS_PDF_CHUNK_ROWS
+        self.assertEqual(TRANSACTIONS_PDF_CHUNK_ROWS, 500)
+
+        for size, chunks, pages in ((500, [500], 3), (501, [500, 1], 4), (1000, [500, 500], 6)):
+            with self.subTest(size=size):
+                FinancialTransaction.objects.filter(store=self.store).delete()
+                self.chunks.clear()
+                self.create_transactions(size)
+
+                page_count, reader = self.write()
+
+                self.assert_chunks(chunks)
+                self.assertEqual(page_count, pages)
+                self.assert_numbered(reader, pages)
+
+    def test_no_transaction_renders_a_single_chunk(self):
+        page_count, reader = self.write()
+
+        self.assert_chunks([0])
+        self.assertIn('Aucune transaction trouvée', self.chunks[0])
+        self.assert_numbered(reader, 1)
+
+    def test_summary_renders_a_single_chunk_without_rows(self):
+        self.create_transactions(600)
+
+        page_count, reader = self.write({'summary': 'true'})
+
+        self.assert_chunks([0])
+        self.assertIn('Synthèse par type', self.chunks[0])
+        self.assert_numbered(reader, page_count)
+
+
+class TransactionNumberingTests(StockFixturesMixin, TestCase):
+    def create_service_payment(self, account, user):
+        return FinancialTransaction.objects.create(
+            transaction_type='service', amount=Decimal('1.00'), to_account=account, created_by=user
+        )
+
+    def test_numbers_are_scoped_per_store(self):
+        store_a, user_a, _, _ = self.create_store('Boutique A')
+        store_b, user_b, _, _ = self.create_store('Boutique B')
+        account_a = Account.objects.create(name='Caisse', account_type='cash', store=store_a)
+        account_b = Account.objects.create(name='Caisse', account_type='cash', store=store_b)
+
+        first_a = self.create_service_payment(account_a, user_a)
+        first_b = self.create_service_payment(account_b, user_b)
+        second_a = self.create_service_payment(account_a, user_a)
+
+        self.assertRegex(first_a.transaction_number, rf'^TRX-{store_a.id}-\d{{8}}-0001$')
+        self.assertRegex(first_b.transaction_number, rf'^TRX-{store_b.id}-\d{{8}}-0001$')
+        self.assertTrue(second_a.transaction_number.endswith('-0002'))
+
+    def test_counter_continues_existing_numbers(self):
+        store, user, _, _ = self.create_store()
+        account = Account.objects.create(name='Caisse', account_type='cash', store=store)
+        existing = self.create_service_payment(account, user)
+        FinancialTransaction.objects.filter(pk=existing.pk).update(
+            transaction_number=existing.transaction_number[:-4] + '9999'
+        )
+        # Compteur perdu : il doit repartir du plus grand numéro existant
+        store.document_sequences.all().delete()
+
+        self.assertTrue(self.create_service_payment(account, user).transaction_number.endswith('-10000'))
+
+    def test_store_less_transaction_is_refused(self):
+        from django.core.exceptions import ValidationError
+        from .models import DocumentSequence
+        store, _, _, _ = self.create_store()
+        support = User.objects.create_superuser(
+            username='support', email='support@test.com', password='secret', fullname='Support'
+        )
+
+        with self.assertRaises(ValidationError) as raised:
+            FinancialTransaction.objects.create(transaction_type='adjustment', amount=Decimal('1.00'), created_by=support)
+        self.assertIn('store', raised.exception.message_dict)
+        self.assertFalse(FinancialTransaction.objects.exists())
+        self.assertFalse(DocumentSequence.objects.exists())
+
+        # Avec un compte, la boutique vient du compte
+        account = Account.objects.create(name='Caisse', account_type='cash', store=store)
+        transaction = self.create_service_payment(account, support)
+        self.assertEqual(transaction.store_id, store.pk)
+        self.assertTrue(transaction.transaction_number.startswith(f'TRX-{store.pk}-'))
+
+    def test_past_day_counters_are_pruned(self):
+        import datetime
+        from unittest import mock
+        from django.utils import timezone
+        from . import sequences
+        store, user, _, _ = self.create_store()
+        account = Account.objects.create(name='Caisse', account_type='cash', store=store)
+        today = timezone.localdate()
+        yesterday = today - datetime.timedelta(days=1)
+        FinancialTransaction.objects.create(
+            transaction_number=f"TRX-{store.pk}-{yesterday:%Y%m%d}-0007", transaction_type='service',
+            amount=Decimal('1.00'), to_account=account, created_by=user,
+        )
+        sequences.next_transaction_number(store.pk, day=yesterday - datetime.timedelta(days=1))
+        sequences.next_transaction_number(store.pk, day=yesterday)
+        self.create_service_payment(account, user)
+        sequences.next_document_number(store.pk, 'stock_entry')
+
+        with mock.patch.dict(sequences._blocks, {(store.pk, f'transaction-{yesterday:%Y%m%d}'): [9, 10]}, clear=True), \
+                mock.patch.object(sequences, '_blocks_day', None):
+            sequences._blocks[(store.pk, f'transaction-{today:%Y%m%d}')] = [2, 10]
+            self.assertEqual(sequences.prune_transaction_sequences(), 2)
+            self.assertEqual(list(sequences._blocks), [(store.pk, f'transaction-{today:%Y%m%d}')])
+
+        self.assertEqual(
+            sorted(store.document_sequences.values_list('document_type', flat=True)),
+            ['stock_entry', f'transaction-{today:%Y%m%d}']
+        )
+        # Compteur supprimé d'un jour passé : il repart du plus grand numéro de ce jour
+        self.assertTrue(sequences.next_transaction_number(store.pk, day=yesterday).endswith('-0008'))
+
+
+class ExportJobQueueTests(StockFixturesMixin, APITestCase):
+    def setUp(self):
+        import tempfile
+        from pathlib import Path
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = Path(directory.name)
+        override = override_settings(EXPORTS_ROOT=self.root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.store, self.user, _, _ = self.create_store()
+        self.client.force_authenticate(self.user)
+
+    def create_job(self, **fields):
+        from .models import ExportJob
+        return ExportJob.objects.create(store=self.store, created_by=self.user, kind='transactions_xlsx', **fields)
+
+    def test_create_queues_the_job(self):
+        from .models import ExportJob
+        response = self.client.post('/api/export-jobs/', {
+            'kind': 'transactions_xlsx', 'params': {'date_from': '2025-01-01', 'inconnu': 'ignoré'}
+        }, format='json')
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], 'pending')
+        job = ExportJob.objects.get(pk=response.data['id'])
+        self.assertEqual((job.store, job.created_by, job.params), (self.store, self.user, {'date_from': '2025-01-01'}))
+
+        # Les types internes ne peuvent pas être demandés par l'API
+        response = self.client.post('/api/export-jobs/', {'kind': 'invoice_pdf_cache'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_claim_reserves_each_job_once_in_order(self):
+        from .exports import claim_job
+        from .models import ExportJob
+        jobs = [self.create_job() for _ in range(3)]
+        # Déjà réservé par un autre worker entre la lecture et l'UPDATE conditionnel
+        ExportJob.objects.filter(pk=jobs[0].pk).update(status='running')
+
+        self.assertEqual([claim_job(), claim_job(), claim_job()], [jobs[1].pk, jobs[2].pk, None])
+        for job in jobs[1:]:
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.attempts), ('running', 1))
+            self.assertIsNotNone(job.started_at)
+
+    def test_stale_jobs_are_requeued_then_failed(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .exports import requeue_stale_jobs
+        stale = timezone.now() - timedelta(minutes=31)
+        retried = self.create_job(status='running', started_at=stale, attempts=1)
+        exhausted = self.create_job(status='running', started_at=stale, attempts=3)
+        recent = self.create_job(status='running', started_at=timezone.now(), attempts=1)
+
+        self.assertEqual(requeue_stale_jobs(), (1, 1))
+        for job in (retried, exhausted, recent):
+            job.refresh_from_db()
+        self.assertEqual([retried.status, exhausted.status, recent.status], ['pending', 'failed', 'running'])
+        self.assertEqual(exhausted.error, "Rendu interrompu")
+
+    def test_expired_jobs_are_purged_with_their_files(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .exports import purge_expired_jobs
+        from .models import ExportJob
+        old = timezone.now() - timedelta(hours=25)
+        (self.root / 'ancien.xlsx').write_bytes(b'ancien')
+        (self.root / 'recent.xlsx').write_bytes(b'recent')
+        self.create_job(status='done', finished_at=old, file_path='ancien.xlsx')
+        self.create_job(status='done', finished_at=old, file_path='deja-supprime.xlsx')
+        self.create_job(status='failed', finished_at=old)
+        kept = self.create_job(status='done', finished_at=timezone.now(), file_path='recent.xlsx')
+        pending = self.create_job()
+
+        self.assertEqual(purge_expired_jobs(), 3)
+        self.assertEqual(set(ExportJob.objects.values_list('pk', flat=True)), {kept.pk, pending.pk})
+        self.assertEqual([path.name for path in self.root.iterdir()], ['recent.xlsx'])
+
+    def test_download_follows_the_job_status(self):
+        import os
+        from .exports import claim_job, export_path, run_export_job
+        job = self.create_job()
+        url = f'/api/export-jobs/{job.pk}/download/'
+
+        response = self.client.get(url)
+        self.assertEqual((response.status_code, response.data['status']), (409, 'pending'))
+
+        self.assertEqual(claim_job(), job.pk)
+        self.assertTrue(run_export_job(job.pk))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('transactions_export.xlsx', response['Content-Disposition'])
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'PK'))
+
+        job.refresh_from_db()
+        os.remove(export_path(job))
+        self.assertEqual(self.client.get(url).status_code, 410)
+
+        other_store, other_user, _, _ = self.create_store('Autre boutique')
+        self.client.force_authenticate(other_user)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+class DocumentSequenceTests(StockFixturesMixin, TestCase):
+    def setUp(self):
+        from . import sequences
+        sequences._blocks.clear()
+        self.addCleanup(sequences._blocks.clear)
+        self.store, self.user, self.warehouse, self.supplier = self.create_store()
+
+    def counter(self, document_type='stock_entry'):
+        from .models import DocumentSequence
+        return DocumentSequence.objects.get(store=self.store, document_type=document_type).last_value
+
+    def test_first_use_starts_after_existing_numbers(self):
+        from .sequences import initial_value, next_document_number
+        prefix = f'ENT-{self.store.pk}-'
+        for suffix in ['00007', '00041', 'ANCIEN', '00041-B']:
+            entry = StockEntry.objects.create(supplier=self.supplier, warehouse=self.warehouse, created_by=self.user)
+            StockEntry.objects.filter(pk=entry.pk).update(entry_number=prefix + suffix)
+        self.store.document_sequences.all().delete()
+
+        with self.assertNumQueries(1):
+            self.assertEqual(initial_value(self.store.pk, 'stock_entry'), 41)
+        self.assertEqual(next_document_number(self.store.pk, 'stock_entry'), f'{prefix}00042')
+
+        StockEntry.objects.filter(entry_number=f'{prefix}00041').update(entry_number=f'{prefix}123456')
+        self.assertEqual(initial_value(self.store.pk, 'stock_entry'), 123456)
+
+    def test_rolled_back_numbers_are_reused(self):
+        from django.db import transaction
+        from .sequences import allocate
+
+        first = allocate(self.store.pk, 'stock_entry')
+        try:
+            with transaction.atomic():
+                self.assertEqual(allocate(self.store.pk, 'stock_entry'), first + 1)
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertEqual(allocate(self.store.pk, 'stock_entry'), first + 1)
+
+    @override_settings(DOCUMENT_SEQUENCE_BLOCK_SIZE=10)
+    def test_block_is_reused_within_the_transaction_and_published_on_commit(self):
+        from .sequences import allocate
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first = allocate(self.store.pk, 'stock_entry')
+            with self.assertNumQueries(0):
+                values = [allocate(self.store.pk, 'stock_entry') for _ in range(4)]
+            self.assertEqual(values, list(range(first + 1, first + 5)))
+        self.assertEqual(self.counter(), first + 9)
+
+        # Après le commit, le reste du bloc est servi en mémoire, puis un nouveau bloc est réservé
+        with self.assertNumQueries(0):
+            values = [allocate(self.store.pk, 'stock_entry') for _ in range(5)]
+        self.assertEqual(values, list(range(first + 5, first + 10)))
+        self.assertEqual(allocate(self.store.pk, 'stock_entry'), first + 10)
+        self.assertEqual(self.counter(), first + 19)
+
+    @override_settings(DOCUMENT_SEQUENCE_BLOCK_SIZE=10)
+    def test_rolled_back_block_is_abandoned(self):
+        from django.db import transaction
+        from .sequences import allocate
+
+        try:
+            with transaction.atomic():
+                first = allocate(self.store.pk, 'stock_entry')
+                self.assertEqual(allocate(self.store.pk, 'stock_entry'), first + 1)
+                raise RuntimeError
+        except RuntimeError:
+            pass
+
+        # Le compteur est revenu en arrière : le bloc annulé n'est plus servi, il est réservé à nouveau
+        self.assertEqual(allocate(self.store.pk, 'stock_entry'), first)
+        self.assertEqual(self.counter(), first + 9)
+
+
+@skipIf(connection.vendor == 'sqlite', "SQLite ne supporte pas les écritures concurrentes")
+class ExportJobClaimConcurrencyTests(StockFixturesMixin, TransactionTestCase):
+    def test_parallel_workers_never_claim_the_same_job(self):
+        from .exports import claim_job
+        from .models import ExportJob
+        store, user, _, _ = self.create_store()
+        ExportJob.objects.bulk_create(
+            ExportJob(store=store, created_by=user, kind='transactions_xlsx') for _ in range(60)
+        )
+        claimed, errors = [], []
+
+        def worker():
+            try:
+                while (job_id := claim_job()) is not None:
+                    claimed.append(job_id)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(claimed), 60)
+        self.assertEqual(len(set(claimed)), 60)
+        self.assertEqual(set(ExportJob.objects.values_list('status', 'attempts')), {('running', 1)})
+
+@skipIf(connection.vendor == 'sqlite', "SQLite ne supporte pas les écritures concurrentes")
+class TransactionNumberingConcurrencyTests(StockFixturesMixin, TransactionTestCase):
+    threads = 16
+    transactions_per_thread = 125
+
+    def test_parallel_transactions_get_unique_numbers(self):
+        stores = [self.create_store(f'Boutique {i}') for i in range(2)]
+        accounts = [
+            Account.objects.create(name='Caisse', account_type='cash', store=store)
+            for store, _, _, _ in stores
+        ]
+        errors = []
+
+        def worker(index):
+            store, user, _, _ = stores[index % 2]
+            account = Account.objects.get(pk=accounts[index % 2].pk)
+            try:
+                for _ in range(self.transactions_per_thread):
+                    FinancialTransaction.objects.create(
+                        transaction_type='service', amount=Decimal('1.00'), to_account=account, created_by=user
+                    )
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker, args=(i,)) for i in range(self.threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        total = self.threads * self.transactions_per_thread
+        numbers = list(FinancialTransaction.objects.values_list('transaction_number', flat=True))
+        self.assertEqual(len(numbers), total)
+        self.assertEqual(len(set(numbers)), total)
+        for store, _, _, _ in stores:
+            suffixes = sorted(
+                int(number.rsplit('-', 1)[1]) for number in numbers if number.startswith(f'TRX-{store.id}-')
+            )
+            self.assertEqual(suffixes, list(range(1, total // 2 + 1)))
+        # Aucune mise à jour de solde perdue
+        for account in accounts:
+            account.refresh_from_db()
+            self.assertEqual(account.balance, Decimal(total // 2))
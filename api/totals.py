@@ -0,0 +1,97 @@
+"""
+Recalcul des totaux des bons d'entrée et de sortie.
+
+Au lieu de re-sommer tous les articles en Python à chaque enregistrement d'un article
+(coût quadratique sur les bons à nombreuses lignes), le total est recalculé par un SUM SQL.
+
+Le recalcul a toujours lieu dans la transaction qui modifie les articles : la transaction
+financière créée par les signaux post_save (achat, vente) et ses erreurs (solde insuffisant)
+sont validées ou annulées avec le stock et les articles, et une lecture dans le bloc voit
+le total à jour. Pour enregistrer plusieurs articles d'un coup, le bloc `deferred_totals()`
+regroupe les recalculs : un seul SUM par bon, à la fin du bloc, avant sa sortie.
+"""
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import DecimalField, F, Sum
+from django.db.models.functions import Coalesce
+
+ITEMS_TOTAL = Coalesce(
+    Sum('items__total_price'), Decimal('0.00'),
+    output_field=DecimalField(max_digits=15, decimal_places=2)
+)
+
+
+@contextmanager
+def deferred_totals():
+    """
+    Bloc atomique dans lequel les totaux des bons modifiés sont recalculés une seule fois,
+    à la fin du bloc ; si le recalcul échoue (solde insuffisant), tout le bloc est annulé.
+    """
+    if getattr(connection, 'deferred_document_totals', None) is not None:
+        # Bloc imbriqué : le recalcul a lieu à la fin du bloc le plus externe
+        yield
+        return
+
+    dirty = connection.deferred_document_totals = {}
+    try:
+        with transaction.atomic():
+            yield
+            connection.deferred_document_totals = None
+            flush_totals(dirty)
+    finally:
+        connection.deferred_document_totals = None
+
+
+def mark_dirty(document):
+    """Recalcule le total de `document` (StockEntry ou StockExit), à la fin du bloc deferred_totals() en cours"""
+    dirty = getattr(connection, 'deferred_document_totals', None)
+    if dirty is None:
+        flush_totals({type(document): {document.pk}})
+    else:
+        dirty.setdefault(type(document), set()).add(document.pk)
+
+
+def refresh_total(document):
+    """
+    Total d'un bon en cours d'enregistrement (pre_save) : calculé sur l'instance,
+    ou à la fin du bloc deferred_totals() en cours
+    """
+    if getattr(connection, 'deferred_document_totals', None) is not None:
+        mark_dirty(document)
+    else:
+        document.total_amount = document.items.aggregate(total=ITEMS_TOTAL)['total']
+
+
+def flush_totals(dirty):
+    """Recalcule en SQL le total de chaque bon marqué et l'enregistre s'il a changé"""
+    for model, pks in dirty.items():
+        documents = model.objects.filter(pk__in=pks).annotate(items_total=ITEMS_TOTAL)
+        if model._meta.model_name == 'stockexit':
+            documents = documents.select_related('customer')
+
+        with transaction.atomic():
+            for document in documents:
+                if document.total_amount == document.items_total:
+                    continue
+                if model._meta.model_name == 'stockexit':
+                    update_stock_exit_total(document, document.items_total)
+                else:
+                    document.total_amount = document.items_total
+                    document.save(update_fields=['total_amount'])
+
+
+def update_stock_exit_total(stock_exit, total):
+    """Met à jour le total d'un bon de sortie, son reste à payer et la dette du client"""
+    new_remaining = total - stock_exit.paid_amount
+    if stock_exit.customer:
+        debt_difference = new_remaining - stock_exit.remaining_amount
+        if debt_difference != 0:
+            type(stock_exit.customer).objects.filter(pk=stock_exit.customer_id).update(
+                debt=F('debt') + debt_difference
+            )
+
+    stock_exit.total_amount = total
+    stock_exit.remaining_amount = new_remaining
+    stock_exit.save(update_fields=['total_amount', 'remaining_amount'], skip_debt_update=True)
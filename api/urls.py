@@ -8,7 +8,7 @@ from .views import (
     LogoutView, testViewSet,
     ProductViewSet, StockEntryViewSet, StockExitViewSet,
     CustomerViewSet, SupplierViewSet, WarehouseViewSet, AccountViewSet, InvoiceViewSet,
-    FinancialTransactionViewSet, StockTransferViewSet,
+    FinancialTransactionViewSet, StockTransferViewSet, ExportJobViewSet,
     stock_stats
 )
 
@@ -24,6 +24,7 @@ router.register(r'stock-entries', StockEntryViewSet, basename='stock-entry')
 router.register(r'stock-exits', StockExitViewSet, basename='stock-exit')
 router.register(r'stock-transfers', StockTransferViewSet, basename='stock-transfer')
 router.register(r'financial-transactions', FinancialTransactionViewSet, basename='financial-transaction')
+router.register(r'export-jobs', ExportJobViewSet, basename='export-job')
 
 
 
@@ -1,4 +1,9 @@
+import datetime
+
 from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 
 def set_auth_cookie(response, key, value, max_age):
     response.set_cookie(
@@ -10,4 +15,58 @@ def set_auth_cookie(response, key, value, max_age):
         path=settings.AUTH_COOKIE_PATH,
         samesite=settings.AUTH_COOKIE_SAMESITE,
         domain=settings.AUTH_COOKIE_DOMAIN
-    )
\ No newline at end of file
+    )
+
+
+def day_start(value, days=0):
+    """
+    Début (00:00, fuseau courant) du jour `value` (AAAA-MM-JJ) décalé de `days` jours.
+    Permet de filtrer created_at par intervalle (et donc par index) plutôt que par created_at__date.
+    Retourne None si la date est invalide.
+    """
+    try:
+        date = parse_date(value)
+    except ValueError:
+        return None
+    if date is None:
+        return None
+    return timezone.make_aware(datetime.datetime.combine(date + datetime.timedelta(days=days), datetime.time.min))
+
+
+def filter_transactions(queryset, params):
+    """
+    Applique aux transactions financières les filtres account_id, date_from et date_to
+    (paramètres de requête ou paramètres enregistrés d'un export différé).
+    """
+    account_id = params.get('account_id')
+    if account_id:
+        queryset = queryset.filter(
+            Q(from_account_id=account_id) | Q(to_account_id=account_id)
+        )
+
+    # Filtres de dates en intervalle sur created_at (utilise l'index (store, created_at))
+    date_from = day_start(params.get('date_from') or '')
+    if date_from:
+        queryset = queryset.filter(created_at__gte=date_from)
+
+    date_to = day_start(params.get('date_to') or '', days=1)
+    if date_to:
+        queryset = queryset.filter(created_at__lt=date_to)
+
+    return queryset
+
+
+def filter_invoices(queryset, params):
+    """Factures d'un lot d'impression : liste d'ids (invoice_ids) et/ou période (date_from, date_to)"""
+    if params.get('invoice_ids'):
+        queryset = queryset.filter(pk__in=params['invoice_ids'])
+
+    date_from = day_start(params.get('date_from') or '')
+    if date_from:
+        queryset = queryset.filter(created_at__gte=date_from)
+
+    date_to = day_start(params.get('date_to') or '', days=1)
+    if date_to:
+        queryset = queryset.filter(created_at__lt=date_to)
+
+    return queryset.order_by('created_at', 'id')
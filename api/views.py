@@ -4,19 +4,19 @@ from .serializers import (
     StockEntryFormSerializer, StockExitFormSerializer,
     SupplierSerializer, WarehouseSerializer, CustomerSerializer, AccountSerializer, InvoiceSerializer,
     FinancialTransactionSerializer, StockTransferSerializer, StockTransferFormSerializer,
-    DebtPaymentSerializer
+    DebtPaymentSerializer, ExportJobSerializer
 )
 from django.contrib.auth import login, user_logged_in
-from .models import User, Product, StockEntry, StockExit, StockEntryItem, StockExitItem, Supplier, Warehouse, Customer, ProductStock, Account, Invoice, FinancialTransaction, StockTransfer, StockTransferItem
+from .models import User, Product, StockEntry, StockExit, StockEntryItem, StockExitItem, Supplier, Warehouse, Customer, ProductStock, Account, Invoice, FinancialTransaction, StockTransfer, StockTransferItem, ExportJob
 from django.conf import settings 
 from djoser.views import UserViewSet
 from django.shortcuts import get_object_or_404
 from django.db import transaction
-from django.db.models import Q, Sum, Count, F
+from django.db.models import Q, Sum, Count, F, Prefetch
 from rest_framework.response import Response
 from rest_framework.request import Request
 from rest_framework.exceptions import ValidationError
-from rest_framework import generics, status, viewsets
+from rest_framework import generics, mixins, status, viewsets
 from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
 from rest_framework.decorators import api_view, action, permission_classes
 from rest_framework.filters import SearchFilter, OrderingFilter
@@ -25,12 +25,9 @@ from djoser.social.views import ProviderAuthView
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.exceptions import TokenError
 from .authentication import CustomAuthenticationBackend
-from openpyxl import Workbook
-from openpyxl.utils import get_column_letter
-from django.template.loader import render_to_string
-from django.http import HttpResponse
-from weasyprint import HTML
-import io
+from .stats import compute_stock_stats, compute_transaction_stats, TRANSACTION_STATS_BUCKETS
+from .pagination import CursorPaginationMixin
+from django.http import Http404
 
 
 # from authentication.permissions import CanApproveLevel1, CanApproveLevel2, CanApproveLevel3
@@ -39,7 +36,7 @@ from rest_framework_simplejwt.views import (
     TokenRefreshView,
     TokenVerifyView
 )
-from .utils import set_auth_cookie
+from .utils import set_auth_cookie, day_start, filter_transactions
 from .models import Store
 # Permission
 from django.contrib.auth import user_logged_in
@@ -52,6 +49,17 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+def get_store_products(store, product_ids):
+    """
+    Charge en une seule requête les produits de la boutique référencés par un document.
+    Retourne un dictionnaire {id: produit} ; 404 si l'un des produits est introuvable.
+    """
+    products = Product.objects.filter(store=store).in_bulk(product_ids)
+    if len(products) != len(set(product_ids)):
+        raise Http404("Produit introuvable")
+    return products
+
+
 class StoreContextMixin:
     """
     Mixin pour gérer le contexte store dans les vues.
@@ -228,6 +236,11 @@ def LogoutView(request):
         if refresh_token:
             token = RefreshToken(refresh_token)
             token.blacklist()
+        
+        # Le token d'accès reste valide jusqu'à son expiration : on le révoque explicitement
+        if request.auth is not None and 'jti' in request.auth:
+            from .cache import revoke_token
+            revoke_token(request.auth['jti'], request.auth['exp'])
             
         # Supprime les cookies
         set_auth_cookie(response, 'access', '', max_age=0)
@@ -330,11 +343,27 @@ class ProductViewSet(viewsets.ModelViewSet, StoreContextMixin):
     
     def get_queryset(self):
         queryset = Product.objects.all().order_by('-created_at')
-        return self.get_store_queryset(queryset)
+        return self.with_stock(self.get_store_queryset(queryset))
+    
+    def with_stock(self, queryset):
+        """Annote le stock total et précharge le détail par magasin si demandé"""
+        return self.prefetch_warehouse_stock(queryset.with_total_stock())
+    
+    def prefetch_warehouse_stock(self, queryset):
+        if self.with_warehouses:
+            queryset = queryset.prefetch_related(
+                Prefetch('stocks', queryset=ProductStock.objects.select_related('warehouse').order_by('warehouse__name'))
+            )
+        return queryset
+    
+    @property
+    def with_warehouses(self):
+        return self.request.query_params.get('with_warehouses', '').lower() in ('1', 'true')
     
     def get_serializer_context(self):
         context = super().get_serializer_context()
         context['store'] = self.store
+        context['with_warehouses'] = self.with_warehouses
         return context
     
     def perform_create(self, serializer):
@@ -343,22 +372,26 @@ class ProductViewSet(viewsets.ModelViewSet, StoreContextMixin):
     
     @action(detail=False, methods=['get'], url_path='low-stock')
     def low_stock(self, request):
-        """Retourne les produits avec un stock faible"""
-        queryset = self.get_queryset()
-        low_stock_products = []
-        
-        for product in queryset:
-            # Calculer le stock actuel de manière similaire à stock_stats
-            entries = StockEntryItem.objects.filter(product=product).aggregate(
-                total=Sum('quantity'))['total'] or 0
-            exits = StockExitItem.objects.filter(product=product).aggregate(
-                total=Sum('quantity'))['total'] or 0
-            current_stock = entries - exits
-            
-            if current_stock <= product.min_stock_alert:
-                low_stock_products.append(product)
+        """
+        Retourne les produits avec un stock faible, paginés, les plus critiques en premier.
+        Avec ?warehouse=<id>, le stock est évalué dans ce magasin uniquement.
+        """
+        warehouse = None
+        warehouse_id = request.query_params.get('warehouse')
+        if warehouse_id:
+            if not warehouse_id.isdigit():
+                return Response({'error': 'Identifiant de magasin invalide'}, status=status.HTTP_400_BAD_REQUEST)
+            warehouse = get_object_or_404(Warehouse, id=int(warehouse_id), store=self.store)
+        
+        queryset = self.get_store_queryset(Product.objects.all()).low_stock(warehouse=warehouse)
+        queryset = self.prefetch_warehouse_stock(queryset)
         
-        serializer = self.get_serializer(low_stock_products, many=True)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        
+        serializer = self.get_serializer(queryset, many=True)
         return Response(serializer.data)
     
     @action(detail=False, methods=['get'], url_path='search')
@@ -372,7 +405,7 @@ class ProductViewSet(viewsets.ModelViewSet, StoreContextMixin):
         
         # Obtenir le queryset de base sans l'ordre par défaut
         base_queryset = Product.objects.all()
-        base_queryset = self.get_store_queryset(base_queryset)
+        base_queryset = self.with_stock(self.get_store_queryset(base_queryset))
         
         # Recherche avec ordre de pertinence
         from django.db.models import Case, When, Value, IntegerField
@@ -507,22 +540,27 @@ class SupplierViewSet(viewsets.ModelViewSet, StoreContextMixin):
     
     @action(detail=False, methods=['get'], url_path='search')
     def search(self, request):
-        """Recherche rapide pour l'autocomplétion"""
+        """Recherche rapide pour l'autocomplétion (résultats en cache par store, voir api/cache.py)"""
+        from .cache import cached_reference
+        
         search_query = request.query_params.get('search', '')
         limit = int(request.query_params.get('limit', 20))
         
         if not search_query:
             return Response([])
         
-        queryset = self.get_queryset().filter(
-            Q(name__icontains=search_query) |
-            Q(phone__icontains=search_query) |
-            Q(email__icontains=search_query) |
-            Q(address__icontains=search_query)
-        )[:limit]
+        def build():
+            queryset = self.get_queryset().filter(
+                Q(name__icontains=search_query) |
+                Q(phone__icontains=search_query) |
+                Q(email__icontains=search_query) |
+                Q(address__icontains=search_query)
+            )[:limit]
+            return self.get_serializer(queryset, many=True).data
         
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        data = cached_reference(self.store_id, 'supplier-search', build,
+                                depends=('suppliers',), params=(search_query, limit))
+        return Response(data)
 
 
 class WarehouseViewSet(viewsets.ModelViewSet, StoreContextMixin):
@@ -542,13 +580,24 @@ class WarehouseViewSet(viewsets.ModelViewSet, StoreContextMixin):
         context['store'] = self.request.user.store
         return context
     
+    def list(self, request, *args, **kwargs):
+        """Liste des entrepôts (sélecteurs), en cache par store et par paramètres de requête"""
+        from .cache import cached_reference
+        
+        list_view = super().list
+        data = cached_reference(
+            self.store_id, 'warehouses', lambda: list_view(request, *args, **kwargs).data,
+            params=sorted(request.query_params.lists())
+        )
+        return Response(data)
+    
     def create(self, request, *args, **kwargs):
         request.data['store'] = self.store.id
         return super().create(request, *args, **kwargs)
         
 
 
-class StockEntryViewSet(viewsets.ModelViewSet, StoreContextMixin):
+class StockEntryViewSet(CursorPaginationMixin, viewsets.ModelViewSet, StoreContextMixin):
     serializer_class = StockEntrySerializer
     permission_classes = [IsAuthenticated]
     filter_backends = [SearchFilter, OrderingFilter]
@@ -575,63 +624,88 @@ class StockEntryViewSet(viewsets.ModelViewSet, StoreContextMixin):
         supplier = get_object_or_404(Supplier, id=serializer.validated_data['supplier'])
         warehouse = get_object_or_404(Warehouse, id=serializer.validated_data['warehouse'])
         
-        with transaction.atomic():
-            # Générer un numéro d'entrée unique
-            entry_number = f"EN-{StockEntry.objects.count() + 1:06d}"
-            
-            # Récupérer le compte source si spécifié
-            account = None
-            account_id = serializer.validated_data.get('account')
-           
-            if account_id:
-                try:
-                    account = Account.objects.get(
-                        id=account_id, 
-                        store=self.request.user.store,
-                        is_active=True
-                    )
-                except Account.DoesNotExist:
-                    return Response(
-                        {'error': 'Compte spécifié non trouvé ou inactif'},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-            
-            stock_entry = StockEntry.objects.create(
-                entry_number=entry_number,
-                supplier=supplier,
-                warehouse=warehouse,
-                account=account,  # Ajout du compte
-                notes=serializer.validated_data.get('notes', ''),
-                created_by=self.request.user,
-                total_amount=Decimal('0.00')
+        # Récupérer le compte source si spécifié
+        account = None
+        account_id = serializer.validated_data.get('account')
+       
+        if account_id:
+            try:
+                account = Account.objects.get(
+                    id=account_id, 
+                    store=self.request.user.store,
+                    is_active=True
+                )
+            except Account.DoesNotExist:
+                return Response(
+                    {'error': 'Compte spécifié non trouvé ou inactif'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        
+        # Lire les lignes et charger tous les produits en une seule requête
+        lines = [
+            (int(item_data['product']), int(item_data['quantity']), Decimal(item_data['purchase_price']))
+            for item_data in serializer.validated_data['items']
+        ]
+        product_ids = [product_id for product_id, _, _ in lines]
+        products = get_store_products(self.store, product_ids)
+        if len(products) != len(product_ids):
+            # Un produit ne peut apparaître qu'une fois par bon (unique_together)
+            return Response(
+                {'error': 'Un même produit apparaît sur plusieurs lignes du bon'},
+                status=status.HTTP_400_BAD_REQUEST
             )
-            
-            total_amount = Decimal('0.00')
-            
-            # Créer les items
-            for item_data in serializer.validated_data['items']:
-                product = get_object_or_404(Product, id=item_data['product'])
-                quantity = int(item_data['quantity'])
-                purchase_price = Decimal(item_data['purchase_price'])
-                
-                StockEntryItem.objects.create(
-                    stock_entry=stock_entry,
-                    product=product,
-                    quantity=quantity,
-                    purchase_price=purchase_price,
-                    total_price=quantity * purchase_price
+        
+        # Le total est calculé une seule fois : la transaction d'achat est créée
+        # par le signal post_save dès la création du bon
+        total_amount = sum((quantity * purchase_price for _, quantity, purchase_price in lines), Decimal('0.00'))
+        
+        try:
+            with transaction.atomic():
+                # Le numéro d'entrée est attribué par StockEntry.save (api/sequences.py)
+                stock_entry = StockEntry.objects.create(
+                    supplier=supplier,
+                    warehouse=warehouse,
+                    account=account,  # Ajout du compte
+                    notes=serializer.validated_data.get('notes', ''),
+                    created_by=self.request.user,
+                    total_amount=total_amount
                 )
                 
-                total_amount += quantity * purchase_price
-            
-            # Mettre à jour le montant total
-            stock_entry.total_amount = total_amount
-            stock_entry.save()
-            
-            return Response(StockEntrySerializer(stock_entry).data, status=status.HTTP_201_CREATED)
+                # Créer les items en une seule requête (sans passer par StockEntryItem.save)
+                StockEntryItem.objects.bulk_create([
+                    StockEntryItem(
+                        stock_entry=stock_entry,
+                        product=products[product_id],
+                        quantity=quantity,
+                        purchase_price=purchase_price,
+                        total_price=quantity * purchase_price
+                    )
+                    for product_id, quantity, purchase_price in lines
+                ])
+                
+                # Mettre à jour tous les stocks en une seule requête
+                ProductStock.objects.add_quantities(
+                    warehouse, {product_id: quantity for product_id, quantity, _ in lines}
+                )
+        except ValueError as e:
+            # Solde insuffisant pour la transaction d'achat par exemple
+            return Response(
+                {
+                    'error': 'Erreur lors de la création du bon d\'entrée',
+                    'details': str(e)
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        stock_entry = StockEntry.objects.select_related(
+            'supplier', 'warehouse', 'account', 'created_by'
+        ).prefetch_related(
+            Prefetch('items', queryset=StockEntryItem.objects.select_related('product'))
+        ).get(pk=stock_entry.pk)
+        return Response(StockEntrySerializer(stock_entry).data, status=status.HTTP_201_CREATED)
 
 
-class StockExitViewSet(viewsets.ModelViewSet, StoreContextMixin):
+class StockExitViewSet(CursorPaginationMixin, viewsets.ModelViewSet, StoreContextMixin):
     serializer_class = StockExitSerializer
     permission_classes = [IsAuthenticated]
     filter_backends = [SearchFilter, OrderingFilter]
@@ -660,127 +734,118 @@ class StockExitViewSet(viewsets.ModelViewSet, StoreContextMixin):
         if serializer.validated_data.get('customer'):
             customer = get_object_or_404(Customer, id=serializer.validated_data['customer'])
         
-        # Validation préalable du stock pour tous les items
-        stock_errors = []
-        for item_data in serializer.validated_data['items']:
-            product = get_object_or_404(Product, id=item_data['product'])
-            quantity = int(item_data['quantity'])
-            
+        # Récupérer le compte de destination si spécifié
+        account = None
+        account_id = serializer.validated_data.get('account')
+       
+        if account_id:
             try:
-                stock = ProductStock.objects.get(
-                    product=product,
-                    warehouse=warehouse
+                account = Account.objects.get(
+                    id=account_id, 
+                    store=self.request.user.store,
+                    is_active=True
+                )
+            except Account.DoesNotExist:
+                return Response(
+                    {'error': 'Compte spécifié non trouvé ou inactif'},
+                    status=status.HTTP_400_BAD_REQUEST
                 )
-                if stock.quantity < quantity:
-                    stock_errors.append({
-                        'product': product.reference,
-                        'product_name': product.name,
-                        'requested_quantity': quantity,
-                        'available_quantity': stock.quantity,
-                        'error': 'Stock insuffisant'
-                    })
-            except ProductStock.DoesNotExist:
-                stock_errors.append({
-                    'product': product.reference,
-                    'product_name': product.name,
-                    'requested_quantity': quantity,
-                    'available_quantity': 0,
-                    'error': 'Aucun stock disponible'
-                })
         
-        if stock_errors:
+        # Lire les lignes et charger tous les produits en une seule requête
+        product_ids = [int(item_data['product']) for item_data in serializer.validated_data['items']]
+        products = get_store_products(self.store, product_ids)
+        if len(products) != len(product_ids):
+            # Un produit ne peut apparaître qu'une fois par bon (unique_together)
             return Response(
-                {
-                    'error': 'Erreurs de stock détectées',
-                    'details': 'Certains produits n\'ont pas suffisamment de stock disponible',
-                    'stock_errors': stock_errors,
-                    'warehouse': warehouse.name
-                },
+                {'error': 'Un même produit apparaît sur plusieurs lignes du bon'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-
-        with transaction.atomic():
-            # Générer un numéro de sortie unique
-            exit_number = f"EX-{StockExit.objects.count() + 1:06d}"
-            
-            # Récupérer le compte de destination si spécifié
-            account = None
-            account_id = serializer.validated_data.get('account')
-           
-            if account_id:
-                print("---------------------------------------------, account1")
-                try:
-                    account = Account.objects.get(
-                        id=account_id, 
-                        store=self.request.user.store,
-                        is_active=True
-                    )
-                    print("---------------------------------------------, accoun2", account)
-                except Account.DoesNotExist:
+        
+        lines = []
+        for item_data in serializer.validated_data['items']:
+            product = products[int(item_data['product'])]
+            quantity = int(item_data['quantity'])
+            sale_price = Decimal(item_data['sale_price'])
+            # Même règle que StockExitItem.save : prix du produit par défaut
+            if not sale_price:
+                sale_price = product.sale_price
+            lines.append((product, quantity, sale_price))
+        quantities = {product.id: quantity for product, quantity, _ in lines}
+        total_amount = sum((quantity * sale_price for _, quantity, sale_price in lines), Decimal('0.00'))
+        
+        try:
+            with transaction.atomic():
+                # Validation du stock : une seule lecture verrouillée de toutes les lignes concernées
+                available = dict(
+                    ProductStock.objects.select_for_update().filter(
+                        warehouse=warehouse, product_id__in=product_ids
+                    ).values_list('product_id', 'quantity')
+                )
+                stock_errors = [
+                    {
+                        'product': product.reference,
+                        'product_name': product.name,
+                        'requested_quantity': quantity,
+                        'available_quantity': available.get(product.id, 0),
+                        'error': 'Stock insuffisant' if product.id in available else 'Aucun stock disponible'
+                    }
+                    for product, quantity, _ in lines
+                    if available.get(product.id, 0) < quantity
+                ]
+                if stock_errors:
                     return Response(
-                        {'error': 'Compte spécifié non trouvé ou inactif'},
+                        {
+                            'error': 'Erreurs de stock détectées',
+                            'details': 'Certains produits n\'ont pas suffisamment de stock disponible',
+                            'stock_errors': stock_errors,
+                            'warehouse': warehouse.name
+                        },
                         status=status.HTTP_400_BAD_REQUEST
                     )
-            
-            stock_exit = StockExit.objects.create(
-                exit_number=exit_number,
-                customer=customer,
-                customer_name=serializer.validated_data.get('customer_name', ''),
-                warehouse=warehouse,
-                account=account,  # Ajout du compte
-                notes=serializer.validated_data.get('notes', ''),
-                created_by=self.request.user,
-                total_amount=Decimal('0.00')
-            )
-            
-            total_amount = Decimal('0.00')
-            
-            # Créer les items
-            for item_data in serializer.validated_data['items']:
-                product = get_object_or_404(Product, id=item_data['product'])
-                quantity = int(item_data['quantity'])
-                sale_price = Decimal(item_data['sale_price'])
                 
-                try:
-                    StockExitItem.objects.create(
+                # Retrait conditionnel de tous les stocks en une seule requête
+                if ProductStock.objects.remove_quantities(warehouse, quantities) != len(quantities):
+                    raise ValueError(f"Stock modifié pendant la validation de la sortie dans l'entrepôt {warehouse.name}")
+                
+                # Le bon est créé avec son total définitif : dette du client, facture
+                # et transaction de vente sont écrites une seule fois (save + signaux post_save)
+                # Le numéro de sortie est attribué par StockExit.save (api/sequences.py)
+                stock_exit = StockExit.objects.create(
+                    customer=customer,
+                    customer_name=serializer.validated_data.get('customer_name', ''),
+                    warehouse=warehouse,
+                    account=account,  # Ajout du compte
+                    notes=serializer.validated_data.get('notes', ''),
+                    created_by=self.request.user,
+                    total_amount=total_amount
+                )
+                
+                # Créer les items en une seule requête (le stock est déjà retiré)
+                StockExitItem.objects.bulk_create([
+                    StockExitItem(
                         stock_exit=stock_exit,
                         product=product,
                         quantity=quantity,
                         sale_price=sale_price,
                         total_price=quantity * sale_price
                     )
-                except (ValueError, ProductStock.DoesNotExist) as e:
-                    # Supprimer le bon de sortie créé en cas d'erreur
-                    stock_exit.delete()
-                    return Response(
-                        {
-                            'error': 'Erreur de stock',
-                            'details': str(e),
-                            'product': product.reference,
-                            'product_name': product.name
-                        },
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                except ProductStock.DoesNotExist:
-                    # Supprimer le bon de sortie créé en cas d'erreur
-                    stock_exit.delete()
-                    return Response(
-                        {
-                            'error': 'Stock non disponible',
-                            'details': f'Aucun stock disponible pour le produit {product.reference} dans l\'entrepôt {warehouse.name}',
-                            'product': product.reference,
-                            'warehouse': warehouse.name
-                        },
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                
-                total_amount += quantity * sale_price
-            
-            # Mettre à jour le montant total
-            stock_exit.total_amount = total_amount
-            stock_exit.save()
-            
-            return Response(StockExitSerializer(stock_exit).data, status=status.HTTP_201_CREATED)
+                    for product, quantity, sale_price in lines
+                ])
+        except ValueError as e:
+            return Response(
+                {
+                    'error': 'Erreur de stock',
+                    'details': str(e)
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        stock_exit = StockExit.objects.select_related(
+            'customer', 'warehouse', 'account', 'created_by'
+        ).prefetch_related(
+            Prefetch('items', queryset=StockExitItem.objects.select_related('product'))
+        ).get(pk=stock_exit.pk)
+        return Response(StockExitSerializer(stock_exit).data, status=status.HTTP_201_CREATED)
 
 
 @api_view(['GET'])
@@ -795,51 +860,8 @@ def stock_stats(request):
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        # Calculer les statistiques
-        products_count = Product.objects.filter(store=store).count()
-        entries_count = StockEntry.objects.filter(
-            warehouse__store=store
-        ).count()
-        exits_count = StockExit.objects.filter(
-            warehouse__store=store
-        ).count()
-        
-        # Calculer la valeur totale du stock
-        total_stock_value = 0
-        products = Product.objects.filter(store=store)
-        
-        for product in products:
-            # Calculer le stock actuel
-            entries = StockEntryItem.objects.filter(product=product).aggregate(
-                total=Sum('quantity'))['total'] or 0
-            exits = StockExitItem.objects.filter(product=product).aggregate(
-                total=Sum('quantity'))['total'] or 0
-            current_stock = entries - exits
-            
-            # Obtenir le dernier prix d'achat
-            last_entry = StockEntryItem.objects.filter(product=product).order_by('-id').first()
-            if last_entry and current_stock > 0:
-                total_stock_value += float(last_entry.purchase_price) * current_stock
-        
-        # Produits en rupture de stock
-        low_stock_count = 0
-        for product in products:
-            entries = StockEntryItem.objects.filter(product=product).aggregate(
-                total=Sum('quantity'))['total'] or 0
-            exits = StockExitItem.objects.filter(product=product).aggregate(
-                total=Sum('quantity'))['total'] or 0
-            current_stock = entries - exits
-            
-            if current_stock <= product.min_stock_alert:
-                low_stock_count += 1
-        
-        return Response({
-            'products_count': products_count,
-            'entries_count': entries_count,
-            'exits_count': exits_count,
-            'total_stock_value': total_stock_value,
-            'low_stock_count': low_stock_count
-        })
+        # Calculer les statistiques (nombre de requêtes constant)
+        return Response(compute_stock_stats(store))
         
     except Exception as e:
         logger.error(f"Erreur lors du calcul des statistiques: {str(e)}")
@@ -865,58 +887,54 @@ class AccountViewSet(viewsets.ModelViewSet, StoreContextMixin):
     
     @action(detail=False, methods=['get'], url_path='active')
     def active_accounts(self, request):
-        """Retourne seulement les comptes actifs pour les sélecteurs"""
-        queryset = self.get_queryset().filter(is_active=True)
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        """
+        Retourne seulement les comptes actifs pour les sélecteurs. Les comptes sont en cache par store ;
+        les soldes, modifiés à chaque transaction, sont relus en base (une requête) à chaque appel
+        """
+        from .cache import cached_reference
+        
+        def build():
+            queryset = self.get_queryset().filter(is_active=True)
+            return self.get_serializer(queryset, many=True).data
+        
+        accounts = cached_reference(self.store_id, 'active-accounts', build, depends=('accounts',))
+        balances = dict(
+            self.get_queryset().filter(pk__in=[account['id'] for account in accounts]).values_list('id', 'balance')
+        )
+        balance_field = self.get_serializer().fields['balance']
+        data = [
+            {**account, 'balance': balance_field.to_representation(balances[account['id']])}
+            for account in accounts if account['id'] in balances
+        ]
+        return Response(data)
     
     @action(detail=True, methods=['get'], url_path='transactions')
     def account_transactions(self, request, pk=None):
-        """Retourne l'historique des transactions d'un compte"""
+        """
+        Relevé du compte : mouvements signés avec solde après chaque mouvement,
+        soldes d'ouverture/clôture (date_from, date_to) et pagination par curseur (cursor, page_size)
+        """
+        from .statements import account_statement, InvalidCursor
+        
         account = self.get_object()
-        from .models import FinancialTransaction
-        
-        # Récupérer toutes les transactions entrantes et sortantes
-        incoming = FinancialTransaction.objects.filter(to_account=account)
-        outgoing = FinancialTransaction.objects.filter(from_account=account)
-        
-        # Combiner et ordonner par date
-        all_transactions = incoming.union(outgoing).order_by('-created_at')
-        
-        # Paginer les résultats
-        page = int(request.query_params.get('page', 1))
-        page_size = int(request.query_params.get('page_size', 20))
-        
-        from django.core.paginator import Paginator
-        paginator = Paginator(all_transactions, page_size)
-        page_obj = paginator.get_page(page)
-        
-        # Formater les données
-        transactions_data = []
-        for transaction in page_obj:
-            movement_type = 'credit' if transaction.to_account == account else 'debit'
-            transactions_data.append({
-                'id': transaction.id,
-                'transaction_number': transaction.transaction_number,
-                'transaction_type': transaction.transaction_type,
-                'transaction_type_display': transaction.get_transaction_type_display(),
-                'amount': str(transaction.amount),
-                'movement_type': movement_type,
-                'description': transaction.description,
-                'from_account_name': transaction.from_account.name if transaction.from_account else None,
-                'to_account_name': transaction.to_account.name if transaction.to_account else None,
-                'stock_exit_number': transaction.stock_exit.exit_number if transaction.stock_exit else None,
-                'stock_entry_number': transaction.stock_entry.entry_number if transaction.stock_entry else None,
-                'created_by_name': transaction.created_by.fullname,
-                'created_at': transaction.created_at.isoformat(),
-            })
         
-        return Response({
-            'count': paginator.count,
-            'next': page_obj.has_next(),
-            'previous': page_obj.has_previous(),
-            'results': transactions_data
-        })
+        try:
+            page_size = min(max(int(request.query_params.get('page_size', 20)), 1), 100)
+        except ValueError:
+            page_size = 20
+        
+        try:
+            statement = account_statement(
+                account,
+                date_from=day_start(request.query_params.get('date_from', '')),
+                date_to=day_start(request.query_params.get('date_to', ''), days=1),
+                cursor=request.query_params.get('cursor'),
+                page_size=page_size
+            )
+        except InvalidCursor as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response(statement)
     
     def create(self, request, *args, **kwargs):
         """Créer un nouveau compte avec gestion d'erreurs"""
@@ -961,7 +979,7 @@ class AccountViewSet(viewsets.ModelViewSet, StoreContextMixin):
             )
 
 
-class InvoiceViewSet(viewsets.ModelViewSet, StoreContextMixin):
+class InvoiceViewSet(CursorPaginationMixin, viewsets.ModelViewSet, StoreContextMixin):
     """ViewSet pour la gestion des factures"""
     serializer_class = InvoiceSerializer
     permission_classes = [IsAuthenticated]
@@ -971,16 +989,14 @@ class InvoiceViewSet(viewsets.ModelViewSet, StoreContextMixin):
     
     def get_queryset(self):
         queryset = Invoice.objects.select_related(
-            'stock_exit', 'stock_exit__warehouse', 'customer'
-        ).prefetch_related('stock_exit__items__product')
+            'stock_exit', 'stock_exit__warehouse__store', 'customer'
+        ).prefetch_related(
+            # Articles et produits en une seule requête (jointure) pour toute la page
+            Prefetch('stock_exit__items', queryset=StockExitItem.objects.select_related('product'))
+        )
         
-        # Filtrer par store via le stock_exit -> warehouse -> store
-        if self.store:
-            queryset = queryset.filter(stock_exit__warehouse__store=self.store)
-        else:
-            queryset = queryset.none()
-            
-        return queryset.order_by('-created_at')
+        # Filtrer par store (colonne dénormalisée, sans jointure)
+        return self.get_store_queryset(queryset).order_by('-created_at')
     
     @action(detail=True, methods=['get'], url_path='print-data')
     def print_data(self, request, pk=None):
@@ -1030,65 +1046,31 @@ class InvoiceViewSet(viewsets.ModelViewSet, StoreContextMixin):
     
     @action(detail=True, methods=['get'], url_path='download-pdf')
     def download_pdf(self, request, pk=None):
-        """Génère et retourne le PDF de la facture"""
-        invoice = self.get_object()
-        
-        # Préparer le contexte pour le template
-        context = {
-            'invoice': invoice,
-            'store': {
-                'name': invoice.stock_exit.warehouse.store.name,
-                'address': invoice.stock_exit.warehouse.store.description or 'Adresse non renseignée',
-                'phone': 'Téléphone non renseigné',  # Vous pouvez ajouter ce champ au modèle Store
-                'email': 'Email non renseigné',    # Vous pouvez ajouter ce champ au modèle Store
-            },
-            'customer': {
-                'name': invoice.customer.name if invoice.customer else invoice.customer_name,
-                'phone': invoice.customer.phone if invoice.customer else 'Non renseigné',
-                'email': invoice.customer.email if invoice.customer else 'Non renseigné',
-                'address': invoice.customer.address if invoice.customer else 'Non renseignée',
-            },
-            'items': []
-        }
-        
-        # Préparer les articles
-        for item in invoice.stock_exit.items.all():
-            context['items'].append({
-                'product': {
-                    'name': item.product.name,
-                    'barcode': item.product.reference
-                },
-                'quantity': item.quantity,
-                'unit_price': item.sale_price,
-                'total_amount': item.total_price
-            })
-        
-        # Calculer les totaux
-        subtotal = sum(float(item['total_amount']) for item in context['items'])
-        tax_rate = 0.18  # TVA 18%
-        tax_amount = subtotal * tax_rate
-        total_amount = subtotal + tax_amount
-        
-        context.update({
-            'subtotal': subtotal,
-            'tax_amount': tax_amount,
-            'total_amount': total_amount,
-        })
+        """Retourne le PDF de la facture (rendu une seule fois puis servi depuis le cache disque)"""
+        from django.http import FileResponse
+        from .exports import cached_invoice_pdf, invoice_filename
         
-        # Rendre le template HTML
-        html_string = render_to_string('invoice_pdf.html', context)
-        
-        # Générer le PDF avec WeasyPrint
-        html = HTML(string=html_string)
-        pdf_buffer = io.BytesIO()
-        html.write_pdf(pdf_buffer)
-        pdf_buffer.seek(0)
-        
-        # Créer la réponse HTTP avec le PDF
-        response = HttpResponse(pdf_buffer.getvalue(), content_type='application/pdf')
-        response['Content-Disposition'] = f'attachment; filename="facture_{invoice.invoice_number}.pdf"'
-        
-        return response
+        invoice = self.get_object()
+        return FileResponse(
+            cached_invoice_pdf(invoice),
+            as_attachment=True,
+            filename=invoice_filename(invoice),
+            content_type='application/pdf'
+        )
+    
+    @action(detail=False, methods=['post'], url_path='batch-pdf')
+    def batch_pdf(self, request):
+        """
+        Met en file l'impression d'un lot de factures (invoice_ids ou date_from/date_to,
+        format 'zip' ou 'pdf'), à suivre et télécharger via /export-jobs/
+        """
+        serializer = ExportJobSerializer(
+            data={'kind': 'invoice_batch', 'params': request.data},
+            context={**self.get_serializer_context(), 'store': self.store}
+        )
+        serializer.is_valid(raise_exception=True)
+        serializer.save(store=self.store, created_by=request.user)
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
     
     def create(self, request, *args, **kwargs):
         return Response(
@@ -1109,7 +1091,7 @@ class InvoiceViewSet(viewsets.ModelViewSet, StoreContextMixin):
         )
 
 
-class FinancialTransactionViewSet(viewsets.ModelViewSet, StoreContextMixin):
+class FinancialTransactionViewSet(CursorPaginationMixin, viewsets.ModelViewSet, StoreContextMixin):
     """
     ViewSet pour la gestion des transactions financières
     """
@@ -1128,29 +1110,13 @@ class FinancialTransactionViewSet(viewsets.ModelViewSet, StoreContextMixin):
         """
         user = self.request.user
         
-        # Utiliser une seule requête avec Q objects au lieu d'union
+        # Boutique dénormalisée sur la transaction : parcours de l'index (store, created_at)
         queryset = FinancialTransaction.objects.select_related(
             'from_account', 'to_account', 'created_by', 'stock_entry', 'stock_exit'
-        ).filter(
-            Q(from_account__store=user.store) | Q(to_account__store=user.store)
-        ).distinct().order_by('-created_at')
+        ).filter(store=user.store).order_by('-created_at')
 
-        # Filtres personnalisés
-        account_id = self.request.query_params.get('account_id')
-        if account_id:
-            queryset = queryset.filter(
-                Q(from_account_id=account_id) | Q(to_account_id=account_id)
-            )
-
-        date_from = self.request.query_params.get('date_from')
-        if date_from:
-            queryset = queryset.filter(created_at__date__gte=date_from)
-
-        date_to = self.request.query_params.get('date_to')
-        if date_to:
-            queryset = queryset.filter(created_at__date__lte=date_to)
-
-        return queryset
+        # Filtres personnalisés (account_id, date_from, date_to)
+        return filter_transactions(queryset, self.request.query_params)
 
     def perform_create(self, serializer):
         """
@@ -1161,33 +1127,17 @@ class FinancialTransactionViewSet(viewsets.ModelViewSet, StoreContextMixin):
     @action(detail=False, methods=['get'])
     def stats(self, request):
         """
-        Retourne les statistiques des transactions
+        Retourne les statistiques des transactions (une seule requête groupée).
+        Filtres : date_from, date_to, account_id ; découpage : bucket=day|week|month
         """
-        queryset = self.get_queryset()
-        
-        # Calculs des totaux
-        sales = queryset.filter(transaction_type='sale')
-        purchases = queryset.filter(transaction_type='purchase')
-        transfers_in = queryset.filter(transaction_type='transfer_in')
-        transfers_out = queryset.filter(transaction_type='transfer_out')
-        
-        total_sales = sales.aggregate(total=Sum('amount'))['total'] or 0
-        total_purchases = purchases.aggregate(total=Sum('amount'))['total'] or 0
-        total_transfers_in = transfers_in.aggregate(total=Sum('amount'))['total'] or 0
-        total_transfers_out = transfers_out.aggregate(total=Sum('amount'))['total'] or 0
+        bucket = request.query_params.get('bucket')
+        if bucket and bucket not in TRANSACTION_STATS_BUCKETS:
+            return Response(
+                {'error': f"Découpage invalide, valeurs possibles: {', '.join(TRANSACTION_STATS_BUCKETS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        return Response({
-            'total_transactions': queryset.count(),
-            'total_sales': total_sales,
-            'total_purchases': total_purchases,
-            'total_transfers_in': total_transfers_in,
-            'total_transfers_out': total_transfers_out,
-            'net_balance': (total_sales + total_transfers_in) - (total_purchases + total_transfers_out),
-            'sales_count': sales.count(),
-            'purchases_count': purchases.count(),
-            'transfers_in_count': transfers_in.count(),
-            'transfers_out_count': transfers_out.count(),
-        })
+        return Response(compute_transaction_stats(self.get_queryset(), bucket))
 
     @action(detail=False, methods=['post'])
     def create_service_payment(self, request):
@@ -1272,145 +1222,42 @@ class FinancialTransactionViewSet(viewsets.ModelViewSet, StoreContextMixin):
     @action(detail=False, methods=['get'])
     def export(self, request):
         """
-        Exporter les transactions en format Excel
+        Exporter les transactions en format Excel (filtres account_id, date_from, date_to de get_queryset).
+        Le fichier est écrit ligne à ligne et envoyé par morceaux : mémoire bornée quel que soit le volume.
         """
-        account_id = request.query_params.get('account_id')
-        date_from = request.query_params.get('date_from')
-        date_to = request.query_params.get('date_to')
-
-        # Récupérer les transactions en fonction des paramètres
-        transactions = self.get_queryset()
-
-        if account_id:
-            transactions = transactions.filter(
-                Q(from_account_id=account_id) | Q(to_account_id=account_id)
-            )
-        if date_from:
-            transactions = transactions.filter(created_at__date__gte=date_from)
-        if date_to:
-            transactions = transactions.filter(created_at__date__lte=date_to)
-
-        # Créer le fichier Excel
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Transactions"
-
-        # Ajouter les en-têtes de colonnes
-        headers = [
-            "ID de Transaction", "Numéro de Transaction", "Montant", "Description", 
-            "Type de Transaction", "Compte Source", "Compte Cible", "Créé Par", "Créé Le"
-        ]
-
-        ws.append(headers)
-
-        # Ajouter les données des transactions
-        for transaction in transactions:
-            row = [
-                transaction.id,
-                transaction.transaction_number,
-                transaction.amount,
-                transaction.description,
-                transaction.get_transaction_type_display(),  # Affichage du type de transaction
-                transaction.from_account.name if transaction.from_account else '',
-                transaction.to_account.name if transaction.to_account else '',
-                transaction.created_by.fullname,
-                transaction.created_at.replace(tzinfo=None),
-            ]
-            ws.append(row)
-
-        # Ajuster la largeur des colonnes
-        for col in range(1, len(headers) + 1):
-            column = get_column_letter(col)
-            max_length = 0
-            for row in ws.iter_rows():
-                for cell in row:
-                    try:
-                        if len(str(cell.value)) > max_length:
-                            max_length = len(cell.value)
-                    except:
-                        pass
-            adjusted_width = (max_length + 2)
-            ws.column_dimensions[column].width = adjusted_width
-
-        # Créer une réponse HTTP avec le fichier Excel
-        response = HttpResponse(content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-        response["Content-Disposition"] = "attachment; filename=transactions_export.xlsx"
-
-        # Enregistrer le fichier dans la réponse
-        wb.save(response)
-        return response
+        from .exports import TRANSACTION_HEADERS, transaction_rows, xlsx_response
+        
+        return xlsx_response(
+            TRANSACTION_HEADERS,
+            transaction_rows(self.get_queryset()),
+            filename="transactions_export.xlsx"
+        )
 
     # Export des transactions au format PDF
     @action(detail=False, methods=['get'])
     def export_pdf(self, request):
         """
-        Exporter les transactions en format PDF
+        Exporter les transactions en format PDF (?summary=true : synthèse sans la liste)
+        (pour les gros volumes, préférer un export différé : POST /export-jobs/ kind=transactions_pdf)
         """
-        account_id = request.query_params.get('account_id')
-        date_from = request.query_params.get('date_from')
-        date_to = request.query_params.get('date_to')
-
-        # Récupérer les transactions en fonction des paramètres
-        transactions = self.get_queryset()
-
-        if account_id:
-            transactions = transactions.filter(
-                Q(from_account_id=account_id) | Q(to_account_id=account_id)
-            )
-        if date_from:
-            transactions = transactions.filter(created_at__date__gte=date_from)
-        if date_to:
-            transactions = transactions.filter(created_at__date__lte=date_to)
-
-        # Récupérer les informations du store
-        store = request.user.store
-
-        # Calculer les statistiques
-        total_entrees = transactions.filter(
-            transaction_type__in=['purchase', 'service', 'transfer']
-        ).aggregate(total=Sum('amount'))['total'] or 0
-
-        total_sorties = transactions.filter(
-            transaction_type__in=['sale', 'expense']
-        ).aggregate(total=Sum('amount'))['total'] or 0
-
-        solde_net = total_entrees - total_sorties
-
-        # Préparer le contexte pour le template
-        context = {
-            'transactions': transactions,
-            'store': store,
-            'total_entrees': total_entrees,
-            'total_sorties': total_sorties,
-            'solde_net': solde_net,
-            'date_from': date_from,
-            'date_to': date_to,
-            'account_name': '',
-        }
-
-        # Si un compte spécifique est sélectionné, récupérer son nom
-        if account_id:
-            try:
-                account = Account.objects.get(id=account_id, store=store)
-                context['account_name'] = account.name
-            except Account.DoesNotExist:
-                pass
-
-        # Rendre le template HTML
-        html_string = render_to_string('transactions_pdf.html', context)
-        
-        # Générer le PDF
-        html_doc = HTML(string=html_string)
-        pdf_bytes = html_doc.write_pdf()
-
-        # Créer la réponse HTTP
-        response = HttpResponse(pdf_bytes, content_type='application/pdf')
-        response['Content-Disposition'] = 'attachment; filename="rapport_transactions.pdf"'
-        
-        return response
+        import tempfile
+        from django.http import FileResponse
+        from .exports import transactions_pdf_filename, write_transactions_pdf
+        
+        # Transactions filtrées (account_id, date_from, date_to), rendues par paquets dans un fichier temporaire
+        tmp = tempfile.TemporaryFile()
+        write_transactions_pdf(tmp, self.get_queryset(), request.user.store, request.query_params)
+        tmp.seek(0)
+        
+        return FileResponse(
+            tmp,
+            as_attachment=True,
+            filename=transactions_pdf_filename(request.query_params),
+            content_type='application/pdf'
+        )
 
 # 🔄 VIEWSET POUR LES TRANSFERTS DE STOCK
-class StockTransferViewSet(viewsets.ModelViewSet):
+class StockTransferViewSet(CursorPaginationMixin, viewsets.ModelViewSet):
     """
     ViewSet pour la gestion des transferts de stock
     """
@@ -1420,7 +1267,7 @@ class StockTransferViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         user = self.request.user
         queryset = StockTransfer.objects.filter(
-            from_warehouse__store=user.store
+            store=user.store
         ).select_related('from_warehouse', 'to_warehouse', 'created_by').prefetch_related('items__product')
         
         # Filtrage par statut
@@ -1541,4 +1388,49 @@ class StockTransferViewSet(viewsets.ModelViewSet):
             })
             
         except Exception as e:
-            return Response({'error': f'Erreur lors de l\'annulation: {str(e)}'}, status=500)
\ No newline at end of file
+            return Response({'error': f'Erreur lors de l\'annulation: {str(e)}'}, status=500)
+
+
+# 📄 VIEWSET POUR LES EXPORTS DIFFÉRÉS
+class ExportJobViewSet(mixins.CreateModelMixin, viewsets.ReadOnlyModelViewSet, StoreContextMixin):
+    """
+    Exports rendus en arrière-plan par `manage.py run_export_worker` :
+    POST pour mettre en file, GET pour suivre le statut, /download/ pour récupérer le fichier
+    """
+    serializer_class = ExportJobSerializer
+    permission_classes = [IsAuthenticated]
+    
+    def get_queryset(self):
+        return self.get_store_queryset(
+            ExportJob.objects.filter(kind__in=ExportJob.USER_KINDS)
+        ).order_by('-created_at')
+    
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['store'] = self.store
+        return context
+    
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save(store=self.store, created_by=request.user)
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+    
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        """Télécharge le fichier d'un export terminé"""
+        from django.http import FileResponse
+        from .exports import export_path
+        
+        job = self.get_object()
+        if job.status != 'done':
+            return Response(
+                {'error': 'Export non disponible', 'status': job.status, 'details': job.error},
+                status=status.HTTP_409_CONFLICT
+            )
+        
+        try:
+            fileobj = open(export_path(job), 'rb')
+        except FileNotFoundError:
+            return Response({'error': 'Fichier expiré ou supprimé'}, status=status.HTTP_410_GONE)
+        return FileResponse(fileobj, as_attachment=True, filename=job.filename)